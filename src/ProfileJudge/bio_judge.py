@@ -5,6 +5,8 @@ from tinder_user import TinderUser
 
 
 class BioJudge(VoteLoggerMixin):
+    MIN_NR_WORDS = 4  # Check for at least four different words in the bio
+
     def vote(self, user: TinderUser) -> Vote:
         """
         Check for the presence of a bio
@@ -17,13 +19,17 @@ class BioJudge(VoteLoggerMixin):
 
         bio = user.bio
         if self._bio_is_present(bio):
-            return self._vote(f'Bio: {bio}', Vote.approve, 'Bio is present')
+            return self._vote('Bio: %s', Vote.approve, 'Bio is present', bio)
         else:
-            return self._vote(f'Bio: {bio}', Vote.reject, 'Bio is absent')
+            return self._vote('Bio: %s', Vote.reject, 'Bio is absent', bio)
 
     def _bio_is_present(self, bio: str) -> bool:
+        return self.count_words(bio) >= self.MIN_NR_WORDS
+
+    @staticmethod
+    def count_words(bio: str) -> int:
         bio = bio.encode('ascii', 'ignore').decode()  # Remove all non-ASCII characters, like emojis
-        return len(bio.split(' ')) >= 4  # Check for at least four different words in the bio
+        return len(bio.split(' '))
 
 
 if __name__ == '__main__':
@@ -10,15 +10,15 @@ class DistanceJudge(VoteLoggerMixin):
 
     def vote(self, user: TinderUser) -> Vote:
         # Check for distance in km
-        info = f'Distance = {user.distance} km'
         if user.distance < self.DISTANCE_TO_REVIEW:
             # If less than 20 km, I want to check them out manually
-            return self._vote(info, Vote.review, 'Inside Amsterdam')
+            return self._vote('Distance = %d km', Vote.review, 'Inside Amsterdam', user.distance)
         elif user.distance > self.DISTANCE_TO_REJECT:
             # If outside The Netherlands, automatic reject
-            return self._vote(info, Vote.reject, 'Outside The Netherlands')
+            return self._vote('Distance = %d km', Vote.reject, 'Outside The Netherlands', user.distance)
         else:
-            return self._vote(info, Vote.approve, 'Inside The Netherlands, but outside Amsterdam')
+            return self._vote('Distance = %d km', Vote.approve, 'Inside The Netherlands, but outside Amsterdam',
+                              user.distance)
 
 
 if __name__ == '__main__':
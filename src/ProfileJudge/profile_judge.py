@@ -1,3 +1,8 @@
+import hashlib
+from typing import List, Tuple
+
+import numpy as np
+
 from ProfileJudge.bio_judge import BioJudge
 from ProfileJudge.distance_judge import DistanceJudge
 from ProfileJudge.name_judge import NameJudge
@@ -5,20 +10,47 @@ from ProfileJudge.school_judge import SchoolJudge
 from ProfileJudge.vote import Vote
 from enums import SwipeAction
 from logger import Logger
+from metrics import Metrics
 from tinder_user import TinderUser
 
+VOTE_CODES = {vote: code for code, vote in enumerate(Vote)}  # Vote as a small integer, for use in NumPy arrays
+
 
 class ProfileJudge:
     """
     Class responsible for determining the swipe action for a given user
     """
 
+    # Swipe actions with their reasons, in the order in which they are checked
+    NAME_MATCH = (SwipeAction.like, 'Name match.')
+    NAME_MISMATCH = (SwipeAction.nope, 'Name mismatch.')
+    TOO_FAR_AWAY = (SwipeAction.nope, 'Too far away.')
+    TOO_CLOSE = (SwipeAction.no_action, 'Too close to automate.')
+    NO_BIO = (SwipeAction.nope, 'No bio present.')
+    GOOD_SCHOOL = (SwipeAction.like, 'Good school found.')
+    NO_GOOD_SCHOOL = (SwipeAction.nope, 'No good school found.')
+    NO_SCHOOL = (SwipeAction.nope, 'No school found.')
+    UNKNOWN_SCHOOL = (SwipeAction.no_action, 'Unknown school found.')
+
     def __init__(self):
         self.name_judge = NameJudge()
         self.distance_judge = DistanceJudge()
         self.bio_judge = BioJudge()
         self.school_judge = SchoolJudge()
 
+    @property
+    def word_list_version(self) -> str:
+        """
+        Version of the word lists of all judges: a user judged under the same version gets the same verdict
+
+        The word files are checked for changes first, such that the version is that of the next judgement.
+        """
+
+        for judge in (self.name_judge, self.school_judge):
+            judge.refresh_word_lists()
+        versions = [self.name_judge.word_list_version, self.school_judge.word_list_version]
+        return hashlib.sha1(':'.join(versions).encode()).hexdigest()[:16]
+
     def like_or_nope(self, user: TinderUser) -> SwipeAction:
         """
         Determine the SwipeAction for the given user, based on votes from different judges
@@ -26,40 +58,111 @@ class ProfileJudge:
         # TODO: Check for work
         """
 
-        Logger.log(f'Judging {user}', level=1)
+        Logger.log('Judging %s', user, level=1, user_id=user.id)
 
         # First, check on name. This can lead to an instant like
         name_vote = self.name_judge.vote(user)
         if name_vote == Vote.approve:
-            return self._action(SwipeAction.like, 'Name match.')
+            return self._action(*self.NAME_MATCH)
         elif name_vote == Vote.reject:
-            return self._action(SwipeAction.nope, 'Name mismatch.')
+            return self._action(*self.NAME_MISMATCH)
 
         # Then check for distance, this can determine the action regardless of the other votes
         distance_vote = self.distance_judge.vote(user)
         if distance_vote == Vote.reject:
-            return self._action(SwipeAction.nope, 'Too far away.')
+            return self._action(*self.TOO_FAR_AWAY)
         elif distance_vote == Vote.review:
-            return self._action(SwipeAction.no_action, 'Too close to automate.')
+            return self._action(*self.TOO_CLOSE)
 
         # Then check for bio
         bio_vote = self.bio_judge.vote(user)
         if bio_vote == Vote.reject:
-            return self._action(SwipeAction.nope, 'No bio present.')
+            return self._action(*self.NO_BIO)
 
         # Then check for schools
         school_vote = self.school_judge.vote(user)
         if school_vote == Vote.approve:
-            return self._action(SwipeAction.like, 'Good school found.')
+            return self._action(*self.GOOD_SCHOOL)
         if school_vote == Vote.reject:
-            return self._action(SwipeAction.nope, 'No good school found.')
+            return self._action(*self.NO_GOOD_SCHOOL)
         elif school_vote == Vote.no_info:
-            return self._action(SwipeAction.nope, 'No school found.')
+            return self._action(*self.NO_SCHOOL)
         elif school_vote == Vote.review:
-            return self._action(SwipeAction.no_action, 'Unknown school found.')
+            return self._action(*self.UNKNOWN_SCHOOL)
+
+    def judge_many(self, users: List[TinderUser]) -> List[Tuple[SwipeAction, str]]:
+        """
+        Determine the SwipeAction and the deciding reason for each of the given users
+
+        The result is the same as calling like_or_nope for each user, but the distance and bio thresholds are
+        applied to columns of all users at once. Bios and schools are only judged for the users that are not
+        decided yet, as in like_or_nope, such that only those users add words for review.
+        """
+
+        if not users:
+            return []
+
+        name_votes = np.array([VOTE_CODES[vote] for vote in self.name_judge.judge_many([user.name for user in users])],
+                              dtype=np.int8)
+        distances = np.array([user.distance for user in users], dtype=np.int64)
+
+        name_approve = name_votes == VOTE_CODES[Vote.approve]
+        name_reject = name_votes == VOTE_CODES[Vote.reject]
+        too_close = distances < self.distance_judge.DISTANCE_TO_REVIEW
+        too_far = ~too_close & (distances > self.distance_judge.DISTANCE_TO_REJECT)
+        undecided = ~(name_approve | name_reject | too_far | too_close)
+
+        bio_nr_words = np.zeros(len(users), dtype=np.int64)
+        for index in np.flatnonzero(undecided):
+            bio_nr_words[index] = self.bio_judge.count_words(users[index].bio)
+        no_bio = undecided & (bio_nr_words < self.bio_judge.MIN_NR_WORDS)
+        undecided &= ~no_bio
+
+        school_votes = np.full(len(users), -1, dtype=np.int8)
+        for index in np.flatnonzero(undecided):
+            school_votes[index] = VOTE_CODES[self.school_judge.vote(users[index])]
+
+        # The order of the conditions is the order of the checks in like_or_nope
+        rules = [
+            (name_approve, self.NAME_MATCH),
+            (name_reject, self.NAME_MISMATCH),
+            (too_far, self.TOO_FAR_AWAY),
+            (too_close, self.TOO_CLOSE),
+            (no_bio, self.NO_BIO),
+            (school_votes == VOTE_CODES[Vote.approve], self.GOOD_SCHOOL),
+            (school_votes == VOTE_CODES[Vote.reject], self.NO_GOOD_SCHOOL),
+            (school_votes == VOTE_CODES[Vote.no_info], self.NO_SCHOOL),
+            (school_votes == VOTE_CODES[Vote.review], self.UNKNOWN_SCHOOL),
+        ]
+        decisions = np.select([condition for condition, _ in rules], np.arange(len(rules)), default=-1)
+        results = [rules[decision][1] for decision in decisions]
+        if Metrics.enabled:
+            for action, reason in results:
+                Metrics.count('judge_decisions_total', action=action.value, reason=reason)
+
+        if Logger.is_enabled(1):
+            counts = ', '.join(f'{action.value} = {sum(result[0] == action for result in results)}'
+                               for action in SwipeAction)
+            Logger.log('Judged %d users: %s', len(users), counts, level=1)
+        return results
+
+    def flush(self):
+        """
+        Write all pending review words and the verdict caches of the word judges to disk
+        """
+
+        for judge in (self.name_judge, self.school_judge):
+            judge.flush_review_words(compact=True)
+            judge.save_verdict_cache()
+            Logger.log('%s verdict cache: %d hits, %d misses', judge.FIELD_NAME.capitalize(), judge.verdict_cache_hits,
+                       judge.verdict_cache_misses, level=1, field=judge.FIELD_NAME,
+                       hit_rate=judge.verdict_cache_hit_rate)
 
     def _action(self, action: SwipeAction, reason: str):
-        Logger.log(f'Action: {action.value}. Reason: {reason}', level=1)
+        if Logger.is_enabled(1):
+            Logger.log('Action: %s. Reason: %s', action.value, reason, level=1, action=action.value, reason=reason)
+        if Metrics.enabled:
+            Metrics.count('judge_decisions_total', action=action.value, reason=reason)
         return action
 
 
@@ -27,15 +27,15 @@ class SchoolJudge(VoteLoggerMixin, WordJudge):
         """
 
         votes = [self._get_vote_for_school(school) for school in user.schools]
-        schools_str = 'Schools = ' + ', '.join(school['name'] for school in user.schools)
+        schools_str = ', '.join(school['name'] for school in user.schools)
         if Vote.approve in votes:
-            return self._vote(schools_str, Vote.approve, 'At least one approved')
+            return self._vote('Schools = %s', Vote.approve, 'At least one approved', schools_str)
         elif Vote.review in votes:
-            return self._vote(schools_str, Vote.review, 'At least one unknown')
+            return self._vote('Schools = %s', Vote.review, 'At least one unknown', schools_str)
         elif not votes:
-            return self._vote(schools_str, Vote.no_info, 'Empty list')
+            return self._vote('Schools = %s', Vote.no_info, 'Empty list', schools_str)
         else:
-            return self._vote(schools_str, Vote.reject, 'All rejected')
+            return self._vote('Schools = %s', Vote.reject, 'All rejected', schools_str)
 
     def _get_vote_for_school(self, school: SchoolDict) -> Vote:
         """
@@ -48,7 +48,7 @@ class SchoolJudge(VoteLoggerMixin, WordJudge):
         except KeyError:
             # Somehow, some schools don't have a name. Since we qualify all schools based on
             # their name, these schools are useless, and hence we automatically reject them.
-            Logger.log(f'School has no name: {school}', level=2)
+            Logger.log('School has no name: %s', school, level=2)
             return Vote.reject
 
         return self.judge_by_words(name)
@@ -1,8 +1,18 @@
+from typing import Any
+
 from ProfileJudge.vote import Vote
 from logger import Logger
 
 
 class VoteLoggerMixin:
-    def _vote(self, info: str, vote: Vote, reason: str):
-        Logger.log(f'{info}. Vote: {vote.value}. Reason: {reason}.', level=2)
+    def _vote(self, info: str, vote: Vote, reason: str, *info_args: Any):
+        """
+        Log the vote and return it
+
+        :param info: Description of the judged field, formatted with the info arguments only when it is logged
+        """
+
+        if Logger.is_enabled(2):
+            Logger.log(info + '. Vote: %s. Reason: %s.', *info_args, vote.value, reason, level=2,
+                       judge=type(self).__name__, vote=vote.value, reason=reason)
         return vote
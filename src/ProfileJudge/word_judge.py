@@ -1,21 +1,48 @@
+import atexit
+import hashlib
 import json
 import os.path
-import string
+import tempfile
+import threading
+import time
 from abc import ABC
-from typing import Set
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 
 import common
 from ProfileJudge.vote import Vote
+from ProfileJudge.word_matcher import WordMatcher, normalize
 from logger import Logger
+from metrics import Metrics
+
+try:
+    import fcntl
+except ImportError:
+    # Advisory file locks are not available on Windows, there we only lock between threads
+    fcntl = None
 
 
 class WordListMixin:
     # This field name needs to be set by the concrete implementations
     FIELD_NAME: str = None
 
+    REVIEW_FLUSH_SIZE = 20  # Number of new review words that are kept in memory before they are written
+    REVIEW_FLUSH_INTERVAL = 60  # Maximum number of seconds that new review words are kept in memory
+    REVIEW_COMPACT_SIZE = 500  # Number of words in the review log after which it is merged into the JSON file
+    WORD_LIST_CHECK_INTERVAL = 5  # Minimum number of seconds between two checks whether the word files changed
+
     _approve_words: Set[str] = None
     _reject_words: Set[str] = None
     _review_words: Set[str] = None
+    _pending_review_words: List[str] = None  # Review words that are not written to the review log yet
+    _nr_logged_review_words = 0  # Number of review words in the review log
+    _last_review_flush: float = None
+    _review_lock = threading.RLock()
+    _word_files_lock_depth = 0  # Number of nested _word_files_lock blocks of the thread that holds the lock
+    _word_list_version: str = None
+    _word_list_stamps: Dict[str, Optional[Tuple[int, int]]] = None  # Word file -> modification time and size
+    _next_word_list_check = 0.0
 
     @property
     def approve_words_file(self) -> str:
@@ -29,70 +56,393 @@ class WordListMixin:
     def review_words_file(self) -> str:
         return os.path.join(common.get_dir('json'), f'{self.FIELD_NAME}_review_words.json')
 
+    @property
+    def review_words_log_file(self) -> str:
+        """
+        Append-only log of review words that are not yet merged into the review words file
+        """
+
+        return os.path.splitext(self.review_words_file)[0] + '.log'
+
+    @property
+    def word_files_lock_file(self) -> str:
+        return os.path.join(os.path.dirname(self.review_words_file), f'{self.FIELD_NAME}_words.lock')
+
     @property
     def approve_words(self):
-        if self._approve_words is None:
-            self._approve_words = self._read_file(self.approve_words_file)
-        return self._approve_words
+        approve_words = self._approve_words
+        if approve_words is None:
+            # Judges shared by several bots are used from several threads and processes, which must not rewrite
+            # a file at once
+            with self._word_files_lock():
+                if self._approve_words is None:
+                    self._approve_words = self._read_file(self.approve_words_file)
+                approve_words = self._approve_words
+        return approve_words
 
     @property
     def reject_words(self):
-        if self._reject_words is None:
-            self._reject_words = self._read_file(self.reject_words_file)
-        return self._reject_words
+        reject_words = self._reject_words
+        if reject_words is None:
+            with self._word_files_lock():
+                if self._reject_words is None:
+                    self._reject_words = self._read_file(self.reject_words_file)
+                reject_words = self._reject_words
+        return reject_words
+
+    @property
+    def word_list_version(self) -> str:
+        """
+        Hash of the approve and reject words, which changes whenever the words that decide a vote change
+
+        Review words are not included: they only grow with words that are neither approved nor rejected.
+        """
+
+        version = self._word_list_version
+        if version is None:
+            with self._review_lock:
+                if self._word_list_version is None:
+                    digest = hashlib.sha1()
+                    for words in (self.approve_words, self.reject_words):
+                        digest.update('\n'.join(sorted(words)).encode())
+                        digest.update(b'\0')
+                    self._word_list_version = digest.hexdigest()[:16]
+                version = self._word_list_version
+        return version
+
+    def refresh_word_lists(self) -> bool:
+        """
+        Forget the approve and reject words if any of the word files changed on disk, and return whether they did
+
+        The review words are read again, such that words that were removed from the review file are not written back.
+        The files are checked at most once per check interval, and only after the words have been read.
+        Judges are used from several threads, so the words are forgotten under the lock that loads them.
+        """
+
+        if self._word_list_stamps is None or time.monotonic() < self._next_word_list_check:
+            return False
+        with self._review_lock:
+            now = time.monotonic()
+            if self._word_list_stamps is None or now < self._next_word_list_check:
+                # Another thread checked in the meantime
+                return False
+            self._next_word_list_check = now + self.WORD_LIST_CHECK_INTERVAL
+            stamps = self._get_word_list_stamps()
+            if stamps == self._word_list_stamps:
+                return False
+
+            Logger.log('The %s word lists changed, reloading them', self.FIELD_NAME, level=1)
+            self._approve_words = None
+            self._reject_words = None
+            self._word_list_version = None
+            self._word_list_stamps = None
+            self._reload_review_words()
+            self._on_word_lists_changed()
+        return True
+
+    def _remember_word_list_stamps(self):
+        """
+        Remember the state of the word files, as the state in which the words were read
+        """
+
+        with self._word_files_lock():
+            self._ensure_exists(self.review_words_file)
+        self._word_list_stamps = self._get_word_list_stamps()
+        self._next_word_list_check = time.monotonic() + self.WORD_LIST_CHECK_INTERVAL
+
+    def _get_word_list_stamps(self) -> Dict[str, Optional[Tuple[int, int]]]:
+        stamps = dict()
+        for filepath in (self.approve_words_file, self.reject_words_file, self.review_words_file):
+            try:
+                stat = os.stat(filepath)
+                stamps[filepath] = (stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                stamps[filepath] = None
+        return stamps
+
+    def _on_word_lists_changed(self):
+        """
+        Called when the word files changed, to drop everything that was derived from the words
+        """
 
     @property
     def review_words(self):
         if self._review_words is None:
-            self._review_words = self._read_file(self.review_words_file)
+            with self._word_files_lock():
+                if self._review_words is not None:
+                    return self._review_words
+                review_words = self._read_file(self.review_words_file)
+                logged_words = self._read_review_log()
+                self._nr_logged_review_words = len(logged_words)
+                self._pending_review_words = list()
+                self._last_review_flush = time.monotonic()
+                self._review_words = review_words | set(logged_words)
+                atexit.register(self.flush_review_words, compact=True)
         return self._review_words
 
     def add_word_for_review(self, value: str):
-        if value not in self.review_words:
+        """
+        Add the word to the review words
+
+        New words are collected in memory, and appended to the review log in batches.
+        """
+
+        if value in self.review_words:
+            return
+
+        with self._review_lock:
             self._review_words.add(value)
-            with open(self.review_words_file, 'w') as f:
-                json.dump(sorted(self._review_words), f, indent=2)
+            self._pending_review_words.append(value)
+            if (len(self._pending_review_words) >= self.REVIEW_FLUSH_SIZE
+                    or time.monotonic() - self._last_review_flush >= self.REVIEW_FLUSH_INTERVAL):
+                self.flush_review_words()
+
+    def flush_review_words(self, compact: bool = False):
+        """
+        Append the pending review words to the review log
+
+        When the log has grown large, or when asked to compact, the log is merged into the sorted review words file.
+        This is also done at shutdown.
+        """
+
+        if self._review_words is None:
+            # Nothing has been read, so nothing has changed
+            return
+        if not self._pending_review_words and not self._nr_logged_review_words:
+            # Nothing to write, so the files do not need to be locked
+            return
+
+        with self._word_files_lock():
+            if self._pending_review_words:
+                with open(self.review_words_log_file, 'a') as f:
+                    f.writelines(json.dumps(word) + '\n' for word in self._pending_review_words)
+                self._nr_logged_review_words += len(self._pending_review_words)
+                self._pending_review_words = list()
+            self._last_review_flush = time.monotonic()
+
+            log_is_large = self._nr_logged_review_words >= self.REVIEW_COMPACT_SIZE
+            if self._nr_logged_review_words and (compact or log_is_large):
+                # Merge what is on disk, and not the words in memory: all new words are in the log, and words that
+                # were removed from the review file since it was read must not come back
+                self._review_words = self._read_file(self.review_words_file) | set(self._read_review_log())
+                self._write_file(self.review_words_file, self._review_words)
+                if self._word_list_stamps is not None:
+                    # This change of the review words file is our own, so it does not need a reload
+                    self._word_list_stamps[self.review_words_file] = \
+                        self._get_word_list_stamps()[self.review_words_file]
+                if os.path.exists(self.review_words_log_file):
+                    os.remove(self.review_words_log_file)
+                self._nr_logged_review_words = 0
+
+    def _reload_review_words(self):
+        if self._review_words is None:
+            return
+        with self._word_files_lock():
+            # Write the pending words first, such that they are read again from the log
+            self.flush_review_words()
+            logged_words = self._read_review_log()
+            self._nr_logged_review_words = len(logged_words)
+            self._review_words = self._read_file(self.review_words_file) | set(logged_words)
+
+    @contextmanager
+    def _word_files_lock(self) -> Iterator[None]:
+        """
+        Lock the word files of the field against other threads and processes, for reading and writing them
+
+        The lock can be taken again by the thread that holds it.
+        """
+
+        with self._review_lock:
+            if fcntl is None or self._word_files_lock_depth:
+                self._word_files_lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._word_files_lock_depth -= 1
+                return
+            # Lock a separate file, since the word files themselves are replaced on every write
+            with open(self.word_files_lock_file, 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._word_files_lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._word_files_lock_depth -= 1
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_review_log(self) -> List[str]:
+        if not os.path.exists(self.review_words_log_file):
+            return []
+        with open(self.review_words_log_file, 'r') as f:
+            return [json.loads(line) for line in f if line.strip()]
 
     def _read_file(self, filepath: str) -> Set[str]:
         self._ensure_exists(filepath)
         with open(filepath, 'r') as f:
-            result = set(json.load(f))
-        with open(filepath, 'w') as f:
+            contents = json.load(f)
+        result = set(contents)
+        if contents != sorted(result):
             # Perform maintenance on the file by sorting the contents alphabetically
-            json.dump(sorted(result), f, indent=2)
+            self._write_file(filepath, result)
         return result
 
+    @staticmethod
+    def _write_file(filepath: str, words: Set[str]):
+        # Write to a temporary file first, such that a crash never leaves a half written word list behind
+        directory, filename = os.path.split(filepath)
+        fd, tmp_filepath = tempfile.mkstemp(dir=directory, prefix=f'.{filename}', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(sorted(words), f, indent=2)
+            if os.path.exists(filepath):
+                # Keep the permissions of the file, instead of the private ones of a temporary file
+                os.chmod(tmp_filepath, os.stat(filepath).st_mode & 0o777)
+            os.replace(tmp_filepath, filepath)
+        except BaseException:
+            if os.path.exists(tmp_filepath):
+                os.remove(tmp_filepath)
+            raise
+
     def _ensure_exists(self, filepath: str) -> None:
         if not os.path.exists(filepath):
             # If there is a school file missing, generate it empty
-            with open(filepath, 'w') as f:
-                json.dump([], f)
+            try:
+                with open(filepath, 'x') as f:
+                    json.dump([], f)
+            except FileExistsError:
+                pass  # Created by another process in the meantime
 
 
 class WordJudge(WordListMixin, ABC):
     """
     Abstract base class that judges a specific field of the user's profiel based on individual words in it
+
+    The same values, school names in particular, occur in many profiles. The votes of the most recently judged
+    values are therefore kept in a least recently used cache, which is cleared when the word files change.
+    The cache can be persisted, such that it is warm after a restart; it is only used again for the same words.
     """
 
+    VERDICT_CACHE_SIZE = 10000  # Number of values of which the vote is cached, 0 disables the cache
+    PERSIST_VERDICT_CACHE = False  # Save the cache in the cache directory on flush, and read it on first use
+
+    _matcher: WordMatcher = None
+    _verdicts: 'OrderedDict[str, Vote]' = None  # Value -> vote, from least to most recently used
+    _verdict_lock = threading.Lock()
+    verdict_cache_hits = 0
+    verdict_cache_misses = 0
+
+    @property
+    def matcher(self) -> WordMatcher:
+        # A local reference, since another thread may forget the matcher when the word lists change
+        matcher = self._matcher
+        if matcher is None:
+            with self._review_lock:
+                if self._matcher is None:
+                    self._matcher = WordMatcher(self.approve_words, self.reject_words)
+                    self._remember_word_list_stamps()
+                matcher = self._matcher
+        return matcher
+
+    @property
+    def verdict_cache_file(self) -> str:
+        return os.path.join(common.get_dir('cache'), f'{self.FIELD_NAME}_verdicts.json')
+
+    @property
+    def verdict_cache_hit_rate(self) -> float:
+        nr_lookups = self.verdict_cache_hits + self.verdict_cache_misses
+        return self.verdict_cache_hits / nr_lookups if nr_lookups else 0.0
+
     def judge_by_words(self, name: str) -> Vote:
         assert self.FIELD_NAME is not None
 
-        clean_name = name.lower()
-        clean_name = ''.join(letter for letter in clean_name
-                             if letter in string.ascii_lowercase + string.digits + ' ')
-        words = clean_name.split(' ')
-        if any(word in self.approve_words for word in words):
+        self.refresh_word_lists()
+        vote = self._get_cached_vote(name)
+        if vote is not None:
+            if Logger.is_enabled(3):
+                Logger.log('Cached vote for %s %s: %s', self.FIELD_NAME, name, vote.value, level=3)
+            return vote
+
+        vote, review_words = self.matcher.match(name)
+        if vote == Vote.approve:
             # When any word is approved, we know it's a good school
-            Logger.log(f'At least one word in {self.FIELD_NAME} is approved: {name}', level=3)
-            return Vote.approve
-        elif all(word in self.reject_words for word in words):
+            Logger.log('At least one word in %s is approved: %s', self.FIELD_NAME, name, level=3)
+        elif vote == Vote.reject:
             # When all words are rejected, we know it's a bad school
-            Logger.log(f'All words in {self.FIELD_NAME} are rejected: {name}', level=3)
-            return Vote.reject
+            Logger.log('All words in %s are rejected: %s', self.FIELD_NAME, name, level=3)
         else:
             # In all other cases, we need to review the words and take no action
-            Logger.log(f'All words in {self.FIELD_NAME} are for review: {clean_name}', level=3)
-            for word in words:
-                if word not in self.reject_words:
-                    self.add_word_for_review(word)
-            return Vote.review
+            if Logger.is_enabled(3):
+                Logger.log('All words in %s are for review: %s', self.FIELD_NAME, normalize(name), level=3)
+            for word in review_words:
+                self.add_word_for_review(word)
+        self._cache_vote(name, vote)
+        return vote
+
+    def judge_many(self, names: List[str]) -> List[Vote]:
+        """
+        Return the vote for each of the given names
+        """
+
+        return [self.judge_by_words(name) for name in names]
+
+    def save_verdict_cache(self):
+        """
+        Write the cached votes to the cache directory, if the cache is persisted
+        """
+
+        if not self.PERSIST_VERDICT_CACHE or self._verdicts is None:
+            return
+        with self._verdict_lock:
+            contents = {'version': self.word_list_version,
+                        'verdicts': [[name, vote.value] for name, vote in self._verdicts.items()]}
+        # Write to a temporary file first, such that a crash never leaves a half written cache behind
+        tmp_filepath = self.verdict_cache_file + '.tmp'
+        with open(tmp_filepath, 'w') as f:
+            json.dump(contents, f)
+        os.replace(tmp_filepath, self.verdict_cache_file)
+
+    def _get_cached_vote(self, name: str) -> Optional[Vote]:
+        if not self.VERDICT_CACHE_SIZE:
+            return None
+        if self._verdicts is None:
+            # Reading a persisted cache requires the word lists, which are needed for judging anyway
+            self._verdicts = self._read_verdict_cache()
+        with self._verdict_lock:
+            vote = self._verdicts.get(name)
+            if vote is None:
+                self.verdict_cache_misses += 1
+            else:
+                self._verdicts.move_to_end(name)
+                self.verdict_cache_hits += 1
+        if Metrics.enabled:
+            Metrics.count('verdict_cache_lookups_total', field=self.FIELD_NAME,
+                          result='miss' if vote is None else 'hit')
+        return vote
+
+    def _cache_vote(self, name: str, vote: Vote):
+        if not self.VERDICT_CACHE_SIZE:
+            return
+        with self._verdict_lock:
+            self._verdicts[name] = vote
+            while len(self._verdicts) > self.VERDICT_CACHE_SIZE:
+                self._verdicts.popitem(last=False)
+
+    def _read_verdict_cache(self) -> 'OrderedDict[str, Vote]':
+        verdicts = OrderedDict()
+        if not self.PERSIST_VERDICT_CACHE or not os.path.exists(self.verdict_cache_file):
+            return verdicts
+        try:
+            with open(self.verdict_cache_file, 'r') as f:
+                contents = json.load(f)
+        except ValueError:
+            Logger.log('Ignoring the corrupt %s verdict cache', self.FIELD_NAME, level=1)
+            return verdicts
+        if contents.get('version') == self.word_list_version:
+            for name, vote in contents['verdicts'][-self.VERDICT_CACHE_SIZE:]:
+                verdicts[name] = Vote(vote)
+        return verdicts
+
+    def _on_word_lists_changed(self):
+        self._matcher = None
+        with self._verdict_lock:
+            self._verdicts = OrderedDict()
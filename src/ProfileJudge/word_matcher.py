@@ -0,0 +1,101 @@
+import string
+import unicodedata
+from typing import Dict, Iterable, List, Set, Tuple
+
+from ProfileJudge.vote import Vote
+
+ALLOWED_CHARACTERS = set(string.ascii_lowercase + string.digits + ' ')
+
+
+class _NormalizationTable(dict):
+    """
+    Translation table for str.translate that folds accents and deletes all characters that are not allowed
+
+    The translation of each character is computed once, when it is encountered for the first time.
+    """
+
+    def __missing__(self, code_point: int):
+        decomposed = unicodedata.normalize('NFKD', chr(code_point))
+        translation = ''.join(char for char in decomposed if char in ALLOWED_CHARACTERS) or None
+        self[code_point] = translation
+        return translation
+
+
+_NORMALIZATION_TABLE = _NormalizationTable()
+
+
+def normalize(text: str) -> str:
+    """
+    Make all letters lower case, fold accents ("é" becomes "e") and remove all other non alphanumerical characters
+    """
+
+    return text.lower().translate(_NORMALIZATION_TABLE)
+
+
+def tokenize(text: str) -> List[str]:
+    return normalize(text).split(' ')
+
+
+class WordMatcher:
+    """
+    Index of approve and reject words, built once per word list
+
+    Entries can be single words or phrases of multiple words, such as "vrije universiteit".
+    Phrases are stored in a trie of words, such that all phrases in a name are found in a single scan.
+    """
+
+    _TERMINAL = None  # Key in a trie node under which the votes of the phrase ending in that node are stored
+
+    def __init__(self, approve_words: Iterable[str], reject_words: Iterable[str]):
+        self.approve_words: Set[str] = set()
+        self.reject_words: Set[str] = set()
+        self._phrases: Dict = dict()
+        for entry in approve_words:
+            self._add(entry, Vote.approve, self.approve_words)
+        for entry in reject_words:
+            self._add(entry, Vote.reject, self.reject_words)
+
+    def match(self, name: str) -> Tuple[Vote, List[str]]:
+        """
+        Return the vote for the given name, and the words in it that are neither approved nor rejected
+
+        - When any word or phrase is approved, the vote is approve
+        - When all words are rejected, on their own or as part of a rejected phrase, the vote is reject
+        - In all other cases, the vote is review
+        """
+
+        words = tokenize(name)
+        if any(word in self.approve_words for word in words):
+            return Vote.approve, []
+
+        rejected = [word in self.reject_words for word in words]
+        if self._phrases:
+            for start, end, vote in self._find_phrases(words):
+                if vote == Vote.approve:
+                    return Vote.approve, []
+                rejected[start:end] = [True] * (end - start)
+
+        if all(rejected):
+            return Vote.reject, []
+        return Vote.review, [word for word, is_rejected in zip(words, rejected) if not is_rejected]
+
+    def _add(self, entry: str, vote: Vote, words: Set[str]):
+        entry_words = tokenize(entry)
+        if len(entry_words) == 1:
+            words.add(entry_words[0])
+            return
+
+        node = self._phrases
+        for word in entry_words:
+            node = node.setdefault(word, dict())
+        node.setdefault(self._TERMINAL, set()).add(vote)
+
+    def _find_phrases(self, words: List[str]) -> Iterable[Tuple[int, int, Vote]]:
+        for start in range(len(words)):
+            node = self._phrases
+            for end in range(start, len(words)):
+                node = node.get(words[end])
+                if node is None:
+                    break
+                for vote in node.get(self._TERMINAL, ()):
+                    yield start, end + 1, vote
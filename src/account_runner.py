@@ -0,0 +1,135 @@
+import os
+import threading
+from typing import Dict, List, Optional
+
+import common
+from ProfileJudge.profile_judge import ProfileJudge
+from collage_renderer import CollageRenderer
+from http_session import AsyncHttpSession, BackgroundEventLoop
+from logger import Logger
+from secrets import SecretsStore
+from seen_profiles import SeenProfileIndex
+from swipe_history import SwipeHistory
+from swipe_ledger import SwipeLedger
+from tinder_bot import TinderBot
+from tinder_service import TinderService
+
+
+class Account:
+    """
+    Tinder account with its own directory for its secrets, swipe ledger and collages
+
+    Directory structure:
+    accounts
+    - <name>
+      - secrets.json
+      - swipe_ledger.sqlite3
+      - seen_profiles.sqlite3
+      - swipe_history
+      - img
+    """
+
+    def __init__(self, name: str, directory: str = None):
+        self.name = name
+        self.directory = directory or os.path.join(common.get_dir('accounts'), name)
+        os.makedirs(self.img_dir, exist_ok=True)
+
+    @property
+    def secrets_file(self) -> str:
+        return os.path.join(self.directory, 'secrets.json')
+
+    @property
+    def ledger_file(self) -> str:
+        return os.path.join(self.directory, 'swipe_ledger.sqlite3')
+
+    @property
+    def seen_profiles_file(self) -> str:
+        return os.path.join(self.directory, 'seen_profiles.sqlite3')
+
+    @property
+    def swipe_history_dir(self) -> str:
+        return os.path.join(self.directory, 'swipe_history')
+
+    @property
+    def img_dir(self) -> str:
+        return os.path.join(self.directory, 'img')
+
+    def __repr__(self) -> str:
+        return f'Account({self.name!r})'
+
+
+class MultiAccountRunner:
+    """
+    Run the bots of several accounts at the same time, in one process
+
+    Each account has its own credentials, ledger, collages, swipe scheduler and therefore its own rate limits.
+    The word lists, the connection pools and the collage worker processes are shared by all accounts.
+    """
+
+    def __init__(self, accounts: List[Account]):
+        self.accounts = accounts
+        self.profile_judge = ProfileJudge()
+        self.collage_renderer = CollageRenderer()
+        self.session = AsyncHttpSession()
+        self.bots: Dict[str, TinderBot] = dict()
+        for account in accounts:
+            service = TinderService(SecretsStore(account.secrets_file), self.session)
+            self.bots[account.name] = TinderBot(service=service, ledger=SwipeLedger(account.ledger_file),
+                                                img_dir=account.img_dir, profile_judge=self.profile_judge,
+                                                collage_renderer=self.collage_renderer,
+                                                seen_profiles=SeenProfileIndex(account.seen_profiles_file),
+                                                swipe_history=SwipeHistory(account.swipe_history_dir))
+
+    @classmethod
+    def from_accounts_dir(cls, directory: str = None) -> 'MultiAccountRunner':
+        """
+        Create a runner for all accounts in the accounts directory that have a secrets file
+        """
+
+        directory = directory or common.get_dir('accounts')
+        accounts = [Account(name, os.path.join(directory, name)) for name in sorted(os.listdir(directory))
+                    if os.path.isfile(os.path.join(directory, name, 'secrets.json'))]
+        return cls(accounts)
+
+    def run(self, nr_profiles: int = 10) -> Dict[str, Optional[BaseException]]:
+        """
+        Run the bots of all accounts in parallel, and return the error of each account, None if it succeeded
+
+        An error in one account does not stop the other accounts.
+        """
+
+        errors: Dict[str, Optional[BaseException]] = dict()
+
+        def run_bot(name: str, bot: TinderBot):
+            try:
+                bot.run(nr_profiles)
+                errors[name] = None
+            except BaseException as e:
+                errors[name] = e
+                Logger.log('Account %s stopped: %r', name, e, account=name)
+
+        threads = [threading.Thread(target=run_bot, args=(name, bot), name=f'account-{name}')
+                   for name, bot in self.bots.items()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+
+    def close(self):
+        for bot in self.bots.values():
+            bot.swipe_scheduler.close()
+            bot.ledger.close()
+            bot.seen_profiles.close()
+        self.collage_renderer.close()
+        BackgroundEventLoop.get().run(self.session.close())
+
+
+if __name__ == '__main__':
+    Logger.max_level = 1
+    runner = MultiAccountRunner.from_accounts_dir()
+    try:
+        for account_name, error in runner.run(nr_profiles=100).items():
+            Logger.log('%s: %s', account_name, 'finished' if error is None else repr(error), account=account_name)
+    finally:
+        runner.close()
@@ -0,0 +1,377 @@
+"""
+Microbenchmarks of the hot paths of the bot: judging, user parsing and collage rendering
+
+All benchmarks run on synthetic data, generated with a fixed seed. The results can be stored as a baseline
+in the repository, and later runs can be compared with it to find regressions:
+
+    python benchmarks.py save      # Run all benchmarks and store the results as the new baseline
+    python benchmarks.py compare   # Run all benchmarks and compare them with the baseline
+
+Timings vary between processes, so the benchmarks run in several processes, and a benchmark is only a regression
+when it is slower than the baseline by more than the threshold on top of the noise of the baseline, and by more
+than an absolute minimum.
+"""
+
+import argparse
+import atexit
+import json
+import os
+import platform
+import random
+import shutil
+import string
+import subprocess
+import sys
+import tempfile
+import timeit
+from collections import defaultdict
+from io import BytesIO
+from typing import Callable, Dict, List, Tuple
+
+import PIL
+from PIL import Image
+
+import common
+from fake_tinder_server import FakeProfileGenerator
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), '..', 'test_data', 'benchmark_baseline.json')
+
+SEED = 0
+NR_USERS = 500
+WORD_LIST_SIZE = 5000  # Number of synthetic words in each approve and reject list, on top of the real words
+REPEAT = 10  # The fastest of this number of measurements is reported
+MIN_TIME = 0.1  # Minimum number of seconds per measurement
+ROUNDS = 5  # Number of processes the benchmarks run in, the fastest round is reported
+THRESHOLD = 0.2  # A benchmark that is this fraction slower than the baseline, on top of its noise, is a regression
+MIN_DIFFERENCE = 5e-8  # Any benchmark may be this number of seconds per operation slower than the baseline
+
+# Benchmark name -> function that prepares the data, and returns the statement to time and its number of operations
+BENCHMARKS: Dict[str, Callable[[], Tuple[Callable[[], None], int]]] = dict()
+
+
+def benchmark(name: str):
+    def register(setup: Callable[[], Tuple[Callable[[], None], int]]):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+def _random_word(rng: random.Random) -> str:
+    return ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 12)))
+
+
+def _create_data_dir():
+    """
+    Let the bot use a temporary data directory with synthetic word lists, instead of the real data
+    """
+
+    data_dir = tempfile.mkdtemp(prefix='patinderbot_benchmarks_')
+    os.environ[common.PROJECT_DIR_VARIABLE] = data_dir
+    # Registered before any judge is created, so it runs after the judges flushed their review words at exit
+    atexit.register(shutil.rmtree, data_dir, ignore_errors=True)
+
+    rng = random.Random(SEED)
+    names = [name.lower() for name in FakeProfileGenerator.NAMES]
+    school_words = sorted({word.lower() for school in FakeProfileGenerator.SCHOOL_NAMES for word in school.split()})
+    word_lists = {
+        'name_approve_words.json': names[::2],
+        'name_reject_words.json': names[1::2],
+        'school_approve_words.json': school_words[::2],
+        'school_reject_words.json': school_words[1::2],
+    }
+    for filename, words in word_lists.items():
+        words = words + [_random_word(rng) for _ in range(WORD_LIST_SIZE)]
+        with open(os.path.join(common.get_dir('json'), filename), 'w') as f:
+            json.dump(sorted(set(words)), f)
+
+
+def _generate_user_dicts() -> List[dict]:
+    generator = FakeProfileGenerator('http://localhost/images', seed=SEED)
+    return [generator.generate() for _ in range(NR_USERS)]
+
+
+def _generate_users():
+    from tinder_user import TinderUser
+    return [TinderUser(user_dict) for user_dict in _generate_user_dicts()]
+
+
+def _generate_photos(nr_photos: int, size: int) -> List[Image.Image]:
+    rng = random.Random(SEED)
+    return [Image.effect_noise((size, size), sigma=rng.uniform(20, 80)).convert('RGB') for _ in range(nr_photos)]
+
+
+def _generate_names() -> List[str]:
+    rng = random.Random(SEED)
+    return [' '.join(rng.choice(FakeProfileGenerator.NAMES + [_random_word(rng)]) for _ in range(rng.randint(1, 3)))
+            for _ in range(NR_USERS)]
+
+
+@benchmark('word_judge.judge_by_words')
+def bench_judge_by_words():
+    from ProfileJudge.name_judge import NameJudge
+    judge = NameJudge()
+    judge.VERDICT_CACHE_SIZE = 0  # Measure the word matching itself
+    names = _generate_names()
+
+    def run():
+        for name in names:
+            judge.judge_by_words(name)
+
+    return run, len(names)
+
+
+@benchmark('word_judge.judge_by_words_cached')
+def bench_judge_by_words_cached():
+    from ProfileJudge.name_judge import NameJudge
+    judge = NameJudge()
+    names = _generate_names()
+
+    def run():
+        for name in names:
+            judge.judge_by_words(name)
+
+    return run, len(names)
+
+
+@benchmark('school_judge.vote')
+def bench_school_vote():
+    from ProfileJudge.school_judge import SchoolJudge
+    judge = SchoolJudge()
+    judge.VERDICT_CACHE_SIZE = 0  # Measure the judging itself, like the recorded baseline
+    users = _generate_users()
+
+    def run():
+        for user in users:
+            judge.vote(user)
+
+    return run, len(users)
+
+
+@benchmark('profile_judge.like_or_nope')
+def bench_like_or_nope():
+    from ProfileJudge.profile_judge import ProfileJudge
+    judge = ProfileJudge()
+    for word_judge in (judge.name_judge, judge.school_judge):
+        word_judge.VERDICT_CACHE_SIZE = 0  # Measure the judging itself, like the recorded baseline
+    users = _generate_users()
+
+    def run():
+        for user in users:
+            judge.like_or_nope(user)
+
+    return run, len(users)
+
+
+@benchmark('tinder_user.parse')
+def bench_user_parse():
+    from tinder_user import TinderUser
+    user_dicts = _generate_user_dicts()
+
+    def run():
+        for user_dict in user_dicts:
+            TinderUser(user_dict)
+
+    return run, len(user_dicts)
+
+
+@benchmark('tinder_user.properties')
+def bench_user_properties():
+    users = _generate_users()
+
+    def run():
+        for user in users:
+            (user.id, user.name, user.bio, user.age, user.jobs, user.schools, user.school_names,
+             user.common_friends, user.distance, user.photos)
+
+    return run, len(users)
+
+
+@benchmark('tinder_user.as_dict')
+def bench_user_as_dict():
+    users = _generate_users()
+
+    def run():
+        for user in users:
+            user.as_dict()
+
+    return run, len(users)
+
+
+@benchmark('collage_creator.write_user_photos')
+def bench_write_user_photos():
+    from collage_creator import CollageCreator
+    collage_creator = CollageCreator()
+    collage_creator.photos = _generate_photos(6, collage_creator._img_size)
+    width, height = collage_creator._get_photos_size()
+    img = Image.new(mode='RGB', size=(width, height), color='white')
+
+    def run():
+        collage_creator._write_user_photos(img)
+
+    return run, 1
+
+
+@benchmark('collage_creator.write_user_info')
+def bench_write_user_info():
+    from collage_creator import CollageCreator
+    collage_creator = CollageCreator()
+    user = max(_generate_users(), key=lambda u: len(u.bio or ''))
+    width = 2 * collage_creator._img_size
+    lines = collage_creator._layout_user_info(user, width - 2 * collage_creator._margin)
+    img = Image.new(mode='RGB', size=(width, (len(lines) + 2) * collage_creator.LINE_HEIGHT), color='white')
+
+    def run():
+        collage_creator._write_user_info(img, lines, y=collage_creator._margin)
+
+    return run, 1
+
+
+@benchmark('jpeg.save')
+def bench_jpeg_save():
+    photos = _generate_photos(6, 400)
+    img = Image.new(mode='RGB', size=(800, 1400), color='white')
+    for index, photo in enumerate(photos):
+        img.paste(photo, box=(400 * (index % 2), 400 * (index // 2)))
+
+    def run():
+        img.save(BytesIO(), format='JPEG', quality=95, optimize=True)
+
+    return run, 1
+
+
+def run_benchmarks(names: List[str] = None) -> Dict[str, float]:
+    """
+    Run the given benchmarks, or all of them, and return the number of seconds per operation of each
+    """
+
+    _create_data_dir()
+    results = dict()
+    for name, setup in BENCHMARKS.items():
+        if names and name not in names:
+            continue
+        statement, nr_operations = setup()
+        statement()  # Warm up caches, such as the word matcher and the fonts
+        timer = timeit.Timer(statement)
+        number = max(1, int(MIN_TIME / max(timer.timeit(number=1), 1e-9)))
+        seconds = min(timer.repeat(repeat=REPEAT, number=number)) / number / nr_operations
+        results[name] = seconds
+        print(f'{name:<36} {seconds * 1e6:12.2f} µs/op')
+    return results
+
+
+def run_rounds(names: List[str] = None, rounds: int = ROUNDS) -> Tuple[Dict[str, float], Dict[str, float]]:
+    """
+    Run the benchmarks in the given number of new processes, and return the fastest number of seconds per operation
+    of each, and the noise of each: the spread between the processes as a fraction of the fastest
+
+    A process is started per round, because the hash seed and the memory layout differ per process, and they change
+    the timings more than repeating the measurements within a process does.
+    """
+
+    measurements = defaultdict(list)
+    with tempfile.TemporaryDirectory(prefix='patinderbot_benchmarks_') as tmp_dir:
+        output_file = os.path.join(tmp_dir, 'results.json')
+        for round_nr in range(1, rounds + 1):
+            print(f'Round {round_nr} of {rounds}', flush=True)
+            command = [sys.executable, os.path.abspath(__file__), 'run', '--rounds', '1', '--output', output_file]
+            for name in names or []:
+                command += ['--benchmark', name]
+            subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+            with open(output_file, 'r') as f:
+                for name, seconds in json.load(f).items():
+                    measurements[name].append(seconds)
+
+    results = {name: min(seconds) for name, seconds in measurements.items()}
+    noise = {name: max(seconds) / min(seconds) - 1 for name, seconds in measurements.items()}
+    for name in results:
+        print(f'{name:<36} {results[name] * 1e6:12.2f} µs/op  (noise {noise[name]:5.1%})')
+    return results, noise
+
+
+def get_environment() -> Dict[str, str]:
+    return {'python': platform.python_version(), 'pillow': PIL.__version__,
+            'machine': platform.machine(), 'processor': platform.processor()}
+
+
+def read_baseline() -> dict:
+    with open(BASELINE_FILE, 'r') as f:
+        baseline = json.load(f)
+    baseline.setdefault('noise', dict())
+    return baseline
+
+
+def save_baseline(results: Dict[str, float], noise: Dict[str, float]):
+    baseline = {'environment': get_environment(), 'results': results, 'noise': noise}
+    tmp_file = f'{BASELINE_FILE}.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write('\n')
+    os.replace(tmp_file, BASELINE_FILE)
+    print(f'Baseline written to {os.path.normpath(BASELINE_FILE)}')
+
+
+def compare(results: Dict[str, float], baseline: dict, threshold: float, min_difference: float) -> List[str]:
+    """
+    Print the change of each benchmark with respect to the baseline, and return the names of the regressions
+
+    A benchmark is a regression when it is slower than the baseline by more than the threshold on top of the noise
+    measured for the baseline, and by more than the minimum difference in seconds per operation.
+    """
+
+    for key, value in get_environment().items():
+        if baseline['environment'].get(key) != value:
+            print(f'Warning: the baseline was recorded with {key} {baseline["environment"].get(key)}, not {value}')
+
+    regressions = []
+    for name, seconds in results.items():
+        if name not in baseline['results']:
+            print(f'{name:<36} not in baseline')
+            continue
+        baseline_seconds = baseline['results'][name]
+        change = seconds / baseline_seconds - 1
+        allowed_change = threshold + baseline['noise'].get(name, 0)
+        is_regression = change > allowed_change and seconds - baseline_seconds > min_difference
+        if is_regression:
+            regressions.append(name)
+        print(f'{name:<36} {change:+8.1%}  (allowed {allowed_change:+.0%}){"  REGRESSION" if is_regression else ""}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('command', choices=['run', 'save', 'compare'], nargs='?', default='run')
+    parser.add_argument('--benchmark', action='append', dest='names', choices=list(BENCHMARKS),
+                        help='only run this benchmark, can be given multiple times')
+    parser.add_argument('--rounds', type=int, default=ROUNDS,
+                        help='number of processes to run the benchmarks in, the fastest round counts')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='fraction by which a benchmark may be slower than the baseline, on top of its noise')
+    parser.add_argument('--min-difference', type=float, default=MIN_DIFFERENCE,
+                        help='number of seconds per operation by which any benchmark may be slower than the baseline')
+    parser.add_argument('--output', help='write the results of the run command as JSON to this file')
+    args = parser.parse_args()
+
+    if args.rounds > 1:
+        results, noise = run_rounds(args.names, args.rounds)
+    else:
+        results, noise = run_benchmarks(args.names), dict()
+
+    if args.command == 'run' and args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f)
+    elif args.command == 'save':
+        if args.names:
+            baseline = read_baseline()
+            results, noise = {**baseline['results'], **results}, {**baseline['noise'], **noise}
+        save_baseline(results, noise)
+    elif args.command == 'compare':
+        print()
+        regressions = compare(results, read_baseline(), args.threshold, args.min_difference)
+        if regressions:
+            print(f'\n{len(regressions)} regression(s): {", ".join(regressions)}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
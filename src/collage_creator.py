@@ -18,17 +18,43 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 # TODO: Check if this collage creator is still working
 
+import functools
 import math
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from io import BytesIO
+from typing import List, Optional, Tuple
 
-import requests
 from PIL import Image, ImageDraw, ImageFont
+from requests import RequestException
 
 import common
 from enums import Status
+from http_session import HttpSession
+from logger import Logger
+from metrics import Metrics
+from photo_cache import PhotoCache
 from tinder_user import TinderUser
+from type_hinting import PhotoDict
+
+
+FONT_FILE = 'Trebuchet MS Bold.ttf'
+
+
+@functools.lru_cache(maxsize=None)
+def get_font(size: int) -> ImageFont.ImageFont:
+    """
+    Return the collage font in the given size
+
+    Fonts are parsed once per process. If the font file is not available, Pillow's default font is used.
+    """
+
+    try:
+        return ImageFont.truetype(FONT_FILE, size)
+    except OSError as e:
+        Logger.log('Font %s not available, using the default font: %s', FONT_FILE, e)
+        return ImageFont.load_default()
 
 
 class CollageCreator(object):
@@ -36,11 +62,15 @@ class CollageCreator(object):
     Class that creates a collage based on a PATinderUser
     """
 
-    def __init__(self):
+    MAX_PARALLEL_DOWNLOADS = 3  # Maximum number of photos of one user that are downloaded at the same time
+    FONT_SIZE = 24
+    LINE_HEIGHT = FONT_SIZE + 2
+
+    def __init__(self, img_dir: str = None):
+        self.img_dir = img_dir  # Directory in which the collages are saved, by default the img directory
         self.photos = list()
         self._img_size = 400
         self._margin = 20
-        self._first_text = None
 
     def download_img(self, url: str):
         """
@@ -51,50 +81,148 @@ class CollageCreator(object):
             If output is None, this means that the requested image does not exist.
         """
 
-        if url is None:
-            return
+        data = self._fetch_bytes(url)
+        if data is not None:
+            self.add_photo(data)
+
+    def download_imgs(self, urls: List[str]):
+        """
+        Download the images of the given urls in parallel
+
+        The photos are added in the order of the urls, regardless of the order in which the downloads finish.
+        Images that fail to download are skipped.
+        """
+
+        for data in self.download_photo_bytes(urls):
+            self.add_photo(data)
+
+    def download_photo_bytes(self, urls: List[str]) -> List[bytes]:
+        """
+        Download the images of the given urls in parallel, in the order of the urls, as they were downloaded
+
+        The photos are decoded and resized only once, by add_photo. Images that fail to download are skipped.
+        """
+
+        urls = [url for url in urls if url is not None]
+        if not urls:
+            return []
+
+        with ThreadPoolExecutor(max_workers=min(self.MAX_PARALLEL_DOWNLOADS, len(urls))) as executor:
+            return [data for data in executor.map(self._fetch_bytes, urls) if data is not None]
+
+    def select_photo_url(self, photo: PhotoDict) -> Optional[str]:
+        """
+        Return the url of the smallest processed variant of the photo that still covers a collage cell
+
+        If no processed variant is large enough, the url of the original photo is returned.
+        """
+
+        variants = [variant for variant in photo.get('processedFiles', [])
+                    if variant.get('url')
+                    and variant.get('width', 0) >= self._img_size and variant.get('height', 0) >= self._img_size]
+        if not variants:
+            return photo.get('url')
+        return min(variants, key=lambda variant: variant['width'] * variant['height'])['url']
+
+    def add_photo(self, data: bytes):
+        """
+        Decode the given encoded image and add it to the photos of the collage
+        """
 
-        r = requests.get(url)
         try:
-            img = Image.open(BytesIO(r.content))
-            img = img.resize((self._img_size, self._img_size), Image.ANTIALIAS)
-            self.photos.append(img)
+            self.photos.append(self._decode_img(data))
         except OSError as e:
+            # Print the error message, but continue with the other photos
+            print(e)
+
+    @property
+    def photo_cache(self) -> PhotoCache:
+        return PhotoCache.default()
+
+    def _decode_img(self, data: bytes) -> Image.Image:
+        img = Image.open(BytesIO(data))
+        # For JPEG images, let the decoder already scale down to the smallest size that covers a collage cell
+        img.draft('RGB', (self._img_size, self._img_size))
+        return img.resize((self._img_size, self._img_size), Image.LANCZOS)
+
+    def _fetch_bytes(self, url: str) -> Optional[bytes]:
+        """
+        Return the encoded photo at the given url, as it was downloaded
+
+        The photo is not re-encoded, such that it is only decoded and resized once, when the collage is created,
+        without losing quality to a second JPEG compression. The photo cache is checked before going to the network.
+        If the photo could not be downloaded or is not an image, None is returned.
+        """
+
+        if url is None:
+            return None
+
+        key = self.photo_cache.key(url)
+        data = self.photo_cache.get(key)
+        Metrics.count('photo_cache_requests_total', result='miss' if data is None else 'hit')
+        if data is not None:
+            return data
+
+        try:
+            with Metrics.timer('photo_download_seconds'):
+                response = HttpSession.get().get(url)
+            Metrics.count('http_responses_total', client='requests', status=response.status_code)
+            Metrics.count('photo_bytes_downloaded_total', len(response.content))
+            data = response.content
+            # Only reads the header, to not cache an error page as a photo
+            Image.open(BytesIO(data))
+        except (OSError, RequestException) as e:
             # Print the error message, but continue downloading
             print(e)
+            return None
+
+        try:
+            self.photo_cache.put(key, data)
+        except OSError as e:
+            # Print the error message, the photo can still be used without caching it
+            print(e)
+        return data
 
     def create_collage(self, user: TinderUser, status: Status):
         """
         Collect all photos and place user info under the photos
+
+        All text is measured first, such that the final image is allocated once and drawn in a single pass.
         """
 
-        img = self._write_user_photos()
-        try:
-            img = self._write_user_info(img, user)
-        except Exception as e:
-            # Print the error message, but continue creating a collage
-            print(e)
-        img = self._add_bottom_margin(img)
+        with Metrics.timer('collage_seconds', step='compose'):
+            width, photos_height = self._get_photos_size()
+            try:
+                lines = self._layout_user_info(user, width - 2 * self._margin)
+            except Exception as e:
+                # Print the error message, but continue creating a collage
+                print(e)
+                lines = []
+            text_height = self._margin + len(lines) * self.LINE_HEIGHT if lines else 0
+
+            img = Image.new(mode='RGB', size=(width, photos_height + text_height + self._margin), color='white')
+            self._write_user_photos(img)
+            self._write_user_info(img, lines, y=photos_height + self._margin)
 
         filename = f'{user.name}_{user.id}.jpg'
-        full_img_name = os.path.join(self._get_img_dir(status), filename)
-        img.save(full_img_name, quality=95, optimize=True)
+        full_img_name = os.path.join(self._get_img_dir(status, self.img_dir), filename)
+        with Metrics.timer('collage_seconds', step='save'):
+            img.save(full_img_name, quality=95, optimize=True)
 
-    @property
-    def nr_liked_today(self):
-        liked_dir = self._get_img_dir(Status.liked)
-        return len([name for name in os.listdir(liked_dir)
-                    if os.path.isfile(os.path.join(liked_dir, name))
-                    and name.endswith('.jpg')])
+    def _get_photos_size(self) -> Tuple[int, int]:
+        """
+        Return the width and height of the part of the collage that contains the photos, two photos per row
+        """
 
-    def _write_user_photos(self):
         nr_photos = len(self.photos)
         if nr_photos == 1:
             width = self._img_size
         else:
             width = 2 * self._img_size
         height = int(math.ceil(nr_photos / 2.0) * self._img_size)
-        img = Image.new(mode='RGB', size=(width, height), color='white')
+        return width, height
+
+    def _write_user_photos(self, img: Image.Image):
         index_x = 0
         index_y = 0
         for photo in self.photos:
@@ -108,79 +236,64 @@ class CollageCreator(object):
                 # Move below and back to the left
                 index_x = 0
                 index_y += 1
-        return img
 
-    def _write_user_info(self, img, user):
-        self._first_text = True
+    def _layout_user_info(self, user: TinderUser, max_width: int) -> List[str]:
+        """
+        Return the lines of text with the relevant info of a person, wrapped to the given width in pixels
+        """
 
-        img = self._put_text_in_img(img, f'Naam: {user.name}')
-        img = self._put_text_in_img(img, f'Leeftijd: {user.age} jaar')
+        texts = [f'Naam: {user.name}', f'Leeftijd: {user.age} jaar']
         if len(user.jobs) > 0:
-            img = self._put_text_in_img(img, f'Werk: {", ".join(user.jobs)}')
+            texts.append(f'Werk: {", ".join(user.jobs)}')
         if len(user.school_names) > 0:
-            img = self._put_text_in_img(img, f'School: {", ".join(user.school_names)}')
+            texts.append(f'School: {", ".join(user.school_names)}')
         if len(user.common_friends) > 0:
-            img = self._put_text_in_img(img, f'Vrienden: {", ".join(user.common_friends)}')
-
-        img = self._put_text_in_img(img, f'Afstand: {user.distance} km')
-        img = self._put_text_in_img(img, f'Bio: {user.bio}')
+            texts.append(f'Vrienden: {", ".join(user.common_friends)}')
+        texts.append(f'Afstand: {user.distance} km')
+        texts.append(f'Bio: {user.bio}')
 
-        return img
+        font = get_font(self.FONT_SIZE)
+        measure = ImageDraw.Draw(Image.new(mode='RGB', size=(1, 1)))
+        lines = []
+        for text in texts:
+            lines.extend(self._wrap_text(text, font, measure, max_width))
+        return lines
 
-    def _put_text_in_img(self, img, text):
+    @staticmethod
+    def _wrap_text(text: str, font, measure: ImageDraw.ImageDraw, max_width: int) -> List[str]:
         """
-        Put the relevant text of a person in the img.
+        Split the text into lines that fit the given width. Words longer than a line are not split.
         """
 
-        assert (self._first_text is not None)
-
-        font_size = 24
-        line_height = font_size + 2
-        if self._first_text:
-            new_height = img.size[1] + line_height + self._margin
-        else:
-            new_height = img.size[1] + line_height
-
-        # Create more space to output text
-        result = Image.new(mode='RGB', size=(img.size[0], new_height), color='white')
-        result.paste(img, (0, 0, img.size[0], img.size[1]))
-
-        # Initialize draw object
-        draw = ImageDraw.Draw(result)
-
-        # Define font
-        font = ImageFont.truetype("Trebuchet MS Bold.ttf", font_size)
-
-        # Define text location
-        x = self._margin
-        if self._first_text:
-            y = img.size[1] + self._margin
-        else:
-            y = img.size[1]
-
-        # Draw the text
-        if text:
-            draw.text((x, y), text, fill='black', font=font)
-
-        # Indicate that we have drawn at least one text
-        self._first_text = False
-
-        return result
-
-    def _add_bottom_margin(self, img):
-        result = Image.new(mode='RGB', size=(img.size[0], img.size[1] + self._margin), color='white')
-        result.paste(img, (0, 0, img.size[0], img.size[1]))
-        return result
+        lines = []
+        line = ''
+        for word in text.split():
+            candidate = f'{line} {word}' if line else word
+            if line and measure.textlength(candidate, font=font) > max_width:
+                lines.append(line)
+                line = word
+            else:
+                line = candidate
+        lines.append(line)
+        return lines
+
+    def _write_user_info(self, img: Image.Image, lines: List[str], y: int):
+        draw = ImageDraw.Draw(img)
+        font = get_font(self.FONT_SIZE)
+        for line in lines:
+            if line:
+                draw.text((self._margin, y), line, fill='black', font=font)
+            y += self.LINE_HEIGHT
 
     @staticmethod
-    def _get_img_dir(status: Status):
+    def _get_img_dir(status: Status, img_dir: str = None):
         """
         Return a string which contains the PATinderBot img directory for the given status for today
         """
 
         date_format = '%Y%m%d'
         today_dir = datetime.today().strftime(date_format)
-        status_dir = os.path.join(common.get_dir('img'), status.value)
+        status_dir = os.path.join(img_dir or common.get_dir('img'), status.value)
         img_dir = os.path.join(status_dir, today_dir)
         common.ensure_dir_exists(status_dir)
         common.ensure_dir_exists(img_dir)
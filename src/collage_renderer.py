@@ -0,0 +1,100 @@
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from collage_creator import CollageCreator
+from enums import Status
+from logger import Logger
+from metrics import Metrics
+from tinder_user import TinderUser
+
+
+def render_collage(user: TinderUser, photos: List[bytes], status: Status, img_dir: str = None,
+                   collect_metrics: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Decode the photos and create the collage of the given user
+
+    This is a module level function, such that it can be executed in a worker process. Metrics recorded in a worker
+    process do not reach the main process by themselves, so if asked for, they are returned as a snapshot.
+    """
+
+    if collect_metrics:
+        Metrics.enabled = True
+        Metrics.reset()
+    with Metrics.timer('collage_seconds', step='decode'):
+        collage_creator = CollageCreator(img_dir)
+        for data in photos:
+            collage_creator.add_photo(data)
+    collage_creator.create_collage(user, status)
+    return Metrics.snapshot() if collect_metrics else None
+
+
+class CollageRenderer:
+    """
+    Pool of worker processes that create collages
+
+    Decoding, resizing, compositing and saving photos is CPU bound. Doing this in separate processes
+    lets it scale across cores, and the swiping thread can continue with the next user right away.
+    """
+
+    MAX_WORKERS = None  # Number of worker processes, None means one per CPU
+    MAX_PENDING_JOBS = 8  # submit() blocks when this many jobs are waiting or running
+
+    def __init__(self, max_workers: int = None, max_pending_jobs: int = None):
+        # Worker processes are spawned instead of forked: a fork copies the locks held by the threads of the Logger,
+        # the event loop and the metrics, and a child would wait forever for a lock that no thread releases
+        self._executor = ProcessPoolExecutor(max_workers=max_workers or self.MAX_WORKERS,
+                                             mp_context=multiprocessing.get_context('spawn'))
+        self._slots = threading.BoundedSemaphore(max_pending_jobs or self.MAX_PENDING_JOBS)
+        self._pending: List[Future] = []
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> 'CollageRenderer':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def submit(self, user: TinderUser, photos: List[bytes], status: Status, img_dir: str = None):
+        """
+        Enqueue a collage job, waiting for a free slot if too many jobs are pending
+
+        The collage is saved in the given img directory, by default the one of the project.
+        """
+
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(render_collage, user, photos, status, img_dir, Metrics.enabled)
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._pending.append(future)
+        future.add_done_callback(self._on_done)
+
+    def flush(self):
+        """
+        Wait until all submitted collages are created
+        """
+
+        with self._lock:
+            pending = list(self._pending)
+        for future in pending:
+            future.exception()  # Waits for the job, errors are already reported in _on_done
+
+    def close(self):
+        self.flush()
+        self._executor.shutdown()
+
+    def _on_done(self, future: Future):
+        with self._lock:
+            self._pending.remove(future)
+        self._slots.release()
+        error = future.exception()
+        if error is not None:
+            # Print the error message, but continue creating other collages
+            Logger.log('Creating collage failed: %r', error)
+            Metrics.count('collage_errors_total')
+        elif future.result() is not None:
+            Metrics.merge(future.result())
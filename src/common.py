@@ -3,6 +3,9 @@ from typing import Dict, List, Union
 
 OptionalJSON = Union[List, Dict, float, int, str, bool, None]
 
+# Environment variable to use another directory than the project directory for all data, e.g. for load tests
+PROJECT_DIR_VARIABLE = 'PATINDERBOT_DIR'
+
 
 def ensure_dir_exists(directory):
     if not os.path.exists(directory):
@@ -16,6 +19,7 @@ def get_dir(directory: str) -> str:
     Current directory structure:
     PATinderBot
         src
+        cache
         img
             like
             match
@@ -27,8 +31,10 @@ def get_dir(directory: str) -> str:
     :return: string with the complete path to the searched for directory
     """
 
-    current_dir = os.path.dirname(__file__)
-    project_dir = os.path.join(current_dir, '..')
+    project_dir = os.environ.get(PROJECT_DIR_VARIABLE)
+    if not project_dir:
+        current_dir = os.path.dirname(__file__)
+        project_dir = os.path.join(current_dir, '..')
     result = os.path.join(project_dir, directory)
     ensure_dir_exists(result)
     return result
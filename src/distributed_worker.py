@@ -0,0 +1,302 @@
+"""
+Distributed worker mode: fetchers publish recommended users to a work queue, and workers judge, swipe and render them
+
+A fetcher publishes the recommendations of an account as 'judge' jobs. Workers lease jobs of one or more topics:
+- judge: judge the user with the ProfileJudge, and publish a 'swipe' job with the verdict
+- swipe: send the swipe to Tinder and record it exactly once per user, and publish a 'collage' job for likes
+- collage: download the photos and create the collage
+
+Workers keep no state of their own: everything that has to survive a worker is in the queue, and in the ledger and
+the swipe history of the account. A job of a worker that dies is leased to another worker once the lease expires.
+Users are judged again when the word lists change, since the version of the word lists is part of the job keys.
+"""
+
+import argparse
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+from functools import partial
+from typing import Dict, List, Optional
+
+import common
+from ProfileJudge.profile_judge import ProfileJudge
+from account_runner import Account
+from collage_creator import CollageCreator
+from collage_renderer import render_collage
+from enums import Status, SwipeAction
+from logger import Logger
+from metrics import Metrics
+from recommendation_buffer import RecommendationBuffer
+from secrets import SecretsStore
+from swipe_history import SwipeHistory
+from swipe_ledger import SubmissionClaimed, SwipeLedger
+from swipe_scheduler import SwipeScheduler
+from tinder_service import TinderService
+from tinder_user import TinderUser
+from work_queue import Job, MemoryWorkQueue, SqliteWorkQueue, WorkQueue
+
+JUDGE = 'judge'
+SWIPE = 'swipe'
+COLLAGE = 'collage'
+TOPICS = [JUDGE, SWIPE, COLLAGE]
+
+MAX_NUMBER_OF_PHOTOS = 6
+
+
+def publish_recommendations(queue: WorkQueue, account: Account, nr_profiles: int) -> int:
+    """
+    Publish the given number of recommended users of the account as judge jobs, and return how many were new
+
+    The parked likes of the account are published first, as swipe jobs, such that a worker likes them once
+    likes are available again. A user that was published before is published again once the word lists changed.
+    """
+
+    word_list_version = ProfileJudge().word_list_version
+    service = TinderService(SecretsStore(account.secrets_file))
+    ledger = SwipeLedger(account.ledger_file)
+    nr_published = 0
+    try:
+        for user_dict in ledger.pending_likes():
+            # Retries get a new key, the ledger makes sure that the like is sent only once
+            queue.publish(SWIPE, {'account': account.name, 'user': user_dict, 'action': SwipeAction.like.value},
+                          key=f'{account.name}:{user_dict["_id"]}:{time.time()}')
+
+        recommendation_buffer = RecommendationBuffer(service)
+        try:
+            for nr_profiles_checked, user in enumerate(recommendation_buffer, start=1):
+                if queue.publish(JUDGE, {'account': account.name, 'user': user.d},
+                                 key=f'{account.name}:{user.id}:{word_list_version}'):
+                    nr_published += 1
+                if nr_profiles_checked >= nr_profiles:
+                    break
+        finally:
+            recommendation_buffer.close()
+    finally:
+        ledger.close()
+        service.close()
+    Logger.log('Published %d new users of %s', nr_published, account.name, level=1, account=account.name)
+    return nr_published
+
+
+class _AccountContext:
+    """
+    Service, ledger, swipe history and swipe scheduler of an account, created by a worker when it first needs them
+    """
+
+    def __init__(self, account: Account):
+        self.account = account
+        self.service = TinderService(SecretsStore(account.secrets_file))
+        self.ledger = SwipeLedger(account.ledger_file)
+        self.swipe_history = SwipeHistory(account.swipe_history_dir)
+        self.swipe_scheduler = SwipeScheduler(self.service, self.ledger)
+
+    def close(self):
+        try:
+            self.swipe_scheduler.close()
+        finally:
+            self.swipe_history.flush()
+            self.ledger.close()
+            self.service.close()
+
+
+class Worker:
+    """
+    Lease jobs of the given topics from the queue and handle them, until stopped
+
+    A job is acknowledged when it was handled, and released for a retry when it failed. Judging and creating
+    collages give the same result when they are repeated. Swipes are claimed in the ledger of the account before
+    they are sent, for as long as the job is leased, such that no other worker sends the same swipe meanwhile.
+    A swipe is recorded in the same transaction that marks it as sent, so it is recorded exactly once, even when
+    its job is retried. It is only sent again if the worker dies between sending and recording it.
+    """
+
+    POLL_INTERVAL = 0.5  # Number of seconds to wait before asking again when no job is available
+
+    def __init__(self, queue: WorkQueue, topics: List[str] = None, accounts: List[Account] = None):
+        self.queue = queue
+        self.topics = topics or TOPICS
+        self.worker_id = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self._accounts = {account.name: account for account in accounts or []}
+        self._contexts: Dict[str, _AccountContext] = dict()
+        self._profile_judge: Optional[ProfileJudge] = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+
+    def run(self, nr_threads: int = 1, stop_when_idle: bool = False):
+        """
+        Handle jobs in the given number of threads
+
+        :param stop_when_idle: Return as soon as no job is available, instead of waiting for new jobs
+        """
+
+        threads = [threading.Thread(target=self._work, args=(stop_when_idle,), name=f'Worker-{index}')
+                   for index in range(nr_threads)]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            self.stop()
+            for thread in threads:
+                thread.join()
+
+    def stop(self):
+        """
+        Stop leasing new jobs, the jobs that are being handled are finished
+        """
+
+        self._stopped.set()
+
+    def close(self):
+        for context in self._contexts.values():
+            context.close()
+        if self._profile_judge is not None:
+            self._profile_judge.flush()
+
+    def handle(self, job: Job):
+        handlers = {JUDGE: self._judge, SWIPE: self._swipe, COLLAGE: self._collage}
+        with Metrics.timer('work_job_seconds', topic=job.topic):
+            handlers[job.topic](self._get_context(job.payload['account']), TinderUser(job.payload['user']), job)
+
+    def _work(self, stop_when_idle: bool):
+        while not self._stopped.is_set():
+            job = self.queue.lease(self.topics, self.worker_id)
+            if job is None:
+                if stop_when_idle:
+                    return
+                self._stopped.wait(self.POLL_INTERVAL)
+                continue
+
+            try:
+                self.handle(job)
+            except Exception as e:
+                Metrics.count('work_errors_total', topic=job.topic)
+                Logger.log('%r failed: %r', job, e, topic=job.topic, attempts=job.attempts)
+                self.queue.nack(job, repr(e))
+                if job.topic == SWIPE and not isinstance(e, SubmissionClaimed):
+                    # The swipe scheduler does not recover from an error, so the retry starts with a new one
+                    self._discard_context(job.payload['account'])
+            else:
+                self.queue.ack(job)
+
+    def _get_context(self, account_name: str) -> _AccountContext:
+        with self._lock:
+            if account_name not in self._contexts:
+                account = self._accounts.get(account_name) or Account(account_name)
+                self._contexts[account_name] = _AccountContext(account)
+            return self._contexts[account_name]
+
+    def _discard_context(self, account_name: str):
+        with self._lock:
+            context = self._contexts.pop(account_name, None)
+        if context is not None:
+            try:
+                context.close()
+            except Exception:
+                pass  # The error of the scheduler has already been reported
+
+    def _get_profile_judge(self) -> ProfileJudge:
+        with self._lock:
+            if self._profile_judge is None:
+                self._profile_judge = ProfileJudge()
+            return self._profile_judge
+
+    def _judge(self, context: _AccountContext, user: TinderUser, job: Job):
+        profile_judge = self._get_profile_judge()
+        action = profile_judge.like_or_nope(user)
+        self.queue.publish(SWIPE, {'account': context.account.name, 'user': user.d, 'action': action.value},
+                           key=f'{context.account.name}:{user.id}:{profile_judge.word_list_version}')
+
+    def _swipe(self, context: _AccountContext, user: TinderUser, job: Job):
+        action = SwipeAction(job.payload['action'])
+        ledger = context.ledger
+        if action == SwipeAction.no_action:
+            return
+        # The claim expires with the lease of the job, when another worker may take over the job
+        if not ledger.claim_submission(user.id, action, self.worker_id, datetime.fromtimestamp(job.lease_until)):
+            Logger.log('%s has already been swiped', user.name, level=1, user_id=user.id)
+            ledger.remove_pending_like(user.id)
+            return
+
+        try:
+            if action == SwipeAction.like:
+                match = context.swipe_scheduler.like(user)
+                if match is None:
+                    # The like is parked in the ledger, and published again by the next fetch
+                    ledger.release_submission(user.id, self.worker_id)
+                    return
+                status = Status.matched if match else Status.liked
+                self._complete_swipe(context, user, status)
+                self.queue.publish(COLLAGE, {'account': context.account.name, 'user': user.d,
+                                             'status': status.value}, key=f'{context.account.name}:{user.id}')
+            else:
+                status = Status.noped
+                context.swipe_scheduler.nope(user, on_sent=partial(self._complete_swipe, context, status=status))
+                context.swipe_scheduler.flush()
+        except BaseException:
+            # Whether the swipe was sent is unknown, so let the retry send it again rather than wait for the claim
+            ledger.release_submission(user.id, self.worker_id)
+            raise
+        Metrics.count('swipes_total', action=action.value, status=status.value)
+        Logger.log('%s %s', status.value.capitalize(), user.name, level=1, user_id=user.id, status=status.value,
+                   account=context.account.name)
+
+    def _complete_swipe(self, context: _AccountContext, user: TinderUser, status: Status):
+        """
+        Record the swipe that was sent, unless another worker took over the claim and records it
+        """
+
+        if context.ledger.complete_submission(user.id, self.worker_id, status):
+            context.swipe_history.record(user, status)
+            # Workers keep no state of their own, so the history is written right away
+            context.swipe_history.flush()
+
+    @staticmethod
+    def _collage(context: _AccountContext, user: TinderUser, job: Job):
+        collage_creator = CollageCreator(context.account.img_dir)
+        urls = [collage_creator.select_photo_url(photo) for photo in user.photos[:MAX_NUMBER_OF_PHOTOS]]
+        photos = collage_creator.download_photo_bytes(urls)
+        render_collage(user, photos, Status(job.payload['status']), context.account.img_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('command', choices=['fetch', 'work', 'demo'],
+                        help='publish recommendations, handle jobs, or do both in this process with an in-memory queue')
+    parser.add_argument('--accounts', nargs='+', metavar='NAME',
+                        help='accounts to fetch for, by default all accounts in the accounts directory')
+    parser.add_argument('--profiles', type=int, default=10, help='number of profiles to fetch per account')
+    parser.add_argument('--topics', nargs='+', choices=TOPICS, default=TOPICS, help='topics to handle')
+    parser.add_argument('--threads', type=int, default=1, help='number of worker threads')
+    parser.add_argument('--until-idle', action='store_true', help='stop working when no jobs are available')
+    parser.add_argument('--queue', help='path of the SQLite work queue, by default in the data directory')
+    args = parser.parse_args()
+
+    Logger.max_level = 1
+    accounts_dir = common.get_dir('accounts')
+    names = args.accounts or [name for name in sorted(os.listdir(accounts_dir))
+                              if os.path.isfile(os.path.join(accounts_dir, name, 'secrets.json'))]
+    accounts = [Account(name) for name in names]
+
+    queue = MemoryWorkQueue() if args.command == 'demo' else SqliteWorkQueue(args.queue)
+    if args.command in ('fetch', 'demo'):
+        for account in accounts:
+            publish_recommendations(queue, account, args.profiles)
+    if args.command in ('work', 'demo'):
+        worker = Worker(queue, args.topics, accounts)
+        try:
+            worker.run(args.threads, stop_when_idle=args.until_idle or args.command == 'demo')
+        finally:
+            worker.close()
+    for topic in TOPICS:
+        Logger.log('%s: %d done, %d failed', topic, queue.nr_jobs(topic, WorkQueue.DONE),
+                   queue.nr_jobs(topic, WorkQueue.FAILED))
+    Logger.flush()
+
+
+if __name__ == '__main__':
+    main()
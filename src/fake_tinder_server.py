@@ -0,0 +1,321 @@
+"""
+Local stand-in for the Tinder API, to exercise the bot without the real API
+
+It implements the endpoints that TinderService and TinderAuthenticator use, and serves photos of its own profiles.
+Latency, server errors, token expiry and running out of likes can be configured.
+"""
+
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from PIL import Image
+
+import common
+from type_hinting import TinderUserDict
+
+
+class FakeProfileGenerator:
+    """
+    Generator of synthetic Tinder users, based on the users in test_data/liked_users.json
+
+    The templates have the format of TinderUser.as_dict. Each generated user is a variation of a random template,
+    in the format that the Tinder API returns.
+    """
+
+    NAMES = ['Anna', 'Emma', 'Julia', 'Lisa', 'Sophie', 'Eva', 'Fleur', 'Iris', 'Sanne', 'Lotte']
+    SCHOOL_NAMES = ['Universiteit van Amsterdam', 'Vrije Universiteit', 'Hogeschool Utrecht', 'Universiteit Leiden',
+                    'Hogeschool van Amsterdam', 'Technische Universiteit Delft', 'ROC Midden Nederland']
+    NR_PHOTOS = (1, 6)  # Minimum and maximum number of photos per user
+    PHOTO_SIZES = [(640, 800), (320, 400), (172, 216), (84, 106)]
+
+    def __init__(self, image_base_url: str, seed: int = 0, templates_file: str = None):
+        templates_file = templates_file or os.path.join(os.path.dirname(__file__), '..', 'test_data',
+                                                        'liked_users.json')
+        with open(templates_file, 'r') as f:
+            self.templates: List[Dict[str, Any]] = json.load(f)
+        self.image_base_url = image_base_url
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def generate(self) -> TinderUserDict:
+        with self._lock:
+            template = self._random.choice(self.templates)
+            name = self._random.choice(self.NAMES + [template.get('name', 'User')])
+            user_id = uuid.UUID(int=self._random.getrandbits(128)).hex[:24]
+            age = max(18, template.get('age', 30) + self._random.randint(-5, 5))
+            distance_km = max(0, template.get('distance', 20) * self._random.uniform(0.2, 12))
+            nr_photos = self._random.randint(*self.NR_PHOTOS)
+            schools = [{'name': name} for name in template.get('school_names', '').split(', ') if name]
+            if self._random.random() < 0.5:
+                schools.append({'name': self._random.choice(self.SCHOOL_NAMES)})
+            bio = template.get('bio', '') if self._random.random() < 0.7 else ''
+
+        birth_date = datetime.now() - timedelta(days=365 * age + 100)
+        return {
+            '_id': user_id,
+            'name': name,
+            'bio': bio,
+            'birth_date': birth_date.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+            'distance_mi': distance_km / 1.609,
+            'jobs': self._parse_jobs(template.get('jobs', '')),
+            'schools': schools,
+            'photos': [self._photo(user_id) for _ in range(nr_photos)],
+        }
+
+    def _photo(self, user_id: str) -> Dict[str, Any]:
+        photo_id = uuid.uuid4().hex
+        return {
+            'id': photo_id,
+            'url': f'{self.image_base_url}/{user_id}/original_{photo_id}.jpeg',
+            'processedFiles': [{'width': width, 'height': height,
+                                'url': f'{self.image_base_url}/{user_id}/{width}x{height}_{photo_id}.jpg'}
+                               for width, height in self.PHOTO_SIZES],
+        }
+
+    @staticmethod
+    def _parse_jobs(jobs: str) -> List[Dict[str, Dict[str, str]]]:
+        result = []
+        for job in filter(None, jobs.split(', ')):
+            title, _, company = job.partition(' - ')
+            result.append({'title': {'name': title}, 'company': {'name': company}} if company
+                          else {'title': {'name': title}})
+        return result
+
+
+class FakeTinderServer:
+    """
+    HTTP server that behaves like the parts of the Tinder API that the bot uses
+
+    - latency: (minimum, maximum) number of seconds each request takes
+    - error_rate: fraction of requests that fail with a 503
+    - token_lifetime: number of seconds after which an access token expires and requests return a 401
+    - likes_per_period: number of likes after which the likes are exhausted for rate_limit_period seconds
+    - max_recs: maximum number of recommendations returned per request, regardless of the requested count
+    - nr_recs: total number of recommendations before the deck is empty, None for an endless deck
+    - match_rate: fraction of likes that result in a match
+    - repeat_rate: fraction of recommendations that are users who were recommended before
+    """
+
+    ORIGINAL_SIZE = (1080, 1350)
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: Tuple[float, float] = (0.0, 0.0),
+                 error_rate: float = 0.0, token_lifetime: float = 3600, likes_per_period: int = 100,
+                 rate_limit_period: float = 12 * 3600, max_recs: int = 20, nr_recs: Optional[int] = None,
+                 match_rate: float = 0.05, repeat_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.token_lifetime = token_lifetime
+        self.likes_per_period = likes_per_period
+        self.rate_limit_period = rate_limit_period
+        self.max_recs = max_recs
+        self.nr_recs_left = nr_recs
+        self.match_rate = match_rate
+        self.repeat_rate = repeat_rate
+
+        self.user_id = 'fake_own_user_id'
+        self.refresh_token = 'fake_refresh_token'
+        self.request_times: Dict[str, List[float]] = defaultdict(list)  # Endpoint -> seconds per request
+        self.status_counts: Dict[int, int] = defaultdict(int)
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens: Dict[str, float] = dict()  # Access token -> expiry time
+        self._users: Dict[str, TinderUserDict] = dict()
+        self._likes_remaining = likes_per_period
+        self._rate_limited_until: Optional[float] = None
+        self._images: Dict[Tuple[int, int], bytes] = dict()
+
+        self._httpd = ThreadingHTTPServer((host, port), self._create_handler())
+        self._httpd.daemon_threads = True
+        self.base_url = f'http://{host}:{self._httpd.server_port}'
+        self.profiles = FakeProfileGenerator(f'{self.base_url}/images', seed=seed)
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> 'FakeTinderServer':
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='FakeTinderServer', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> 'FakeTinderServer':
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def handle(self, method: str, path: str, query: Dict[str, List[str]], headers,
+               body: Optional[Dict[str, Any]]) -> Tuple[int, str, bytes]:
+        """
+        Return the status code, content type and content of the response to the given request
+        """
+
+        time.sleep(self._random.uniform(*self.latency))
+        if self._random.random() < self.error_rate:
+            return self._json(503, {'error': 'Injected server error'})
+
+        if path.startswith('/images/'):
+            return self._image(path)
+        if method == 'POST' and path == '/v2/auth/login/sms':
+            return self._login(body or {})
+
+        token = headers.get('X-Auth-Token')
+        with self._lock:
+            expires_at = self._tokens.get(token)
+        if expires_at is None or expires_at < time.time():
+            return self._json(401, {'error': 'Unauthorized'})
+
+        if method == 'GET' and path == '/user/recs':
+            return self._recs(int(query.get('count', ['1'])[0]))
+        match = re.fullmatch(r'/(user|like|pass)/([^/]+)', path)
+        if method == 'GET' and match:
+            endpoint, user_id = match.groups()
+            if endpoint == 'user':
+                return self._user(user_id)
+            elif endpoint == 'like':
+                return self._like()
+            else:
+                return self._json(200, {'status': 200})
+        return self._json(404, {'error': 'Not found'})
+
+    def _login(self, body: Dict[str, Any]) -> Tuple[int, str, bytes]:
+        if body.get('refresh_token') != self.refresh_token:
+            return self._json(401, {'error': 'Invalid refresh token'})
+        api_token = str(uuid.uuid4())
+        with self._lock:
+            self._tokens[api_token] = time.time() + self.token_lifetime
+        return self._json(200, {'data': {'_id': self.user_id, 'api_token': api_token,
+                                         'refresh_token': self.refresh_token, 'is_new_user': False}})
+
+    def _recs(self, count: int) -> Tuple[int, str, bytes]:
+        with self._lock:
+            count = min(count, self.max_recs)
+            if self.nr_recs_left is not None:
+                count = min(count, self.nr_recs_left)
+                self.nr_recs_left -= count
+        if count <= 0:
+            return self._json(200, {'message': 'recs timeout'})
+
+        with self._lock:
+            users = [self._random.choice(list(self._users.values()))
+                     if self._users and self._random.random() < self.repeat_rate else self.profiles.generate()
+                     for _ in range(count)]
+            for user in users:
+                self._users[user['_id']] = user
+        return self._json(200, {'status': 200, 'results': users})
+
+    def _user(self, user_id: str) -> Tuple[int, str, bytes]:
+        with self._lock:
+            user = self._users.get(user_id)
+        if user is None:
+            user = self.profiles.generate()
+            user['_id'] = user_id
+        return self._json(200, {'status': 200, 'results': user})
+
+    def _like(self) -> Tuple[int, str, bytes]:
+        with self._lock:
+            now = time.time()
+            if self._rate_limited_until is not None and self._rate_limited_until <= now:
+                self._rate_limited_until = None
+                self._likes_remaining = self.likes_per_period
+            if self._likes_remaining <= 0:
+                self._rate_limited_until = self._rate_limited_until or now + self.rate_limit_period
+                # A refused like has no match
+                return self._json(200, {'status': 200, 'likes_remaining': 0,
+                                        'rate_limited_until': int(self._rate_limited_until * 1000)})
+            self._likes_remaining -= 1
+            content = {'status': 200, 'match': self._random.random() < self.match_rate,
+                       'likes_remaining': self._likes_remaining}
+            if self._likes_remaining == 0:
+                # Like the real API, the last like already tells until when the likes are exhausted
+                self._rate_limited_until = now + self.rate_limit_period
+                content['rate_limited_until'] = int(self._rate_limited_until * 1000)
+        return self._json(200, content)
+
+    def _image(self, path: str) -> Tuple[int, str, bytes]:
+        match = re.search(r'/(\d+)x(\d+)_[^/]+$', path)
+        size = (int(match.group(1)), int(match.group(2))) if match else self.ORIGINAL_SIZE
+        with self._lock:
+            data = self._images.get(size)
+        if data is None:
+            output = BytesIO()
+            color = tuple(self._random.randint(0, 255) for _ in range(3))
+            Image.new(mode='RGB', size=size, color=color).save(output, format='JPEG', quality=90)
+            data = output.getvalue()
+            with self._lock:
+                self._images[size] = data
+        return 200, 'image/jpeg', data
+
+    @staticmethod
+    def endpoint(method: str, path: str) -> str:
+        """
+        Return the endpoint of a request, e.g. "GET /like/{id}", to group request times by
+        """
+
+        if path.startswith('/images/'):
+            return f'{method} /images'
+        if path != '/user/recs':
+            path = re.sub(r'^/(user|like|pass)/[^/]+$', r'/\1/{id}', path)
+        return f'{method} {path}'
+
+    @staticmethod
+    def _json(status: int, content: Any) -> Tuple[int, str, bytes]:
+        return status, 'application/json', json.dumps(content).encode()
+
+    def _create_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # Keep connections alive, like the real API
+
+            def do_GET(self):
+                self._respond('GET')
+
+            def do_POST(self):
+                self._respond('POST')
+
+            def _respond(self, method: str):
+                start = time.perf_counter()
+                url = urlparse(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                status, content_type, content = server.handle(method, url.path, parse_qs(url.query),
+                                                              self.headers, body)
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+                with server._lock:
+                    server.request_times[server.endpoint(method, url.path)].append(time.perf_counter() - start)
+                    server.status_counts[status] += 1
+
+            def log_message(self, format, *args):
+                # Do not print every request
+                pass
+
+        return Handler
+
+
+if __name__ == '__main__':
+    with FakeTinderServer(latency=(0.05, 0.2), port=8080) as fake_server:
+        print(f'Fake Tinder API running at {fake_server.base_url}, refresh token: {fake_server.refresh_token}')
+        print(f'Data directory for the bot: set {common.PROJECT_DIR_VARIABLE} to use a separate directory')
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
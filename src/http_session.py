@@ -0,0 +1,266 @@
+import asyncio
+import json
+import random
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from metrics import Metrics
+
+
+class HttpError(Exception):
+    """
+    Raised when an HTTP call returns an unsuccessful status code after all retries
+    """
+
+    def __init__(self, status_code: int, text: str):
+        super().__init__(f'HTTP {status_code}: {text}')
+        self.status_code = status_code
+        self.text = text
+
+
+class JitterRetry(Retry):
+    """
+    Retry strategy with exponential backoff plus a random jitter
+
+    The jitter prevents many parallel requests that failed at the same moment to all retry at the same moment again.
+    """
+
+    BACKOFF_JITTER = 0.5  # Maximum number of seconds added to each backoff
+
+    def get_backoff_time(self) -> float:
+        backoff = super().get_backoff_time()
+        if backoff <= 0:
+            return backoff
+        return backoff + random.uniform(0, self.BACKOFF_JITTER)
+
+    def increment(self, *args, **kwargs) -> Retry:
+        Metrics.count('http_retries_total', client='requests')
+        return super().increment(*args, **kwargs)
+
+
+class TimeoutSession(requests.Session):
+    """
+    Session that applies a default (connect, read) timeout to every request that does not specify one
+    """
+
+    def __init__(self, timeout: Tuple[float, float]):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+class HttpSession:
+    """
+    Shared HTTP session with keep-alive connection pooling, bounded retries and explicit timeouts
+
+    All API calls and image downloads go through the same session, such that TCP connections and TLS sessions
+    are reused instead of being set up again for every request.
+    """
+
+    CONNECT_TIMEOUT = 5  # Seconds to wait for a connection to be established
+    READ_TIMEOUT = 30  # Seconds to wait for the server to send a response
+
+    RETRIES = 3  # Maximum number of retries for connection errors and server errors
+    BACKOFF_FACTOR = 0.5  # Sleep between retries: backoff_factor * 2 ** (retry number - 1), plus jitter
+    RETRY_STATUSES = (500, 502, 503, 504)
+
+    DEFAULT_POOL_SIZE = 4  # Maximum number of connections kept alive per host, if not specified below
+    HOST_POOL_SIZES: Dict[str, int] = {
+        'https://api.gotinder.com': 10,
+        'https://images-ssl.gotinder.com': 12,
+    }
+
+    _session: Optional[requests.Session] = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls) -> requests.Session:
+        """
+        Return the process-wide session, creating it on first use
+        """
+
+        if cls._session is None:
+            with cls._lock:
+                if cls._session is None:
+                    cls._session = cls._create_session()
+        return cls._session
+
+    @classmethod
+    def close(cls):
+        with cls._lock:
+            if cls._session is not None:
+                cls._session.close()
+                cls._session = None
+
+    @classmethod
+    def backoff_time(cls, retry_number: int) -> float:
+        """
+        Return the number of seconds to sleep before the given retry (starting at 1), following the sync strategy
+        """
+
+        if retry_number <= 1:
+            return 0
+        return cls.BACKOFF_FACTOR * 2 ** (retry_number - 1) + random.uniform(0, JitterRetry.BACKOFF_JITTER)
+
+    @classmethod
+    def retry(cls) -> Retry:
+        return JitterRetry(
+            total=cls.RETRIES,
+            connect=cls.RETRIES,
+            read=cls.RETRIES,
+            status=cls.RETRIES,
+            backoff_factor=cls.BACKOFF_FACTOR,
+            status_forcelist=cls.RETRY_STATUSES,
+            raise_on_status=False,  # Return the last response, such that we can raise an HttpError with its content
+        )
+
+    @classmethod
+    def _create_session(cls) -> requests.Session:
+        session = TimeoutSession(timeout=(cls.CONNECT_TIMEOUT, cls.READ_TIMEOUT))
+        default_adapter = HTTPAdapter(pool_connections=len(cls.HOST_POOL_SIZES) + 1,
+                                      pool_maxsize=cls.DEFAULT_POOL_SIZE, max_retries=cls.retry())
+        session.mount('https://', default_adapter)
+        session.mount('http://', default_adapter)
+        for prefix, pool_size in cls.HOST_POOL_SIZES.items():
+            session.mount(prefix, HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=cls.retry()))
+        return session
+
+
+class AsyncResponse:
+    """
+    Fully read response of an AsyncHttpSession, with the same attributes as a requests.Response that we use
+    """
+
+    def __init__(self, status_code: int, content: bytes):
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    @property
+    def text(self) -> str:
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self) -> Any:
+        return json.loads(self.content)
+
+
+class AsyncHttpSession:
+    """
+    Asyncio counterpart of HttpSession, built on aiohttp with the same pool sizes, retries and timeouts
+
+    An instance is bound to the event loop it is first used in.
+    """
+
+    IDEMPOTENT_METHODS = frozenset(['HEAD', 'GET', 'PUT', 'DELETE', 'OPTIONS', 'TRACE'])
+
+    def __init__(self):
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def request(self, method: str, url: str, **kwargs) -> AsyncResponse:
+        """
+        Perform the request, retrying connection errors and server errors with exponential backoff
+
+        Like urllib3, read errors and server errors are only retried for idempotent methods.
+        """
+
+        session = self._get_session()
+        retry_number = 0
+        while True:
+            retry_number += 1
+            if retry_number > 1:
+                Metrics.count('http_retries_total', client='aiohttp')
+            try:
+                with Metrics.timer('http_request_seconds', client='aiohttp', method=method):
+                    async with session.request(method, url, **kwargs) as response:
+                        content = await response.read()
+                        result = AsyncResponse(response.status, content)
+                Metrics.count('http_responses_total', client='aiohttp', status=result.status_code)
+            except aiohttp.ClientConnectorError:
+                if retry_number > HttpSession.RETRIES:
+                    raise
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if retry_number > HttpSession.RETRIES or method.upper() not in self.IDEMPOTENT_METHODS:
+                    raise
+            else:
+                if (result.status_code not in HttpSession.RETRY_STATUSES
+                        or retry_number > HttpSession.RETRIES
+                        or method.upper() not in self.IDEMPOTENT_METHODS):
+                    return result
+            await asyncio.sleep(HttpSession.backoff_time(retry_number))
+
+    async def get(self, url: str, **kwargs) -> AsyncResponse:
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> AsyncResponse:
+        return await self.request('POST', url, **kwargs)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=sum(HttpSession.HOST_POOL_SIZES.values()),
+                                             limit_per_host=max(HttpSession.HOST_POOL_SIZES.values()))
+            timeout = aiohttp.ClientTimeout(sock_connect=HttpSession.CONNECT_TIMEOUT,
+                                            sock_read=HttpSession.READ_TIMEOUT)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+
+
+class BackgroundEventLoop:
+    """
+    Event loop running forever in a daemon thread
+
+    This allows synchronous code, possibly in several threads, to run coroutines on one shared loop, such that
+    they share the connection pools of the asynchronous clients. Never call run() from within the loop itself.
+    """
+
+    _instance: Optional['BackgroundEventLoop'] = None
+    _lock = threading.Lock()
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name='BackgroundEventLoop', daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def get(cls) -> 'BackgroundEventLoop':
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def run(self, coroutine, timeout: float = None) -> Any:
+        """
+        Run the coroutine on the background loop, block until it is finished and return its result
+        """
+
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout)
+
+
+def ensure_ok(response: requests.Response) -> requests.Response:
+    """
+    Raise an HttpError if the response does not have a successful status code
+    """
+
+    if not response.ok:
+        raise HttpError(response.status_code, response.text)
+    return response
+
+
+if __name__ == '__main__':
+    print(HttpSession.get().adapters)
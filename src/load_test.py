@@ -0,0 +1,166 @@
+"""
+Load test: run the TinderBot against a FakeTinderServer and report throughput and latencies
+
+All data (word lists, secrets, ledger, collages) is written to a temporary directory, such that the load test
+never touches the real data of the bot.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Dict, List, Sequence
+
+import common
+from fake_tinder_server import FakeTinderServer
+
+PERCENTILES = (50, 90, 99)
+
+# Word lists of the judges, such that the generated profiles get liked, noped and left for review
+WORD_LISTS = {
+    'name_approve_words.json': ['anna', 'emma', 'julia'],
+    'name_reject_words.json': ['john', 'lisa', 'eva'],
+    'school_approve_words.json': ['universiteit van amsterdam', 'technische universiteit delft'],
+    'school_reject_words.json': ['my university', 'roc midden nederland', 'hogeschool utrecht'],
+}
+
+
+def percentiles(values: Sequence[float]) -> Dict[int, float]:
+    """
+    Return the given percentiles of the values, by the nearest rank method
+    """
+
+    values = sorted(values)
+    if not values:
+        return {percentile: float('nan') for percentile in PERCENTILES}
+    return {percentile: values[min(len(values) - 1, max(0, round(percentile / 100 * len(values)) - 1))]
+            for percentile in PERCENTILES}
+
+
+def format_latencies(name: str, seconds: List[float]) -> str:
+    result = ', '.join(f'p{percentile} = {value * 1000:.1f} ms'
+                       for percentile, value in percentiles(seconds).items())
+    return f'{name:<24} n = {len(seconds):<6} {result}'
+
+
+def run_load_test(nr_profiles: int, server: FakeTinderServer, nope_delay: float, print_metrics: bool = False,
+                  log_level: int = 0):
+    # The data directory is read when these modules are imported, so they can only be imported
+    # after PATINDERBOT_DIR has been set
+    from logger import Logger
+    from metrics import Metrics
+    from tinder_authenticator import TinderAuthenticator
+    from swipe_scheduler import SwipeScheduler
+    from tinder_bot import TinderBot
+    from tinder_service import AsyncTinderService
+
+    AsyncTinderService.base_url = server.base_url
+    TinderAuthenticator.base_url = server.base_url
+    SwipeScheduler.NOPE_DELAY = (nope_delay, nope_delay)
+    Metrics.enabled = print_metrics
+    Logger.max_level = log_level
+    Logger.add_file(os.path.join(common.get_dir('data'), 'load_test.log'))
+
+    tinder_bot = TinderBot()
+    swipe_times = []
+    swipe = tinder_bot._swipe
+
+    def timed_swipe(item):
+        start = time.perf_counter()
+        try:
+            return swipe(item)
+        finally:
+            swipe_times.append(time.perf_counter() - start)
+
+    tinder_bot._swipe = timed_swipe
+    start = time.perf_counter()
+    try:
+        tinder_bot.run(nr_profiles=nr_profiles)
+        duration = time.perf_counter() - start
+        Logger.flush()
+        print_results(tinder_bot, server, swipe_times, duration, print_metrics)
+    finally:
+        close_bot(tinder_bot)
+
+
+def print_results(tinder_bot, server: FakeTinderServer, swipe_times: List[float], duration: float,
+                  print_metrics: bool):
+    from metrics import Metrics
+
+    nr_swiped = len(swipe_times)
+    print(f'\n{nr_swiped} profiles in {duration:.2f} s: {nr_swiped / duration:.2f} profiles/s')
+    print(f'Liked: {tinder_bot.ledger.nr_liked_today}, matched: {tinder_bot.ledger.nr_matched_today}, '
+          f'parked: {tinder_bot.ledger.nr_pending_likes}')
+    print(format_latencies('swipe (client)', swipe_times))
+    for endpoint, seconds in sorted(server.request_times.items()):
+        print(format_latencies(endpoint, seconds))
+    print(f'Seen profiles: {tinder_bot.seen_profiles.hits} skipped, {tinder_bot.seen_profiles.misses} new')
+    print(f'Status codes: {dict(sorted(server.status_counts.items()))}')
+    if print_metrics:
+        print(f'\n{Metrics.prometheus_text()}')
+
+
+def close_bot(tinder_bot):
+    """
+    Write and close everything of the bot that is in the data directory, also after a failed run
+
+    This must happen before the data directory is removed, instead of in the exit handlers of the judges.
+    """
+
+    from logger import Logger
+
+    for close in (tinder_bot.swipe_scheduler.close, tinder_bot.profile_judge.flush, tinder_bot.seen_profiles.close,
+                  tinder_bot.swipe_history.flush, tinder_bot.collage_renderer.close, tinder_bot.ledger.close,
+                  tinder_bot.service.close, Logger.flush):
+        try:
+            close()
+        except Exception as e:
+            print(f'Closing the bot failed: {e!r}')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--profiles', type=int, default=200, help='number of profiles to swipe')
+    parser.add_argument('--latency', type=float, nargs=2, default=(0.01, 0.05), metavar=('MIN', 'MAX'),
+                        help='minimum and maximum latency of the server in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests that return a 503')
+    parser.add_argument('--token-lifetime', type=float, default=3600, help='seconds until an access token expires')
+    parser.add_argument('--likes', type=int, default=100, help='number of likes before the likes run out')
+    parser.add_argument('--rate-limit-period', type=float, default=12 * 3600,
+                        help='seconds until the likes are available again after they ran out')
+    parser.add_argument('--max-recs', type=int, default=20, help='maximum number of recommendations per request')
+    parser.add_argument('--repeat-rate', type=float, default=0.0,
+                        help='fraction of recommendations that were recommended before')
+    parser.add_argument('--nope-delay', type=float, default=0.0, help='seconds to wait after each nope')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the generated profiles')
+    parser.add_argument('--log-level', type=int, default=0, help='maximum level of the messages of the bot')
+    parser.add_argument('--metrics', action='store_true', help='print the metrics of the bot afterwards')
+    parser.add_argument('--keep', action='store_true', help='keep the data directory afterwards')
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix='patinderbot_load_test_')
+    os.environ[common.PROJECT_DIR_VARIABLE] = data_dir
+    server = FakeTinderServer(latency=tuple(args.latency), error_rate=args.error_rate,
+                              token_lifetime=args.token_lifetime, likes_per_period=args.likes,
+                              rate_limit_period=args.rate_limit_period,
+                              max_recs=args.max_recs, repeat_rate=args.repeat_rate, seed=args.seed)
+    shutil.copy(os.path.join(os.path.dirname(__file__), '..', 'json', 'secrets_template.json'),
+                os.path.join(common.get_dir('json'), 'secrets_template.json'))
+    with open(os.path.join(common.get_dir('json'), 'secrets.json'), 'w') as f:
+        json.dump({'TINDER_REFRESH_TOKEN': server.refresh_token}, f)
+    for filename, words in WORD_LISTS.items():
+        with open(os.path.join(common.get_dir('json'), filename), 'w') as f:
+            json.dump(words, f)
+
+    print(f'Load test against {server.base_url}, data in {data_dir}')
+    try:
+        with server:
+            run_load_test(args.profiles, server, args.nope_delay, args.metrics, args.log_level)
+    finally:
+        if not args.keep:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,140 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from typing import Any, List, Optional
+
+
+class _TextFormatter(logging.Formatter):
+    """
+    Plain text, indented by the level of the message
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        return '    ' * record.depth + record.getMessage()
+
+
+class _JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line, with the time, level, message and all structured fields of the message
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {'time': round(record.created, 6), 'level': record.depth, 'message': record.getMessage()}
+        entry.update(record.fields)
+        return json.dumps(entry, default=str)
+
+
 class Logger:
+    """
+    Log messages without blocking the caller
+
+    Messages are put on a queue, and a background thread formats and writes them to the sinks: stdout, and
+    optionally rotating JSON lines files. Formatting is lazy: pass the arguments separately, as in
+    Logger.log('Judging %s', user, level=1), and the message is only formatted when it is written.
+    Keyword arguments are structured fields, which are written to the JSON lines sinks.
+    """
+
     max_level = 0  # Do not print messages with a level higher than this max_level
+    json_console = False  # Write JSON lines instead of plain text to stdout
+
+    MAX_FILE_SIZE = 10 * 1024 * 1024  # Number of bytes after which a log file is rotated
+    NR_BACKUP_FILES = 5  # Number of rotated log files that are kept
+
+    _file_handlers: List[logging.Handler] = []
+    _queue: Optional[queue.SimpleQueue] = None
+    _writer: Optional[threading.Thread] = None
+    _pid: Optional[int] = None
+    _lock = threading.Lock()
 
     @staticmethod
-    def log(msg: str, level: int = 0):
+    def log(msg: str, *args: Any, level: int = 0, **fields: Any):
         if level <= Logger.max_level:
-            print('    ' * level + msg)
+            record = logging.LogRecord('PATinderBot', logging.INFO, '', 0, msg, args or None, None)
+            record.depth = level
+            record.fields = fields
+            Logger._get_queue().put(record)
+
+    @staticmethod
+    def is_enabled(level: int) -> bool:
+        """
+        Return whether messages of the given level are written, to skip building expensive arguments
+        """
+
+        return level <= Logger.max_level
+
+    @classmethod
+    def add_file(cls, path: str, max_bytes: int = None, backup_count: int = None):
+        """
+        Also write all messages as JSON lines to the given file, which is rotated when it grows too large
+        """
+
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes or cls.MAX_FILE_SIZE,
+                                                       backupCount=backup_count or cls.NR_BACKUP_FILES,
+                                                       encoding='utf-8')
+        handler.setFormatter(_JsonFormatter())
+        with cls._lock:
+            cls._file_handlers = cls._file_handlers + [handler]
+
+    @classmethod
+    def flush(cls, timeout: float = 5):
+        """
+        Wait until all messages that have been logged so far are written
+        """
+
+        if cls._queue is None or cls._pid != os.getpid():
+            return
+        done = threading.Event()
+        cls._queue.put(done)
+        done.wait(timeout)
+
+    @classmethod
+    def _get_queue(cls) -> queue.SimpleQueue:
+        if cls._pid != os.getpid():
+            # Start the writer on first use, and again in a forked worker process, which has no writer thread
+            with cls._lock:
+                if cls._pid != os.getpid():
+                    cls._queue = queue.SimpleQueue()
+                    cls._writer = threading.Thread(target=cls._write, args=(cls._queue,), name='Logger',
+                                                   daemon=True)
+                    cls._writer.start()
+                    if cls._pid is None:
+                        atexit.register(cls.flush)
+                    cls._pid = os.getpid()
+        return cls._queue
+
+    @classmethod
+    def _write(cls, messages: queue.SimpleQueue):
+        text_formatter = _TextFormatter()
+        json_formatter = _JsonFormatter()
+        while True:
+            record = messages.get()
+            if isinstance(record, threading.Event):
+                sys.stdout.flush()
+                record.set()
+                continue
+            try:
+                formatter = json_formatter if cls.json_console else text_formatter
+                print(formatter.format(record))
+                for handler in cls._file_handlers:
+                    handler.handle(record)
+            except Exception as e:
+                # A message that cannot be formatted must not stop the writer
+                print(f'Could not log {record.msg!r}: {e!r}', file=sys.stderr)
 
 
 if __name__ == '__main__':
     Logger.max_level = 1
     Logger.log("Let's start", level=0)
-    Logger.log('Hello world', level=1)
+    Logger.log('Hello %s', 'world', level=1, greeting='hello')
     Logger.log('The quick brown fox jumps over the lazy dog', level=2)
+    start = time.perf_counter()
+    for i in range(10000):
+        Logger.log('Message %d', i, level=2)
+    print(f'10000 filtered messages in {time.perf_counter() - start:.4f} s')
+    Logger.flush()
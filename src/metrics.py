@@ -0,0 +1,229 @@
+import bisect
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Tuple
+
+from logger import Logger
+
+Labels = Tuple[Tuple[str, str], ...]  # Sorted (name, value) pairs that identify one series of a metric
+
+_DISABLED_TIMER = nullcontext()
+
+
+class Histogram:
+    """
+    Distribution of observed values over fixed buckets, plus their count and sum, like a Prometheus histogram
+    """
+
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)  # The last bucket holds the values above the largest bound
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, counts: List[int], total: float):
+        self.counts = [own + other for own, other in zip(self.counts, counts)]
+        self.count += sum(counts)
+        self.sum += total
+
+
+class Metrics:
+    """
+    Counters and latency histograms of the stages of the bot
+
+    Like Logger, this is configured on the class: nothing is recorded unless Metrics.enabled is set, in which case
+    every call returns right after checking that flag. The metrics can be exported in the Prometheus text format,
+    over HTTP with serve(), or as a JSON snapshot file with write_snapshots().
+    """
+
+    enabled = False
+
+    _counters: Dict[str, Dict[Labels, float]] = dict()
+    _histograms: Dict[str, Dict[Labels, Histogram]] = dict()
+    _lock = threading.Lock()
+
+    @classmethod
+    def count(cls, name: str, value: float = 1, **labels: Any):
+        if not cls.enabled:
+            return
+        key = cls._labels(labels)
+        with cls._lock:
+            series = cls._counters.setdefault(name, dict())
+            series[key] = series.get(key, 0) + value
+
+    @classmethod
+    def observe(cls, name: str, value: float, **labels: Any):
+        if not cls.enabled:
+            return
+        key = cls._labels(labels)
+        with cls._lock:
+            series = cls._histograms.setdefault(name, dict())
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    @classmethod
+    def timer(cls, name: str, **labels: Any):
+        """
+        Return a context manager that observes the number of seconds its block takes
+        """
+
+        if not cls.enabled:
+            return _DISABLED_TIMER
+        return cls._timer(name, labels)
+
+    @classmethod
+    @contextmanager
+    def _timer(cls, name: str, labels: Dict[str, Any]) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            cls.observe(name, time.perf_counter() - start, **labels)
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._counters = dict()
+            cls._histograms = dict()
+
+    @classmethod
+    def snapshot(cls) -> Dict[str, Any]:
+        """
+        Return all metrics as a JSON serializable dictionary, which can be merged into the metrics of another process
+        """
+
+        with cls._lock:
+            return {
+                'timestamp': time.time(),
+                'counters': {name: [{'labels': dict(key), 'value': value} for key, value in series.items()]
+                             for name, series in cls._counters.items()},
+                'histograms': {name: [{'labels': dict(key), 'buckets': list(Histogram.BUCKETS),
+                                       'counts': list(histogram.counts), 'count': histogram.count,
+                                       'sum': histogram.sum}
+                                      for key, histogram in series.items()]
+                               for name, series in cls._histograms.items()},
+            }
+
+    @classmethod
+    def merge(cls, snapshot: Dict[str, Any]):
+        """
+        Add the metrics of a snapshot, for example one that was taken in a worker process
+        """
+
+        if not cls.enabled:
+            return
+        for name, series in snapshot.get('counters', {}).items():
+            for entry in series:
+                cls.count(name, entry['value'], **entry['labels'])
+        with cls._lock:
+            for name, series in snapshot.get('histograms', {}).items():
+                for entry in series:
+                    histograms = cls._histograms.setdefault(name, dict())
+                    key = cls._labels(entry['labels'])
+                    histograms.setdefault(key, Histogram()).merge(entry['counts'], entry['sum'])
+
+    @classmethod
+    def prometheus_text(cls) -> str:
+        """
+        Return all metrics in the Prometheus text exposition format
+        """
+
+        lines = []
+        with cls._lock:
+            for name, series in sorted(cls._counters.items()):
+                lines.append(f'# TYPE {name} counter')
+                for key, value in series.items():
+                    lines.append(f'{name}{cls._format_labels(key)} {value}')
+            for name, series in sorted(cls._histograms.items()):
+                lines.append(f'# TYPE {name} histogram')
+                for key, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(Histogram.BUCKETS + (float('inf'),), histogram.counts):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        lines.append(f'{name}_bucket{cls._format_labels(key + (("le", le),))} {cumulative}')
+                    lines.append(f'{name}_sum{cls._format_labels(key)} {histogram.sum}')
+                    lines.append(f'{name}_count{cls._format_labels(key)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    @classmethod
+    def serve(cls, port: int = 9100, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+        """
+        Serve the metrics in the Prometheus text format at http://<host>:<port>/metrics from a daemon thread
+        """
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                content = cls.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name='MetricsServer', daemon=True).start()
+        Logger.log('Serving metrics at http://%s:%d/metrics', host, server.server_port, level=1)
+        return server
+
+    @classmethod
+    def write_snapshot(cls, path: str):
+        directory = os.path.dirname(path) or '.'
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.metrics', suffix='.tmp')
+        with os.fdopen(fd, 'w') as fp:
+            json.dump(cls.snapshot(), fp, indent=2)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def write_snapshots(cls, path: str, interval: float = 60) -> threading.Event:
+        """
+        Write a JSON snapshot to the given path every interval seconds, until the returned event is set
+        """
+
+        stop = threading.Event()
+
+        def write_periodically():
+            while not stop.wait(interval):
+                cls.write_snapshot(path)
+
+        threading.Thread(target=write_periodically, name='MetricsSnapshots', daemon=True).start()
+        return stop
+
+    @staticmethod
+    def _labels(labels: Dict[str, Any]) -> Labels:
+        return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+    @staticmethod
+    def _format_labels(key: Labels) -> str:
+        if not key:
+            return ''
+        escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in key)
+        return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(key, escaped)) + '}'
+
+
+if __name__ == '__main__':
+    Metrics.enabled = True
+    for _ in range(3):
+        with Metrics.timer('stage_seconds', stage='judge'):
+            time.sleep(0.01)
+        Metrics.count('swipes_total', action='like')
+    print(Metrics.prometheus_text())
@@ -0,0 +1,142 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import common
+
+
+class PhotoCache:
+    """
+    Persistent cache of downloaded photos, with a size budget and least recently used eviction
+
+    Entries are stored as files named after a hash of their key. Files are written to a temporary file first
+    and then renamed, such that a crash never leaves a half written entry behind. The modification time of an
+    entry is updated when it is read, such that the least recently used entries can be found after a restart.
+    """
+
+    MAX_SIZE = 200 * 1024 * 1024  # Maximum total size of all cached photos in bytes
+    EXTENSION = '.jpg'
+    TMP_MAX_AGE = 60 * 60  # Number of seconds after which a temporary file is assumed to be left behind by a crash
+
+    _default: Optional['PhotoCache'] = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, directory: str = None, max_size: int = None):
+        self.directory = directory or os.path.join(common.get_dir('cache'), 'photos')
+        self.max_size = max_size or self.MAX_SIZE
+        self.hits = 0
+        self.misses = 0
+
+        common.ensure_dir_exists(self.directory)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # File name -> size in bytes, from least to most recently used
+        self._total_size = 0
+        self._load_index()
+
+    @classmethod
+    def default(cls) -> 'PhotoCache':
+        """
+        Return the process-wide cache, creating it on first use
+        """
+
+        if cls._default is None:
+            with cls._default_lock:
+                if cls._default is None:
+                    cls._default = cls()
+        return cls._default
+
+    @staticmethod
+    def key(url: str) -> str:
+        """
+        Return the cache key of the photo at the given url, as it was downloaded
+        """
+
+        return hashlib.sha1(url.encode()).hexdigest()
+
+    @property
+    def hit_rate(self) -> float:
+        nr_requests = self.hits + self.misses
+        return self.hits / nr_requests if nr_requests else 0.0
+
+    def get(self, key: str) -> Optional[bytes]:
+        filename = key + self.EXTENSION
+        with self._lock:
+            if filename not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(filename)
+
+        filepath = os.path.join(self.directory, filename)
+        try:
+            with open(filepath, 'rb') as f:
+                data = f.read()
+            os.utime(filepath)
+        except OSError:
+            # The entry was evicted or removed in the meantime
+            with self._lock:
+                self._forget(filename)
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes):
+        filename = key + self.EXTENSION
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, os.path.join(self.directory, filename))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            self._forget(filename)
+            self._entries[filename] = len(data)
+            self._total_size += len(data)
+            self._evict()
+
+    def _load_index(self):
+        entries = []
+        now = time.time()
+        for filename in os.listdir(self.directory):
+            filepath = os.path.join(self.directory, filename)
+            try:
+                stat = os.stat(filepath)
+                if filename.endswith('.tmp'):
+                    # Left behind by a crash during a write. Recent ones can be writes of other processes
+                    # that share the cache, which are still in progress.
+                    if now - stat.st_mtime > self.TMP_MAX_AGE:
+                        os.remove(filepath)
+                elif filename.endswith(self.EXTENSION):
+                    entries.append((stat.st_mtime, filename, stat.st_size))
+            except FileNotFoundError:
+                pass  # Renamed or evicted by another process in the meantime
+        for _, filename, size in sorted(entries):
+            self._entries[filename] = size
+            self._total_size += size
+        self._evict()
+
+    def _evict(self):
+        # Only called while holding the lock
+        while self._total_size > self.max_size and self._entries:
+            filename, size = self._entries.popitem(last=False)
+            self._total_size -= size
+            try:
+                os.remove(os.path.join(self.directory, filename))
+            except FileNotFoundError:
+                pass
+
+    def _forget(self, filename: str):
+        # Only called while holding the lock
+        size = self._entries.pop(filename, None)
+        if size is not None:
+            self._total_size -= size
@@ -0,0 +1,161 @@
+import queue
+import threading
+import time
+from typing import Any, Callable, Iterable, List, Optional
+
+from logger import Logger
+from metrics import Metrics
+
+_SENTINEL = object()  # Put in a stage queue to indicate that no more items will follow
+
+
+class Stage:
+    """
+    One step of a Pipeline: worker threads applying a function to the items of a bounded input queue
+
+    The function returns the item to pass on to the next stage, or None to drop it.
+    If the stage is ordered, its results are passed on in the order in which the items arrived,
+    even if they are processed by several workers at the same time.
+    """
+
+    def __init__(self, name: str, func: Callable[[Any], Any], concurrency: int = 1, queue_size: int = 10,
+                 ordered: bool = True):
+        assert concurrency >= 1
+        self.name = name
+        self.func = func
+        self.concurrency = concurrency
+        self.ordered = ordered
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stopped = threading.Event()  # When set, remaining items are consumed but not processed anymore
+
+        self._next_stage: Optional['Stage'] = None
+        self._on_error: Optional[Callable[['Stage', BaseException], None]] = None
+        self._workers: List[threading.Thread] = []
+        self._nr_running = 0
+        self._next_in_seq = 0  # Sequence number of the next input item that is allowed to be passed on
+        self._next_out_seq = 0  # Sequence number given to the next output item
+        self._pending = dict()  # Results of ordered items that have to wait for an earlier item to finish
+        self._lock = threading.Lock()
+
+    def start(self, next_stage: Optional['Stage'], on_error: Callable[['Stage', BaseException], None]):
+        self._next_stage = next_stage
+        self._on_error = on_error
+        self._nr_running = self.concurrency
+        for index in range(self.concurrency):
+            worker = threading.Thread(target=self._work, name=f'{self.name}-{index}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def put(self, seq: int, item: Any):
+        self.queue.put((seq, item))
+
+    def close(self):
+        """
+        Indicate that no more items will be put in this stage
+        """
+
+        for _ in range(self.concurrency):
+            self.queue.put(_SENTINEL)
+
+    def join(self):
+        for worker in self._workers:
+            worker.join()
+
+    def _work(self):
+        while True:
+            entry = self.queue.get()
+            if entry is _SENTINEL:
+                break
+
+            seq, item = entry
+            result = None
+            if not self.stopped.is_set():
+                start = time.perf_counter()
+                try:
+                    result = self.func(item)
+                except BaseException as e:
+                    Metrics.count('pipeline_errors_total', stage=self.name)
+                    self._on_error(self, e)
+                seconds = time.perf_counter() - start
+                Metrics.observe('pipeline_stage_seconds', seconds, stage=self.name)
+                Logger.log('Stage %s took %.3f s', self.name, seconds, level=3, stage=self.name, seconds=seconds)
+            self._emit(seq, result)
+
+        with self._lock:
+            self._nr_running -= 1
+            is_last_worker = self._nr_running == 0
+        if is_last_worker and self._next_stage is not None:
+            # All items of this stage have been passed on, so the next stage can finish too
+            self._next_stage.close()
+
+    def _emit(self, seq: int, result: Any):
+        with self._lock:
+            if not self.ordered:
+                self._pass_on(result)
+                return
+
+            self._pending[seq] = result
+            while self._next_in_seq in self._pending:
+                self._pass_on(self._pending.pop(self._next_in_seq))
+                self._next_in_seq += 1
+
+    def _pass_on(self, result: Any):
+        # Only called while holding the lock, such that output sequence numbers are handed out in order.
+        # If the next stage is full, this blocks the workers of this stage: that is the backpressure.
+        if result is None or self._next_stage is None:
+            return
+        self._next_stage.put(self._next_out_seq, result)
+        self._next_out_seq += 1
+
+
+class Pipeline:
+    """
+    Chain of stages connected by bounded queues
+
+    Items from the source enter the first stage. Since all queues are bounded, a slow stage blocks the stages
+    before it, up to the source. When a stage fails, no new items are read from the source, the failing stage
+    and all stages before it discard the items they still have, and the stages after it drain their in-flight
+    work. The first error is then raised from run().
+    """
+
+    def __init__(self, stages: List[Stage]):
+        assert stages
+        self.stages = stages
+        self._error: Optional[BaseException] = None
+        self._error_lock = threading.Lock()
+
+    def run(self, source: Iterable[Any]):
+        for index, stage in enumerate(self.stages):
+            next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+            stage.start(next_stage, self._on_error)
+
+        first_stage = self.stages[0]
+        try:
+            for seq, item in enumerate(source):
+                if first_stage.stopped.is_set():
+                    break
+                first_stage.put(seq, item)
+        except BaseException as e:
+            # Also stop on errors in the source, and on KeyboardInterrupt
+            self._on_error(None, e)
+        finally:
+            first_stage.close()
+            for stage in self.stages:
+                stage.join()
+
+        if self._error is not None:
+            raise self._error
+
+    def _on_error(self, failed_stage: Optional[Stage], error: BaseException):
+        with self._error_lock:
+            if self._error is None:
+                self._error = error
+                stage_name = failed_stage.name if failed_stage else 'source'
+                Logger.log('Pipeline stopped in stage %s: %r', stage_name, error, level=1)
+        if failed_stage is None:
+            # The source stopped, but everything it produced is still handled
+            return
+        for stage in self.stages:
+            stage.stopped.set()
+            if stage is failed_stage:
+                break
@@ -0,0 +1,116 @@
+import threading
+from collections import deque
+from typing import Deque, Iterator, Optional, Set
+
+from logger import Logger
+from metrics import Metrics
+from tinder_service import TinderService
+from tinder_user import TinderUser
+
+
+class RecommendationBuffer:
+    """
+    Local buffer of recommended users, refilled in the background
+
+    Recommendations are requested in batches. The batch size adapts to what Tinder actually returns:
+    it grows while full batches are returned and is capped at the returned number otherwise. When Tinder has
+    no recommendations left, the refill backs off exponentially instead of asking again immediately.
+    """
+
+    INITIAL_BATCH_SIZE = 10
+    MIN_BATCH_SIZE = 1
+    MAX_BATCH_SIZE = 50
+    LOW_WATER_MARK = 5  # Start a refill when fewer users than this are buffered
+
+    MIN_BACKOFF = 5  # Seconds to wait after the first empty batch
+    MAX_BACKOFF = 300  # Maximum number of seconds to wait between two requests for an empty batch
+
+    def __init__(self, service: TinderService):
+        self.service = service
+        self.batch_size = self.INITIAL_BATCH_SIZE
+        self._batch_size_cap = self.MAX_BATCH_SIZE
+
+        self._users: Deque[TinderUser] = deque()
+        self._user_ids: Set[str] = set()  # Ids of the buffered users, to skip users Tinder returns twice
+        self._backoff = 0
+        self._error: Optional[BaseException] = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._refill, name='RecommendationBuffer', daemon=True)
+        self._thread.start()
+
+    def __iter__(self) -> Iterator[TinderUser]:
+        """
+        Yield recommended users until the buffer is closed, waiting for a refill when the buffer is empty
+        """
+
+        while True:
+            with self._condition:
+                while not self._users and self._error is None and not self._closed:
+                    self._condition.wait()
+                if self._error is not None:
+                    raise self._error
+                if self._closed:
+                    return
+                user = self._users.popleft()
+                self._user_ids.discard(user.id)
+                # Wake up the refill thread, in case we dropped below the low water mark
+                self._condition.notify_all()
+            yield user
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def _refill(self):
+        while True:
+            with self._condition:
+                while len(self._users) >= self.LOW_WATER_MARK and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                batch_size = self.batch_size
+
+            try:
+                with Metrics.timer('recommendations_fetch_seconds'):
+                    users = list(self.service.get_recommendations(count=batch_size))
+                Metrics.count('recommendations_total', len(users))
+            except BaseException as e:
+                with self._condition:
+                    self._error = e
+                    self._condition.notify_all()
+                return
+
+            self._adapt_batch_size(requested=batch_size, returned=len(users))
+            with self._condition:
+                for user in users:
+                    if user.id not in self._user_ids:
+                        self._users.append(user)
+                        self._user_ids.add(user.id)
+                self._condition.notify_all()
+
+                if not users:
+                    self._backoff = min(max(2 * self._backoff, self.MIN_BACKOFF), self.MAX_BACKOFF)
+                    Logger.log('No recommendations, trying again in %s seconds', self._backoff, level=1)
+                    # Waiting on the condition instead of sleeping allows close() to interrupt the backoff
+                    self._condition.wait_for(lambda: self._closed, timeout=self._backoff)
+                else:
+                    self._backoff = 0
+
+    def _adapt_batch_size(self, requested: int, returned: int):
+        if returned >= requested:
+            # Tinder had enough recommendations, so we can ask for more at once
+            self.batch_size = min(2 * requested, self._batch_size_cap)
+        elif returned > 0:
+            # Tinder seems to return at most this number of users at once, so stop growing the batch size
+            self._batch_size_cap = max(returned, self.MIN_BATCH_SIZE)
+            self.batch_size = self._batch_size_cap
+        else:
+            # A previous partial batch may have been caused by running out of recommendations,
+            # so after an empty batch we allow the batch size to grow again
+            self._batch_size_cap = self.MAX_BATCH_SIZE
@@ -1,10 +1,19 @@
 import json
 import os.path
+import tempfile
+import threading
+from contextlib import contextmanager
 from shutil import copyfile
-from typing import Any, Dict
+from typing import Any, Dict, Iterator, Optional, Tuple
 
 import common
 
+try:
+    import fcntl
+except ImportError:
+    # Advisory file locks are not available on Windows, there we only lock between threads
+    fcntl = None
+
 SECRETS_FILE = os.path.join(common.get_dir('json'), 'secrets.json')
 SECRETS_TEMPLATE_FILE = os.path.join(common.get_dir('json'), 'secrets_template.json')
 
@@ -15,24 +24,106 @@ TINDER_ACCESS_TOKEN = 'TINDER_ACCESS_TOKEN'
 TINDER_REFRESH_TOKEN = 'TINDER_REFRESH_TOKEN'
 
 
-def _read_secrets_file() -> Dict[str, Any]:
-    if not os.path.isfile(SECRETS_FILE):
-        copyfile(SECRETS_TEMPLATE_FILE, SECRETS_FILE)
-    with open(SECRETS_FILE, 'r') as f:
-        return json.load(f)
+class SecretsStore:
+    """
+    Secrets file, cached in memory
+
+    The parsed file is only read again when it changed on disk. Writes go to a temporary file that replaces
+    the secrets file, under an advisory lock, such that a crash or a second process never leaves a corrupt
+    secrets file behind.
+    """
+
+    def __init__(self, path: str = SECRETS_FILE, template_path: str = SECRETS_TEMPLATE_FILE):
+        self.path = path
+        self.template_path = template_path
+        self._secrets: Dict[str, Any] = dict()
+        self._file_version: Optional[Tuple[int, int, int]] = None  # Inode, modification time and size of the file
+        self._lock = threading.RLock()
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            self._reload_if_changed()
+            return self._secrets.get(key)
+
+    def set(self, key: str, value: Any):
+        self.update({key: value})
+
+    def update(self, values: Dict[str, Any]):
+        """
+        Set all given keys in one write
+        """
+
+        with self.batch() as secrets:
+            secrets.update(values)
+
+    @contextmanager
+    def batch(self) -> Iterator[Dict[str, Any]]:
+        """
+        Yield the current secrets for modification, and write them once the block finishes without errors
 
+        The file stays locked during the block, such that no other process can write in between.
+        """
 
-def _write_secrets_file(secrets: Dict[str, Any]):
-    with open(SECRETS_FILE, 'w') as fp:
-        return json.dump(secrets, fp, indent=2)
+        with self._lock, self._file_lock():
+            self._reload_if_changed()
+            secrets = dict(self._secrets)
+            yield secrets
+            self._write(secrets)
+
+    def _reload_if_changed(self):
+        if not os.path.isfile(self.path):
+            copyfile(self.template_path, self.path)
+        file_version = self._get_file_version()
+        if file_version != self._file_version:
+            with open(self.path, 'r') as f:
+                self._secrets = json.load(f)
+            self._file_version = file_version
+
+    def _write(self, secrets: Dict[str, Any]):
+        directory = os.path.dirname(self.path)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.secrets', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as fp:
+                json.dump(secrets, fp, indent=2)
+                fp.flush()
+                os.fsync(fp.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._secrets = secrets
+        self._file_version = self._get_file_version()
+
+    def _get_file_version(self) -> Tuple[int, int, int]:
+        # Since every write replaces the file, the inode changes even if the modification time does not
+        stat = os.stat(self.path)
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    @contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        if fcntl is None:
+            yield
+            return
+        # Lock a separate file, since the secrets file itself is replaced on every write
+        with open(self.path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+default_store = SecretsStore()
 
 
 def get_from_secrets(key: str) -> Any:
-    secrets = _read_secrets_file()
-    return secrets.get(key)
+    return default_store.get(key)
 
 
 def set_in_secrets(key: str, value: Any):
-    secrets = _read_secrets_file()
-    secrets[key] = value
-    _write_secrets_file(secrets)
+    default_store.set(key, value)
+
+
+def update_secrets(values: Dict[str, Any]):
+    default_store.update(values)
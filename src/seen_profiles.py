@@ -0,0 +1,214 @@
+import hashlib
+import math
+import os
+import sqlite3
+import struct
+import threading
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+import common
+from enums import SwipeAction
+from logger import Logger
+
+
+class BloomFilter:
+    """
+    Compact set of strings that can answer "definitely not in the set" without false negatives
+
+    Membership tests have a small chance of a false positive, which is the error rate while the filter holds
+    at most its capacity.
+    """
+
+    _HEADER = struct.Struct('<4sQQI')  # Magic, capacity, number of added items, number of hash functions
+    _MAGIC = b'BLM1'
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.nr_bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.nr_hashes = max(1, round(self.nr_bits / capacity * math.log(2)))
+        self.nr_items = 0
+        self._bits = bytearray((self.nr_bits + 7) // 8)
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.nr_items += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def to_bytes(self) -> bytes:
+        return self._HEADER.pack(self._MAGIC, self.capacity, self.nr_items, self.nr_hashes) + bytes(self._bits)
+
+    @classmethod
+    def from_bytes(cls, data: bytes, error_rate: float) -> Optional['BloomFilter']:
+        """
+        Return the filter stored in the given bytes, or None if they do not contain a filter with the given error rate
+        """
+
+        if len(data) < cls._HEADER.size:
+            return None
+        magic, capacity, nr_items, nr_hashes = cls._HEADER.unpack_from(data)
+        bloom_filter = cls(capacity, error_rate)
+        bits = data[cls._HEADER.size:]
+        if magic != cls._MAGIC or nr_hashes != bloom_filter.nr_hashes or len(bits) != len(bloom_filter._bits):
+            return None
+        bloom_filter.nr_items = nr_items
+        bloom_filter._bits = bytearray(bits)
+        return bloom_filter
+
+    def _positions(self, item: str):
+        # Double hashing: the positions of the k hash functions are derived from two 64 bit hashes
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1, h2 = struct.unpack('<QQ', digest)
+        return ((h1 + i * h2) % self.nr_bits for i in range(self.nr_hashes))
+
+
+class SeenProfile(NamedTuple):
+    action: SwipeAction
+    word_list_version: str
+    timestamp: datetime
+
+
+class SeenProfileIndex:
+    """
+    Persistent index of the users that have been judged, with their verdict and the word list version it was made in
+
+    The exact record is kept in an SQLite database. In front of it, a Bloom filter answers for the large majority
+    of users, the ones that have never been seen, without a query. The Bloom filter is saved next to the database,
+    together with the number of users it contains: when that number does not match the database, for example
+    after a crash, the filter is rebuilt from the database.
+    """
+
+    CAPACITY = 100000  # Initial number of users the Bloom filter is sized for, it is doubled when it is full
+    ERROR_RATE = 0.01  # Fraction of the unseen users for which the database is queried anyway
+    SAVE_INTERVAL = 100  # Number of added users after which the Bloom filter is saved
+
+    def __init__(self, path: str = None):
+        self.path = path or os.path.join(common.get_dir('data'), 'seen_profiles.sqlite3')
+        self.bloom_path = os.path.splitext(self.path)[0] + '.bloom'
+        self.hits = 0
+        self.misses = 0
+        self._nr_unsaved = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute('''
+            CREATE TABLE IF NOT EXISTS seen_profiles (
+                user_id TEXT PRIMARY KEY,
+                action TEXT NOT NULL,
+                word_list_version TEXT NOT NULL,
+                timestamp REAL NOT NULL
+            )
+        ''')
+        self._bloom_filter = self._load_bloom_filter()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM seen_profiles').fetchone()[0]
+
+    def __contains__(self, user_id: str) -> bool:
+        return self.get(user_id) is not None
+
+    def get(self, user_id: str) -> Optional[SeenProfile]:
+        """
+        Return the last verdict for the given user, or None if the user has not been judged before
+        """
+
+        with self._lock:
+            if user_id not in self._bloom_filter:
+                self.misses += 1
+                return None
+            row = self._connection.execute(
+                'SELECT action, word_list_version, timestamp FROM seen_profiles WHERE user_id = ?', (user_id,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return SeenProfile(SwipeAction(row[0]), row[1], datetime.fromtimestamp(row[2]))
+
+    def add(self, user_id: str, action: SwipeAction, word_list_version: str):
+        """
+        Record the verdict for the given user, replacing an earlier one
+        """
+
+        with self._lock:
+            values = (action.value, word_list_version, datetime.now().timestamp(), user_id)
+            cursor = self._connection.execute('INSERT OR IGNORE INTO seen_profiles '
+                                              '(action, word_list_version, timestamp, user_id) VALUES (?, ?, ?, ?)',
+                                              values)
+            if cursor.rowcount == 0:
+                self._connection.execute('UPDATE seen_profiles SET action = ?, word_list_version = ?, timestamp = ? '
+                                         'WHERE user_id = ?', values)
+                return
+
+            self._bloom_filter.add(user_id)
+            self._nr_unsaved += 1
+            if self._bloom_filter.nr_items > self._bloom_filter.capacity:
+                self._bloom_filter = self._build_bloom_filter(2 * self._bloom_filter.capacity)
+            if self._nr_unsaved >= self.SAVE_INTERVAL:
+                self._save_bloom_filter()
+
+    def flush(self):
+        """
+        Save the Bloom filter
+        """
+
+        with self._lock:
+            if self._nr_unsaved:
+                self._save_bloom_filter()
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._connection.close()
+
+    def _load_bloom_filter(self) -> BloomFilter:
+        nr_users = self._connection.execute('SELECT COUNT(*) FROM seen_profiles').fetchone()[0]
+        if os.path.exists(self.bloom_path):
+            with open(self.bloom_path, 'rb') as f:
+                bloom_filter = BloomFilter.from_bytes(f.read(), self.ERROR_RATE)
+            if bloom_filter is not None and bloom_filter.nr_items == nr_users:
+                return bloom_filter
+
+        capacity = self.CAPACITY
+        while capacity < nr_users:
+            capacity *= 2
+        bloom_filter = self._build_bloom_filter(capacity)
+        self._save_bloom_filter(bloom_filter)
+        Logger.log('Built the seen profiles filter from %d users', nr_users, level=2)
+        return bloom_filter
+
+    def _build_bloom_filter(self, capacity: int) -> BloomFilter:
+        bloom_filter = BloomFilter(capacity, self.ERROR_RATE)
+        for (user_id,) in self._connection.execute('SELECT user_id FROM seen_profiles'):
+            bloom_filter.add(user_id)
+        return bloom_filter
+
+    def _save_bloom_filter(self, bloom_filter: BloomFilter = None):
+        # Write to a temporary file first, such that a crash never leaves a half written filter behind
+        tmp_path = self.bloom_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write((bloom_filter or self._bloom_filter).to_bytes())
+        os.replace(tmp_path, self.bloom_path)
+        self._nr_unsaved = 0
+
+
+if __name__ == '__main__':
+    import tempfile
+    import time
+
+    Logger.max_level = 1
+    with tempfile.TemporaryDirectory() as directory:
+        index = SeenProfileIndex(os.path.join(directory, 'seen_profiles.sqlite3'))
+        start = time.perf_counter()
+        for i in range(10000):
+            index.add(f'user{i}', SwipeAction.nope, 'v1')
+        print(f'Added 10000 users in {time.perf_counter() - start:.3f} s')
+        start = time.perf_counter()
+        nr_seen = sum(index.get(f'user{i}') is not None for i in range(5000, 25000))
+        print(f'Looked up 20000 users in {time.perf_counter() - start:.3f} s, {nr_seen} seen')
+        index.close()
@@ -0,0 +1,320 @@
+"""
+Columnar history of all swipes, for fast offline analysis
+
+Each column is a NumPy .npy file of fixed width values, which can be memory mapped and analysed without reading
+or parsing anything else. Strings that repeat a lot, such as names, jobs and schools, are dictionary encoded:
+the column holds an index into a list of distinct values, or -1 for an empty value.
+
+Directory structure:
+swipe_history
+- manifest.json: number of rows and the state of the imports
+- <column>.npy
+- <column>.dictionary.json, for the dictionary encoded columns
+- append.lock: locked by the process that appends
+"""
+
+import argparse
+import json
+import os
+import struct
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+import common
+from enums import Status
+from logger import Logger
+from swipe_ledger import SwipeLedger
+from tinder_user import TinderUser
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    # Parquet export is optional, the NumPy columns do not need it
+    pyarrow = None
+
+try:
+    import fcntl
+except ImportError:
+    # Advisory file locks are not available on Windows, there we only lock between threads
+    fcntl = None
+
+STATUS_CODES = {status: code for code, status in enumerate(Status)}  # Status as a small integer
+MISSING = -1  # Value of numeric and dictionary encoded columns that is not known, for example for imported swipes
+
+# Column name -> dtype of the stored values. Dictionary encoded columns store int32 indices.
+COLUMNS = {
+    'timestamp': np.dtype('<f8'),  # Seconds since the epoch
+    'status': np.dtype('i1'),  # Index in STATUS_CODES
+    'user_id': np.dtype('S32'),
+    'name': np.dtype('<i4'),
+    'age': np.dtype('<i2'),
+    'distance': np.dtype('<i4'),  # Kilometers
+    'nr_photos': np.dtype('i1'),
+    'bio_length': np.dtype('<i4'),  # Number of characters
+    'jobs': np.dtype('<i4'),
+    'school_names': np.dtype('<i4'),
+}
+DICTIONARY_COLUMNS = ('name', 'jobs', 'school_names')
+
+_NPY_HEADER_SIZE = 128  # Fixed size of the .npy headers, such that the number of rows can be updated in place
+_NPY_PREFIX = b'\x93NUMPY\x01\x00'
+
+Row = Tuple[Any, ...]  # Values in the order of COLUMNS, with strings for the dictionary encoded columns
+
+
+class SwipeHistory:
+    """
+    Append-only columnar dataset of swipes
+
+    Swipes are collected in memory by record() and appended to the columns by flush(), typically once per run.
+    An append writes the new values of all columns first and then the number of rows in the manifest, such that
+    a crash halfway an append leaves the dataset as it was before: the loader only maps the rows in the manifest,
+    and the next append overwrites the rest. Processes that share the dataset, like distributed workers of the same
+    account, append one at a time, each after reading what the others appended.
+    """
+
+    MANIFEST = 'manifest.json'
+
+    def __init__(self, directory: str = None):
+        self.directory = directory or os.path.join(common.get_dir('data'), 'swipe_history')
+        common.ensure_dir_exists(self.directory)
+        self._rows: List[Row] = []
+        self._lock = threading.Lock()
+        self._reload()
+
+    def __len__(self) -> int:
+        return self._manifest['nr_rows']
+
+    def record(self, user: TinderUser, status: Status, timestamp: datetime = None):
+        """
+        Add a swipe, which is written by the next flush
+        """
+
+        timestamp = timestamp or datetime.now()
+        row = (timestamp.timestamp(), STATUS_CODES[status], user.id or '', user.name or '', user.age, user.distance,
+               len(user.photos), len(user.bio or ''), ', '.join(user.jobs), ', '.join(user.school_names))
+        with self._lock:
+            self._rows.append(row)
+
+    def flush(self):
+        """
+        Append the recorded swipes to the columns
+        """
+
+        with self._lock:
+            rows, self._rows = self._rows, []
+            if rows:
+                with self._file_lock():
+                    self._reload()
+                    self._append(rows)
+
+    def import_ledger(self, ledger: SwipeLedger):
+        """
+        Append the swipes in the ledger from before the first swipe in the history, once
+
+        The ledger only knows the user id, the status and the time of a swipe, so the other columns are missing.
+        """
+
+        with self._lock, self._file_lock():
+            self._reload()
+            if self._manifest.get('ledger_imported'):
+                return
+            until = None
+            if len(self):
+                until = datetime.fromtimestamp(float(self.load_columns(['timestamp'])['timestamp'].min()))
+            rows = [(timestamp.timestamp(), STATUS_CODES[status], user_id, '', MISSING, MISSING, MISSING, MISSING,
+                     '', '') for user_id, status, timestamp in ledger.swipes(until=until)]
+            self._append(rows, ledger_imported=True)
+        Logger.log('Imported %d swipes from the ledger', len(rows), level=1)
+
+    def load_columns(self, columns: List[str] = None) -> Dict[str, np.ndarray]:
+        """
+        Return the given columns, by default all, as read-only arrays that are memory mapped from the files
+        """
+
+        nr_rows = len(self)
+        result = dict()
+        for column in columns or COLUMNS:
+            if nr_rows == 0:
+                # An empty file cannot be memory mapped
+                result[column] = np.empty(0, dtype=COLUMNS[column])
+            else:
+                result[column] = np.load(self._column_file(column), mmap_mode='r')[:nr_rows]
+        return result
+
+    def dictionary(self, column: str) -> List[str]:
+        """
+        Return the distinct values of a dictionary encoded column, such that dictionary(column)[code] is the value
+        """
+
+        return list(self._dictionaries[column])
+
+    def decode(self, column: str, codes: np.ndarray) -> List[Optional[str]]:
+        values = self._dictionaries[column]
+        return [values[code] if code != MISSING else None for code in codes]
+
+    def export_parquet(self, path: str):
+        """
+        Write the history as a Parquet file, with the dictionary encoded columns as Arrow dictionary arrays
+        """
+
+        if pyarrow is None:
+            raise ImportError('Exporting to Parquet requires pyarrow')
+        arrays = dict()
+        for column, values in self.load_columns().items():
+            if column in DICTIONARY_COLUMNS:
+                indices = pyarrow.array(values, mask=values == MISSING)
+                arrays[column] = pyarrow.DictionaryArray.from_arrays(indices, self._dictionaries[column])
+            elif column == 'status':
+                arrays[column] = pyarrow.DictionaryArray.from_arrays(pyarrow.array(values),
+                                                                     [status.value for status in Status])
+            elif column == 'user_id':
+                arrays[column] = pyarrow.array(np.char.decode(values, 'ascii'))
+            elif column == 'timestamp':
+                arrays[column] = pyarrow.array((values * 1e6).astype('datetime64[us]'))
+            else:
+                arrays[column] = pyarrow.array(values, mask=values == MISSING)
+        pyarrow.parquet.write_table(pyarrow.table(arrays), path)
+
+    def _reload(self):
+        """
+        Read the manifest and the dictionaries, which other processes may have appended to
+        """
+
+        self._manifest = self._read_manifest()
+        self._dictionaries: Dict[str, List[str]] = {column: self._read_dictionary(column)
+                                                    for column in DICTIONARY_COLUMNS}
+        self._codes: Dict[str, Dict[str, int]] = {column: {value: code for code, value in enumerate(values)}
+                                                  for column, values in self._dictionaries.items()}
+
+    @contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        if fcntl is None:
+            yield
+            return
+        # Lock a separate file, since the manifest and the dictionaries are replaced on every append
+        with open(os.path.join(self.directory, 'append.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _append(self, rows: List[Row], **manifest_fields: Any):
+        nr_rows = len(self)
+        columns = list(zip(*rows)) if rows else [[] for _ in COLUMNS]
+        for (column, dtype), values in zip(COLUMNS.items(), columns):
+            if column in DICTIONARY_COLUMNS:
+                values = [self._encode(column, value) for value in values]
+            elif column == 'user_id':
+                values = [value.encode('ascii', 'replace') for value in values]
+            self._append_column(column, np.array(values, dtype=dtype), nr_rows)
+        for column in DICTIONARY_COLUMNS:
+            self._write_json(self._dictionary_file(column), self._dictionaries[column])
+        self._manifest = {**self._manifest, **manifest_fields, 'nr_rows': nr_rows + len(rows)}
+        self._write_json(os.path.join(self.directory, self.MANIFEST), self._manifest)
+
+    def _encode(self, column: str, value: str) -> int:
+        if not value:
+            return MISSING
+        codes = self._codes[column]
+        if value not in codes:
+            codes[value] = len(self._dictionaries[column])
+            self._dictionaries[column].append(value)
+        return codes[value]
+
+    def _append_column(self, column: str, values: np.ndarray, nr_rows: int):
+        path = self._column_file(column)
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                self._write_npy_header(f, values.dtype, 0)
+        with open(path, 'r+b') as f:
+            # Values beyond the number of rows in the manifest are left over from an interrupted append
+            f.seek(_NPY_HEADER_SIZE + nr_rows * values.dtype.itemsize)
+            f.write(values.tobytes())
+            f.truncate()
+            self._write_npy_header(f, values.dtype, nr_rows + len(values))
+
+    @staticmethod
+    def _write_npy_header(f, dtype: np.dtype, nr_rows: int):
+        """
+        Write a version 1.0 .npy header, padded to a fixed size
+        """
+
+        header = repr({'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': (nr_rows,)})
+        header = header.ljust(_NPY_HEADER_SIZE - len(_NPY_PREFIX) - 2 - 1) + '\n'
+        f.seek(0)
+        f.write(_NPY_PREFIX + struct.pack('<H', len(header)) + header.encode('latin1'))
+
+    def _column_file(self, column: str) -> str:
+        return os.path.join(self.directory, f'{column}.npy')
+
+    def _dictionary_file(self, column: str) -> str:
+        return os.path.join(self.directory, f'{column}.dictionary.json')
+
+    def _read_manifest(self) -> Dict[str, Any]:
+        path = os.path.join(self.directory, self.MANIFEST)
+        if not os.path.exists(path):
+            return {'nr_rows': 0}
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def _read_dictionary(self, column: str) -> List[str]:
+        path = self._dictionary_file(column)
+        if not os.path.exists(path):
+            return []
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    @staticmethod
+    def _write_json(path: str, contents: Any):
+        # Write to a temporary file first, such that a crash never leaves a half written file behind
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(contents, f)
+        os.replace(tmp_path, path)
+
+
+def print_summary(history: SwipeHistory):
+    columns = history.load_columns()
+    print(f'{len(history)} swipes')
+    for status, code in STATUS_CODES.items():
+        selected = columns['status'] == code
+        ages = columns['age'][selected & (columns['age'] != MISSING)]
+        mean_age = f'{ages.mean():.1f}' if len(ages) else '-'
+        print(f'{status.value:<8} {int(selected.sum()):>8} swipes, mean age {mean_age}')
+    schools = columns['school_names'][columns['school_names'] != MISSING]
+    if len(schools):
+        codes, counts = np.unique(schools, return_counts=True)
+        print('Most common schools:')
+        for code, count in sorted(zip(codes, counts), key=lambda item: -item[1])[:10]:
+            print(f'{count:>8} {history.dictionary("school_names")[code]}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('command', choices=['summary', 'import-ledger', 'parquet'])
+    parser.add_argument('path', nargs='?', help='output file of the parquet command')
+    parser.add_argument('--directory', help='directory of the history, by default data/swipe_history')
+    args = parser.parse_args()
+
+    Logger.max_level = 1
+    history = SwipeHistory(args.directory)
+    if args.command == 'import-ledger':
+        ledger = SwipeLedger()
+        ledger.import_img_dirs()
+        history.import_ledger(ledger)
+        ledger.close()
+    elif args.command == 'parquet':
+        history.export_parquet(args.path or os.path.join(common.get_dir('data'), 'swipe_history.parquet'))
+    print_summary(history)
+    Logger.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,288 @@
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+import common
+from enums import Status, SwipeAction
+from logger import Logger
+from type_hinting import TinderUserDict
+
+
+class SubmissionClaimed(Exception):
+    def __init__(self, user_id: str, worker_id: str, lease_until: datetime):
+        super().__init__(f'The swipe of {user_id} is claimed by {worker_id} until {lease_until:%Y-%m-%d %H:%M:%S}')
+        self.user_id = user_id
+        self.worker_id = worker_id
+        self.lease_until = lease_until
+
+
+class SwipeLedger:
+    """
+    Persistent, indexed record of every swipe: which user got which status at what time
+
+    The ledger is an SQLite database in WAL mode, such that counts like "liked today" are answered from an index
+    instead of by listing the collage directories.
+    """
+
+    IMG_IMPORT_DONE = 'img_import_done'  # Meta key that is set once the img directories have been imported
+
+    # States of a swipe submission
+    CLAIMED = 'claimed'
+    SENT = 'sent'
+
+    def __init__(self, path: str = None):
+        self.path = path or os.path.join(common.get_dir('data'), 'swipe_ledger.sqlite3')
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript('''
+            CREATE TABLE IF NOT EXISTS swipes (
+                id INTEGER PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                timestamp REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS swipes_status_timestamp ON swipes (status, timestamp);
+            CREATE INDEX IF NOT EXISTS swipes_user_id ON swipes (user_id);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS pending_likes (
+                user_id TEXT PRIMARY KEY,
+                user TEXT NOT NULL,
+                timestamp REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS swipe_submissions (
+                user_id TEXT PRIMARY KEY,
+                action TEXT NOT NULL,
+                state TEXT NOT NULL,
+                timestamp REAL NOT NULL,
+                worker_id TEXT,
+                lease_until REAL
+            );
+        ''')
+        columns = [row[1] for row in self._connection.execute('PRAGMA table_info(swipe_submissions)')]
+        if 'worker_id' not in columns:
+            # Ledgers from before claims were leased to a worker
+            self._connection.executescript('''
+                ALTER TABLE swipe_submissions ADD COLUMN worker_id TEXT;
+                ALTER TABLE swipe_submissions ADD COLUMN lease_until REAL;
+            ''')
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def record(self, user_id: str, status: Status, timestamp: datetime = None):
+        timestamp = timestamp or datetime.now()
+        with self._lock:
+            self._connection.execute('INSERT INTO swipes (user_id, status, timestamp) VALUES (?, ?, ?)',
+                                     (user_id, status.value, timestamp.timestamp()))
+
+    def count(self, status: Status, since: datetime, until: datetime = None) -> int:
+        """
+        Return the number of swipes with the given status in the given period
+        """
+
+        query = 'SELECT COUNT(*) FROM swipes WHERE status = ? AND timestamp >= ?'
+        params = [status.value, since.timestamp()]
+        if until is not None:
+            query += ' AND timestamp < ?'
+            params.append(until.timestamp())
+        with self._lock:
+            return self._connection.execute(query, params).fetchone()[0]
+
+    def swipes(self, until: datetime = None) -> List[Tuple[str, Status, datetime]]:
+        """
+        Return the user id, status and time of all swipes, optionally only the ones before the given time
+        """
+
+        query = 'SELECT user_id, status, timestamp FROM swipes'
+        params = []
+        if until is not None:
+            query += ' WHERE timestamp < ?'
+            params.append(until.timestamp())
+        with self._lock:
+            rows = self._connection.execute(query + ' ORDER BY timestamp', params).fetchall()
+        return [(user_id, Status(status), datetime.fromtimestamp(timestamp)) for user_id, status, timestamp in rows]
+
+    def last_status(self, user_id: str) -> Optional[Status]:
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT status FROM swipes WHERE user_id = ? ORDER BY timestamp DESC LIMIT 1', (user_id,)
+            ).fetchone()
+        return Status(row[0]) if row else None
+
+    def park_like(self, user_id: str, user_dict: TinderUserDict):
+        """
+        Keep a user that should be liked, while no likes are remaining
+        """
+
+        with self._lock:
+            self._connection.execute('INSERT OR REPLACE INTO pending_likes (user_id, user, timestamp) VALUES (?, ?, ?)',
+                                     (user_id, json.dumps(user_dict), datetime.now().timestamp()))
+
+    def pending_likes(self, limit: int = None) -> List[TinderUserDict]:
+        """
+        Return the parked users, the ones that were parked first come first
+        """
+
+        query = 'SELECT user FROM pending_likes ORDER BY timestamp'
+        if limit is not None:
+            query += f' LIMIT {int(limit)}'
+        with self._lock:
+            return [json.loads(row[0]) for row in self._connection.execute(query)]
+
+    def remove_pending_like(self, user_id: str):
+        with self._lock:
+            self._connection.execute('DELETE FROM pending_likes WHERE user_id = ?', (user_id,))
+
+    def claim_submission(self, user_id: str, action: SwipeAction, worker_id: str, lease_until: datetime) -> bool:
+        """
+        Claim the sending of a swipe to Tinder for the given worker, and return whether it still has to be sent
+
+        A swipe that has been sent is never claimed again. A claim of another worker is respected until its lease
+        expires, after which the worker is assumed to have died and the swipe can be claimed again.
+
+        :raises SubmissionClaimed: when another worker holds a claim that has not expired
+        """
+
+        now = datetime.now().timestamp()
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._connection.execute(
+                    'SELECT state, worker_id, lease_until FROM swipe_submissions WHERE user_id = ?', (user_id,)
+                ).fetchone()
+                is_sent = row is not None and row[0] == self.SENT
+                is_claimed_by_other = (row is not None and not is_sent and row[1] != worker_id
+                                       and (row[2] or 0) > now)
+                if not is_sent and not is_claimed_by_other:
+                    self._connection.execute(
+                        'INSERT OR REPLACE INTO swipe_submissions '
+                        '(user_id, action, state, timestamp, worker_id, lease_until) VALUES (?, ?, ?, ?, ?, ?)',
+                        (user_id, action.value, self.CLAIMED, now, worker_id, lease_until.timestamp()))
+                self._connection.execute('COMMIT')
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+        if is_claimed_by_other:
+            raise SubmissionClaimed(user_id, row[1], datetime.fromtimestamp(row[2]))
+        return not is_sent
+
+    def complete_submission(self, user_id: str, worker_id: str, status: Status) -> bool:
+        """
+        Mark the swipe claimed by the given worker as sent, record it and remove its parked like, all at once
+
+        Returns whether the swipe was recorded. It is not if the claim was lost, because the lease expired and another
+        worker claimed the swipe; that worker records it. A swipe is therefore recorded exactly once. It is only sent
+        twice if a worker dies after sending it and before completing it.
+        """
+
+        now = datetime.now().timestamp()
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                cursor = self._connection.execute(
+                    'UPDATE swipe_submissions SET state = ?, timestamp = ?, lease_until = NULL '
+                    'WHERE user_id = ? AND state = ? AND worker_id = ?',
+                    (self.SENT, now, user_id, self.CLAIMED, worker_id))
+                is_claimed = cursor.rowcount == 1
+                if is_claimed:
+                    self._connection.execute('INSERT INTO swipes (user_id, status, timestamp) VALUES (?, ?, ?)',
+                                             (user_id, status.value, now))
+                    self._connection.execute('DELETE FROM pending_likes WHERE user_id = ?', (user_id,))
+                self._connection.execute('COMMIT')
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+        return is_claimed
+
+    def release_submission(self, user_id: str, worker_id: str):
+        """
+        Give up the claim of the given worker on a swipe that was not sent, for example a like that was parked
+        """
+
+        with self._lock:
+            self._connection.execute('DELETE FROM swipe_submissions WHERE user_id = ? AND state = ? AND worker_id = ?',
+                                     (user_id, self.CLAIMED, worker_id))
+
+    @property
+    def nr_pending_likes(self) -> int:
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM pending_likes').fetchone()[0]
+
+    @property
+    def nr_liked_today(self) -> int:
+        return self.count(Status.liked, since=self._start_of_today())
+
+    @property
+    def nr_matched_today(self) -> int:
+        return self.count(Status.matched, since=self._start_of_today())
+
+    @property
+    def nr_matched_this_week(self) -> int:
+        start_of_today = self._start_of_today()
+        return self.count(Status.matched, since=start_of_today - timedelta(days=start_of_today.weekday()))
+
+    def import_img_dirs(self, img_dir: str = None):
+        """
+        Import the swipes of the collages in the img/<status>/<date> directories, once
+
+        The user id is taken from the file name, the time of the swipe from the modification time of the file.
+        """
+
+        with self._lock:
+            if self._connection.execute('SELECT 1 FROM meta WHERE key = ?', (self.IMG_IMPORT_DONE,)).fetchone():
+                return
+
+        img_dir = img_dir or common.get_dir('img')
+        rows = []
+        for status in Status:
+            status_dir = os.path.join(img_dir, status.value)
+            if not os.path.isdir(status_dir):
+                continue
+            for date_dir in sorted(os.listdir(status_dir)):
+                date_path = os.path.join(status_dir, date_dir)
+                if not os.path.isdir(date_path):
+                    continue
+                for filename in os.listdir(date_path):
+                    if not filename.endswith('.jpg') or '_' not in filename:
+                        continue
+                    user_id = filename[:-len('.jpg')].rsplit('_', 1)[1]
+                    timestamp = os.path.getmtime(os.path.join(date_path, filename))
+                    rows.append((user_id, status.value, timestamp))
+
+        with self._lock:
+            # Another process may have imported the directories since the check above, so check again while
+            # holding the write lock of the database
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                if self._connection.execute('SELECT 1 FROM meta WHERE key = ?', (self.IMG_IMPORT_DONE,)).fetchone():
+                    self._connection.execute('ROLLBACK')
+                    return
+                self._connection.executemany('INSERT INTO swipes (user_id, status, timestamp) VALUES (?, ?, ?)',
+                                             rows)
+                self._connection.execute('INSERT INTO meta (key, value) VALUES (?, ?)',
+                                         (self.IMG_IMPORT_DONE, datetime.now().isoformat()))
+                self._connection.execute('COMMIT')
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+        Logger.log('Imported %d swipes from %s', len(rows), img_dir, level=1)
+
+    @staticmethod
+    def _start_of_today() -> datetime:
+        return datetime.combine(datetime.today(), datetime.min.time())
+
+
+if __name__ == '__main__':
+    Logger.max_level = 1
+    ledger = SwipeLedger()
+    ledger.import_img_dirs()
+    print(f'Liked today: {ledger.nr_liked_today}, matched this week: {ledger.nr_matched_this_week}')
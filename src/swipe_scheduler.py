@@ -0,0 +1,165 @@
+import queue
+import random
+import threading
+import time
+from datetime import datetime
+from typing import Callable, List, Optional, Set
+
+from enums import Status
+from logger import Logger
+from metrics import Metrics
+from swipe_ledger import SwipeLedger
+from tinder_service import OutOfLikes, TinderService
+from tinder_user import TinderUser
+
+_STOP = object()  # Put in the nope queue to stop the nope thread
+
+
+class SwipeScheduler:
+    """
+    Decides when swipes are sent to Tinder, respecting the rate limit on likes and pacing the nopes
+
+    - While Tinder refuses likes, users that should be liked are parked in the ledger, and liked once the
+      rate limit has been reset. Nopes continue in the meantime.
+    - In order to not look like a bot, consecutive nopes are a random time around 1 second apart. The nopes are
+      sent from a separate thread, such that judging, liking and downloading continue while a nope waits.
+      For likes this is not necessary, since we create a photo collage for them, which takes a similar amount
+      of time.
+    """
+
+    NOPE_DELAY = (0.7, 1.2)  # Minimum and maximum number of seconds between two nopes
+    MAX_SCHEDULED_NOPES = 10  # nope() blocks when this many nopes are waiting to be sent
+    MAX_PENDING_LIKES_PER_TAKE = 10  # Maximum number of parked users that take_pending_likes() returns at once
+
+    def __init__(self, service: TinderService, ledger: SwipeLedger):
+        self.service = service
+        self.ledger = ledger
+        self._nopes = queue.Queue(maxsize=self.MAX_SCHEDULED_NOPES)
+        self._next_nope_at = 0.0  # Monotonic time at which the next nope may be sent
+        self._taken_user_ids: Set[str] = set()  # Parked users that are being swiped again
+        self._error: Optional[BaseException] = None
+        self._lock = threading.Lock()
+        self._nope_thread = threading.Thread(target=self._send_nopes, name='SwipeScheduler', daemon=True)
+        self._nope_thread.start()
+
+    @property
+    def rate_limited_until(self) -> Optional[datetime]:
+        return self.service.rate_limited_until
+
+    def can_like(self) -> bool:
+        rate_limited_until = self.rate_limited_until
+        return rate_limited_until is None or rate_limited_until <= datetime.now()
+
+    def like(self, user: TinderUser) -> Optional[bool]:
+        """
+        Like the user, or park them if no likes are remaining
+
+        :return: Flag indicating whether you have a match, or None if the user was parked
+        """
+
+        self._raise_error()
+        if self.can_like():
+            try:
+                match = self.service.like(user)
+            except OutOfLikes as e:
+                Logger.log('%s, parking likes', e, level=1)
+            else:
+                self._forget_pending(user)
+                return match
+
+        self.ledger.park_like(user.id, user.d)
+        with self._lock:
+            self._taken_user_ids.discard(user.id)
+        Metrics.count('likes_parked_total')
+        Logger.log('Parked like of %s', user.name, level=1, user_id=user.id)
+        return None
+
+    def nope(self, user: TinderUser, on_sent: Callable[[TinderUser], None] = None):
+        """
+        Schedule a nope of the user, which is sent after the pacing delay
+
+        :param on_sent: Called with the user from the nope thread once the nope has been sent, to record it instead of
+            recording it in the ledger
+        """
+
+        self._raise_error()
+        self._forget_pending(user)
+        self._nopes.put((user, on_sent))
+
+    def skip(self, user: TinderUser):
+        """
+        Take no action on the user
+        """
+
+        self._forget_pending(user)
+
+    def take_pending_likes(self) -> List[TinderUser]:
+        """
+        Return parked users that can be liked again now, and that are not already being swiped
+        """
+
+        if not self.can_like() or not self.ledger.nr_pending_likes:
+            return []
+        users = []
+        with self._lock:
+            for user_dict in self.ledger.pending_likes(limit=self.MAX_PENDING_LIKES_PER_TAKE):
+                user = TinderUser(user_dict)
+                if user.id not in self._taken_user_ids:
+                    self._taken_user_ids.add(user.id)
+                    users.append(user)
+        return users
+
+    def flush(self):
+        """
+        Wait until all scheduled nopes are sent
+        """
+
+        self._nopes.join()
+        self._raise_error()
+
+    def close(self):
+        """
+        Send all scheduled nopes and stop the nope thread
+        """
+
+        self._nopes.put(_STOP)
+        self._nope_thread.join()
+        self._raise_error()
+
+    def _forget_pending(self, user: TinderUser):
+        with self._lock:
+            if user.id not in self._taken_user_ids:
+                return
+            self._taken_user_ids.discard(user.id)
+        self.ledger.remove_pending_like(user.id)
+
+    def _send_nopes(self):
+        while True:
+            item = self._nopes.get()
+            if item is _STOP:
+                self._nopes.task_done()
+                return
+            if self._error is not None:
+                # After an error, the remaining nopes are dropped
+                self._nopes.task_done()
+                continue
+
+            delay = self._next_nope_at - time.monotonic()
+            if delay > 0:
+                with Metrics.timer('nope_delay_seconds'):
+                    time.sleep(delay)
+            user, on_sent = item
+            try:
+                self.service.nope(user)
+                if on_sent is None:
+                    self.ledger.record(user.id, Status.noped)
+                else:
+                    on_sent(user)
+            except BaseException as e:
+                self._error = e
+            self._next_nope_at = time.monotonic() + random.uniform(*self.NOPE_DELAY)
+            self._nopes.task_done()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
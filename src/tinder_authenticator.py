@@ -1,9 +1,8 @@
 from typing import Dict
 
-import requests
-
-from secrets import TINDER_ACCESS_TOKEN, TINDER_PHONE_NUMBER, TINDER_REFRESH_TOKEN, TINDER_USER_ID, get_from_secrets, \
-    set_in_secrets
+from http_session import HttpSession, ensure_ok
+import secrets
+from secrets import TINDER_ACCESS_TOKEN, TINDER_PHONE_NUMBER, TINDER_REFRESH_TOKEN, TINDER_USER_ID, SecretsStore
 
 
 class TinderAuthenticator:
@@ -17,6 +16,9 @@ class TinderAuthenticator:
     headers = {'User-Agent': 'Tinder/11.4.0 (iPhone; iOS 12.4.1; Scale/2.00)',
                'content-type': 'application/json'}
 
+    def __init__(self, secrets_store: SecretsStore = None):
+        self.secrets = secrets_store or secrets.default_store
+
     def ensure_authentication(self):
         """
         Set Tinder user ID and auth tokens in secrets file
@@ -29,14 +31,13 @@ class TinderAuthenticator:
         # Set the user ID and access token at the start of the function.
         # If all goes well, they are set correctly at the end of this function.
         # If something unexpected happens, the user ID and access token that were present are unreliable.
-        set_in_secrets(TINDER_USER_ID, None)
-        set_in_secrets(TINDER_ACCESS_TOKEN, None)
+        self.secrets.update({TINDER_USER_ID: None, TINDER_ACCESS_TOKEN: None})
 
         # If there is a refresh token, assume it is valid.
         # If it turns out to be not valid (anymore), we discard it later and try again.
-        refresh_token = get_from_secrets(TINDER_REFRESH_TOKEN)
+        refresh_token = self.secrets.get(TINDER_REFRESH_TOKEN)
         if not refresh_token:
-            phone_number = get_from_secrets(TINDER_PHONE_NUMBER)
+            phone_number = self.secrets.get(TINDER_PHONE_NUMBER)
             # TODO(auth): This is not working anymore
             # self._send_otp_code(phone_number)
             otp_code = input('Please enter the code you have received by SMS: ')
@@ -46,12 +47,14 @@ class TinderAuthenticator:
         try:
             access_token = self._get_access_token(refresh_token)
         except PermissionError:
-            set_in_secrets(TINDER_REFRESH_TOKEN, None)
+            self.secrets.set(TINDER_REFRESH_TOKEN, None)
             return self.ensure_authentication()
 
-        set_in_secrets(TINDER_USER_ID, access_token['_id'])
-        set_in_secrets(TINDER_ACCESS_TOKEN, access_token['api_token'])
-        set_in_secrets(TINDER_REFRESH_TOKEN, access_token['refresh_token'])
+        self.secrets.update({
+            TINDER_USER_ID: access_token['_id'],
+            TINDER_ACCESS_TOKEN: access_token['api_token'],
+            TINDER_REFRESH_TOKEN: access_token['refresh_token'],
+        })
 
     def _send_otp_code(self, phone_number: str):
         """
@@ -62,10 +65,9 @@ class TinderAuthenticator:
 
         url = f'{self.base_url}/v2/auth/sms/send'
         # url = f'{self.base_url}/v3/auth/login'
-        response = requests.post(url, headers=self.headers, params={'auth_type': 'sms'},
-                                 json={'phone_number': phone_number})
-        assert response.ok, response.text
-        data = response.json()['data']
+        response = HttpSession.get().post(url, headers=self.headers, params={'auth_type': 'sms'},
+                                          json={'phone_number': phone_number})
+        data = ensure_ok(response).json()['data']
         # TODO(auth): This is not working anymore
         #             https://github.com/fbessez/Tinder/pull/117/files
         assert data['sms_sent'] is True, response.json()
@@ -80,10 +82,9 @@ class TinderAuthenticator:
         """
 
         url = f'{self.base_url}/v2/auth/sms/validate'
-        response = requests.post(url, headers=self.headers, params={'auth_type': 'sms'},
-                                 json={'otp_code': otp_code, 'phone_number': phone_number})
-        assert response.ok, response.text
-        data = response.json()['data']
+        response = HttpSession.get().post(url, headers=self.headers, params={'auth_type': 'sms'},
+                                          json={'otp_code': otp_code, 'phone_number': phone_number})
+        data = ensure_ok(response).json()['data']
         assert data['validated'] is True, response.json()
         return data['refresh_token']
 
@@ -104,11 +105,10 @@ class TinderAuthenticator:
         """
 
         url = f'{self.base_url}/v2/auth/login/sms'
-        response = requests.post(url, headers=self.headers, json={'refresh_token': refresh_token})
+        response = HttpSession.get().post(url, headers=self.headers, json={'refresh_token': refresh_token})
         if response.status_code in (401, 403):
             raise PermissionError()
-        assert response.ok, response.text
-        data = response.json()['data']
+        data = ensure_ok(response).json()['data']
         return data
 
 
@@ -16,14 +16,27 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import random
-import time
+import functools
+import itertools
+import os
+from typing import Iterable, Iterator, Optional, Tuple
 
 from ProfileJudge.profile_judge import ProfileJudge
+from ProfileJudge.word_judge import WordJudge
+import common
 from collage_creator import CollageCreator
+from collage_renderer import CollageRenderer
 from enums import Status, SwipeAction
 from logger import Logger
-from secrets import TINDER_USER_ID, get_from_secrets
+from metrics import Metrics
+from photo_cache import PhotoCache
+from pipeline import Pipeline, Stage
+from recommendation_buffer import RecommendationBuffer
+from secrets import TINDER_USER_ID
+from seen_profiles import SeenProfileIndex
+from swipe_history import SwipeHistory
+from swipe_ledger import SwipeLedger
+from swipe_scheduler import SwipeScheduler
 from tinder_service import TinderService
 from tinder_user import TinderUser
 
@@ -31,31 +44,64 @@ from tinder_user import TinderUser
 class TinderBot:
     MAX_NUMBER_OF_PHOTOS = 6
 
-    def __init__(self):
-        self.profile_judge = ProfileJudge()
-        self.service = TinderService()
-        self.user = self.service.get_user(get_from_secrets(TINDER_USER_ID))
-        Logger.log(f'TinderBot initialized for {self.user.name}. Liked today: {CollageCreator().nr_liked_today}.')
+    # Number of worker threads per pipeline stage. The swipe stage uses a single worker,
+    # such that users are swiped in the order in which Tinder recommended them.
+    JUDGE_CONCURRENCY = 1
+    DOWNLOAD_CONCURRENCY = 2
+    QUEUE_SIZE = 10  # Maximum number of users waiting in front of each stage
 
-    def run(self, nr_profiles: int = 10):
-        Logger.log('TinderBot is running')
+    def __init__(self, service: TinderService = None, ledger: SwipeLedger = None, img_dir: str = None,
+                 profile_judge: ProfileJudge = None, collage_renderer: CollageRenderer = None,
+                 seen_profiles: SeenProfileIndex = None, swipe_history: SwipeHistory = None):
+        """
+        By default, the bot uses the account in the secrets file and the project's data and img directories.
+        The judge and the renderer can be shared between bots of different accounts.
+        """
+
+        self.profile_judge = profile_judge or ProfileJudge()
+        self.service = service or TinderService()
+        self.collage_renderer = collage_renderer or CollageRenderer()
+        self.img_dir = img_dir
+        self.user = self.service.get_user(self.service.secrets.get(TINDER_USER_ID))
+        self.ledger = ledger or SwipeLedger()
+        self.ledger.import_img_dirs(img_dir)
+        self.swipe_scheduler = SwipeScheduler(self.service, self.ledger)
+        # An empty index or history is falsy, so compare with None
+        self.seen_profiles = seen_profiles if seen_profiles is not None else SeenProfileIndex()
+        self.swipe_history = swipe_history if swipe_history is not None else SwipeHistory()
+        Logger.log('TinderBot initialized for %s. Liked today: %d.', self.user.name, self.ledger.nr_liked_today)
 
-        nr_profiles_checked = 0
-        while True:
-            # The function get_recommendations returns ±10 profiles, determined by Tinder
-            # We therefore need to call this function multiple times if we want to run
-            # the bot on more profiles.
-            for user in self.service.get_recommendations():
-                if user is None:
-                    break
+    def run(self, nr_profiles: int = 10):
+        """
+        Judge and swipe the given number of recommended users
 
-                nr_profiles_checked += 1
-                Logger.log(f'{nr_profiles_checked}/{nr_profiles}', level=1)
+        The work is done in a pipeline of stages: fetch recommendations -> judge -> swipe -> download photos,
+        after which the collage is created in a separate process. A slow download or collage does therefore
+        not hold up the swiping of the next users, while bounded queues between the stages prevent fetching
+        many more recommendations than we can swipe. All pending collages are finished before returning.
+        Users that have been judged before under the same word lists are skipped.
+        """
 
-                self._like_or_nope(user)
+        Logger.log('TinderBot is running')
 
-                if nr_profiles_checked >= nr_profiles:
-                    return
+        pipeline = Pipeline([
+            Stage('judge', self._judge, concurrency=self.JUDGE_CONCURRENCY, queue_size=self.QUEUE_SIZE),
+            Stage('swipe', self._swipe, concurrency=1, queue_size=self.QUEUE_SIZE),
+            Stage('download', self._download, concurrency=self.DOWNLOAD_CONCURRENCY, queue_size=self.QUEUE_SIZE,
+                  ordered=False),
+        ])
+        recommendation_buffer = RecommendationBuffer(self.service)
+        try:
+            pipeline.run(self._get_users(itertools.islice(recommendation_buffer, nr_profiles), nr_profiles))
+        finally:
+            recommendation_buffer.close()
+            self.swipe_scheduler.flush()
+            self.collage_renderer.flush()
+            self.profile_judge.flush()
+            self.seen_profiles.flush()
+            self.swipe_history.flush()
+            photo_cache = PhotoCache.default()
+            Logger.log('Photo cache: %d hits, %d misses', photo_cache.hits, photo_cache.misses, level=1)
 
     def analyze_photo_success_rate(self):
         """
@@ -67,41 +113,99 @@ class TinderBot:
             url = photo.get('url')
             select_rate = photo.get('selectRate')
             success_rate = photo.get('successRate')
-            Logger.log(f'{url}: select rate = {select_rate}, success rate = {success_rate}', level=1)
+            Logger.log('%s: select rate = %s, success rate = %s', url, select_rate, success_rate, level=1)
 
-    def _like_or_nope(self, user: TinderUser) -> None:
+    def _get_users(self, recommendations: Iterable[TinderUser], nr_profiles: int) -> Iterator[Tuple[str, TinderUser]]:
+        """
+        Yield the recommended users with their progress, preceded by parked likes as soon as likes are available again
+
+        Users that Tinder recommends again, and that were judged under the current word lists, are skipped.
+        """
+
+        for nr_profiles_checked, user in enumerate(recommendations, start=1):
+            for pending_user in self.swipe_scheduler.take_pending_likes():
+                yield 'Retrying parked like', pending_user
+            seen_profile = self.seen_profiles.get(user.id)
+            # The word lists can be reloaded during a run, so the version is that of the judgement of this user
+            if seen_profile is not None and seen_profile.word_list_version == self.profile_judge.word_list_version:
+                Metrics.count('seen_profiles_skipped_total', action=seen_profile.action.value)
+                Logger.log('%d/%d: %s was already judged: %s', nr_profiles_checked, nr_profiles, user.name,
+                           seen_profile.action.value, level=2, user_id=user.id)
+                continue
+            yield f'{nr_profiles_checked}/{nr_profiles}', user
+
+    def _judge(self, item: Tuple[str, TinderUser]) -> Tuple[TinderUser, SwipeAction, str]:
+        progress, user = item
+        Logger.log(progress, level=1, user_id=user.id)
         action = self.profile_judge.like_or_nope(user)
+        return user, action, self.profile_judge.word_list_version
+
+    def _swipe(self, item: Tuple[TinderUser, SwipeAction, str]) -> Optional[Tuple[TinderUser, Status]]:
+        """
+        Send the swipe, and remember the user as seen once it has been sent
+
+        A like that is parked or fails is not remembered, such that the user is judged again when recommended again.
+        """
+
+        user, action, word_list_version = item
         if action == SwipeAction.like:
-            match = self.service.like(user)
+            match = self.swipe_scheduler.like(user)
+            if match is None:
+                # The like is parked until likes are available again, the collage is created then
+                return None
+            status = Status.matched if match else Status.liked
+            Metrics.count('swipes_total', action=action.value, status=status.value)
+            self.ledger.record(user.id, status)
+            self.swipe_history.record(user, status)
+            self.seen_profiles.add(user.id, action, word_list_version)
+            Logger.log('Liked today: %d', self.ledger.nr_liked_today, user_id=user.id, status=status.value)
             if match:
                 Logger.log("*** It's a match!! ***\n", level=1)
-                status = Status.matched
-            else:
-                status = Status.liked
-            self._create_photo_cards(user, status)
+            return user, status
         elif action == SwipeAction.nope:
-            self.service.nope(user)
-            # In order to not look like a bot, we wait a random time around 1 second
-            # For like this is not necessary, since we create a photo collage for them,
-            # which takes a similar amount of time
-            time.sleep(random.uniform(0.7, 1.2))
+            # The nope is sent by the scheduler after a human-like delay, while we continue with the next user
+            self.swipe_scheduler.nope(user, on_sent=functools.partial(self._on_nope_sent,
+                                                                      word_list_version=word_list_version))
+            Metrics.count('swipes_total', action=action.value, status=Status.noped.value)
         elif action == SwipeAction.no_action:
             # Explicitly do nothing
-            pass
+            self.swipe_scheduler.skip(user)
+            self.seen_profiles.add(user.id, action, word_list_version)
+            Metrics.count('swipes_total', action=action.value, status='none')
+        return None
+
+    def _on_nope_sent(self, user: TinderUser, word_list_version: str):
+        self.ledger.record(user.id, Status.noped)
+        self.swipe_history.record(user, Status.noped)
+        self.seen_profiles.add(user.id, SwipeAction.nope, word_list_version)
+
+    def _download(self, item: Tuple[TinderUser, Status]) -> None:
+        user, status = item
+        self._create_photo_cards(user, status)
 
     def _create_photo_cards(self, user: TinderUser, status: Status):
+        """
+        Download the photos of the user and hand them to the renderer, which creates the collage in the background
+        """
+
         collage_creator = CollageCreator()
-        for photo_index, photo in enumerate(user.d['photos']):
-            if photo_index < self.MAX_NUMBER_OF_PHOTOS:
-                collage_creator.download_img(url=photo['url'])
-        collage_creator.create_collage(user, status)
+        urls = [collage_creator.select_photo_url(photo) for photo in user.photos[:self.MAX_NUMBER_OF_PHOTOS]]
+        photos = collage_creator.download_photo_bytes(urls)
+        self.collage_renderer.submit(user, photos, status, self.img_dir)
 
 
 if __name__ == '__main__':
     Logger.max_level = 1
+    WordJudge.PERSIST_VERDICT_CACHE = True
+    Logger.add_file(os.path.join(common.get_dir('data'), 'tinder_bot.log'))
+    Metrics.enabled = True
+    metrics_file = os.path.join(common.get_dir('data'), 'metrics.json')
+    stop_metrics = Metrics.write_snapshots(metrics_file)
     tinder_bot = TinderBot()
     # tinder_bot.analyze_photo_success_rate()
     try:
         tinder_bot.run(nr_profiles=1000)
     finally:
-        Logger.log(f'TinderBot is finished. Liked today: {CollageCreator().nr_liked_today}.')
+        stop_metrics.set()
+        Metrics.write_snapshot(metrics_file)
+        Logger.log('TinderBot is finished. Liked today: %d.', tinder_bot.ledger.nr_liked_today)
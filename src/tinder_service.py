@@ -1,83 +1,115 @@
+import asyncio
+import re
 from datetime import datetime
-from typing import Any, Dict, Iterator, List
+from typing import Any, Dict, Iterator, List, Optional
 
-import requests
-
-from collage_creator import CollageCreator
 from common import OptionalJSON
+from http_session import AsyncHttpSession, BackgroundEventLoop, ensure_ok
 from logger import Logger
-from secrets import TINDER_ACCESS_TOKEN, TINDER_USER_ID, get_from_secrets
+from metrics import Metrics
+import secrets
+from secrets import TINDER_ACCESS_TOKEN, TINDER_USER_ID, SecretsStore, get_from_secrets
 from tinder_authenticator import TinderAuthenticator
 from tinder_user import TinderUser
 from type_hinting import TinderUserDict
 
 
 class OutOfLikes(Exception):
-    pass
+    def __init__(self, rate_limited_until: datetime):
+        super().__init__(f'Out of likes until {rate_limited_until:"%Y-%m-%d %H:%M:%S"}')
+        self.rate_limited_until = rate_limited_until
 
 
-class TinderService:
+class AsyncTinderService:
     """
-    Class responsible to make API calls to Tinder
+    Class responsible to make API calls to Tinder, using asyncio
+
+    Many calls can be in flight at the same time on one event loop, sharing one connection pool.
 
     Documented APIs: https://github.com/fbessez/Tinder
     """
 
     base_url = 'https://api.gotinder.com'
 
-    def __init__(self):
-        if not get_from_secrets(TINDER_ACCESS_TOKEN):
+    MAX_AUTH_ATTEMPTS = 2  # Number of times the tokens are refreshed when a call is not authorized
+
+    def __init__(self, secrets_store: SecretsStore = None, session: AsyncHttpSession = None):
+        """
+        :param secrets_store: Secrets of the account to use, by default the secrets file in the json directory
+        :param session: Session to share with other services, by default a session of this service only
+        """
+
+        self.secrets = secrets_store or secrets.default_store
+        self._owns_session = session is None
+        self._session = session or AsyncHttpSession()
+        self._auth_lock = None  # Created on first use, such that it is bound to the running event loop
+        self.likes_remaining: Optional[int] = None  # As reported by the last like, None if unknown
+        self.rate_limited_until: Optional[datetime] = None  # Until when likes are refused, None if they are not
+        if not self.secrets.get(TINDER_ACCESS_TOKEN):
             self._update_tinder_tokens()
 
+    async def __aenter__(self) -> 'AsyncTinderService':
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
     @property
     def headers(self) -> Dict[str, Any]:
         return {
             'app_version': '3',
             'platform': 'ios',
-            'X-Auth-Token': get_from_secrets(TINDER_ACCESS_TOKEN)
+            'X-Auth-Token': self.secrets.get(TINDER_ACCESS_TOKEN)
         }
 
-    def get_user(self, user_id: str) -> TinderUser:
-        user_dict: TinderUserDict = self._make_get_call(url=f'/user/{user_id}')['results']
+    async def get_user(self, user_id: str) -> TinderUser:
+        user_dict: TinderUserDict = (await self._make_get_call(url=f'/user/{user_id}'))['results']
         return TinderUser(user_dict)
 
-    def get_recommendations(self) -> Iterator[TinderUser]:
-        response = self._make_get_call(url='/user/recs', params={'count': 1})
+    async def get_recommendations(self, count: int = 1) -> List[TinderUser]:
+        """
+        Return a batch of recommended users
+
+        :param count: Number of users requested. Tinder may return fewer users than requested.
+        :return: List of users, empty if there are no more recommendations
+        """
+
+        response = await self._make_get_call(url='/user/recs', params={'count': count})
         if 'results' not in response:
-            msg = 'There are no more recommendations for you'
-            print(msg)
-            return
+            Logger.log('There are no more recommendations for you', level=1)
+            return []
         recommendations: List[TinderUserDict] = response['results']
-        for user_dict in recommendations:
-            yield TinderUser(user_dict)
+        return [TinderUser(user_dict) for user_dict in recommendations]
 
-    def like(self, user: TinderUser) -> bool:
+    async def like(self, user: TinderUser) -> bool:
         """
         Swipe a user to the right
 
         :param user: User to swipe
         :return: Flag indicating whether you have match
+        :raises OutOfLikes: when the like is refused, since there are no likes remaining
         """
 
-        response = self._make_get_call(url=f'/like/{user.id}')
-        likes_remaining = response['likes_remaining']
-        if likes_remaining == 0:
-            rate_limited_until = datetime.fromtimestamp(response['rate_limited_until'] / 1000)
-            raise OutOfLikes(f'Out of likes until {rate_limited_until:"%Y-%m-%d %H:%M:%S"}')
-        else:
-            Logger.log(f'Liked today: {CollageCreator().nr_liked_today + 1}. Likes remaining: {likes_remaining}')
+        response = await self._make_get_call(url=f'/like/{user.id}')
+        self.likes_remaining = response.get('likes_remaining', self.likes_remaining)
+        # The last like that is accepted already tells until when the next likes are refused
+        rate_limited_until = response.get('rate_limited_until')
+        self.rate_limited_until = datetime.fromtimestamp(rate_limited_until / 1000) if rate_limited_until else None
+        if 'match' not in response or response.get('status', 200) >= 400:
+            raise OutOfLikes(self.rate_limited_until or datetime.now())
+        Logger.log('Likes remaining: %d', self.likes_remaining, likes_remaining=self.likes_remaining)
         return response['match']
 
-    def nope(self, user: TinderUser):
+    async def nope(self, user: TinderUser):
         """
         Swipe a user to the left
 
         :param user: User to swipe
         """
 
-        return self._make_get_call(url=f'/pass/{user.id}')
+        return await self._make_get_call(url=f'/pass/{user.id}')
 
-    def send_message(self, user_id: str, message: str):
+    async def send_message(self, user_id: str, message: str):
         """
         Send a message to the given user
 
@@ -87,36 +119,147 @@ class TinderService:
                 contact the app or website owner.
         """
 
-        return self._make_post_call(url=f'/user/matches/{user_id}', body={'message': message})
+        return await self._make_post_call(url=f'/user/matches/{user_id}', body={'message': message})
+
+    async def close(self):
+        if self._owns_session:
+            await self._session.close()
 
     def _update_tinder_tokens(self):
-        TinderAuthenticator().ensure_authentication()
+        TinderAuthenticator(self.secrets).ensure_authentication()
 
-    def _make_get_call(self, url: str, params: Dict[str, Any] = None) -> OptionalJSON:
-        response = requests.get(self.base_url + url, headers=self.headers, params=params)
+    def _get_auth_lock(self) -> asyncio.Lock:
+        if self._auth_lock is None:
+            self._auth_lock = asyncio.Lock()
+        return self._auth_lock
 
-        if response.status_code in (401, 403):
-            # When we are not authorized, we refresh the tokens. In theory, this could lead to an
-            # infinite loop of the tokens remain invalid, but in practice this never happens, since
-            # user interaction is required to obtain the tokens.
-            self._update_tinder_tokens()
-            return self._make_get_call(url, params)
+    async def _get_access_token(self) -> str:
+        """
+        Return the access token, waiting for a refresh that is in progress
 
-        assert response.ok, response.text
-        return response.json()
+        While the tokens are refreshed, the access token in the secrets is None. Calls made meanwhile must not send it,
+        so they wait until the refresh has finished, or refresh the tokens themselves if no refresh is in progress.
+        """
 
-    def _make_post_call(self, url: str, params: Dict[str, Any] = None, body: Dict[str, Any] = None) -> OptionalJSON:
-        response = requests.get(self.base_url + url, headers=self.headers, params=params, json=body)
+        access_token = self.secrets.get(TINDER_ACCESS_TOKEN)
+        auth_lock = self._get_auth_lock()
+        if access_token and not auth_lock.locked():
+            return access_token
+        async with auth_lock:
+            if not self.secrets.get(TINDER_ACCESS_TOKEN):
+                await asyncio.get_running_loop().run_in_executor(None, self._update_tinder_tokens)
+            return self.secrets.get(TINDER_ACCESS_TOKEN)
 
-        if response.status_code in (401, 403):
-            # When we are not authorized, we refresh the tokens. In theory, this could lead to an
-            # infinite loop of the tokens remain invalid, but in practice this never happens, since
-            # user interaction is required to obtain the tokens.
-            self._update_tinder_tokens()
-            return self._make_post_call(url, params, body)
+    async def _refresh_tinder_tokens(self, rejected_token: str):
+        """
+        Refresh the tokens in a worker thread, unless another call already did so after our token was rejected
+        """
+
+        async with self._get_auth_lock():
+            if self.secrets.get(TINDER_ACCESS_TOKEN) in (rejected_token, None):
+                await asyncio.get_running_loop().run_in_executor(None, self._update_tinder_tokens)
+
+    async def _make_get_call(self, url: str, params: Dict[str, Any] = None) -> OptionalJSON:
+        return await self._make_call('GET', url, params=params)
+
+    async def _make_post_call(self, url: str, params: Dict[str, Any] = None,
+                              body: Dict[str, Any] = None) -> OptionalJSON:
+        return await self._make_call('POST', url, params=params, body=body)
+
+    async def _make_call(self, method: str, url: str, params: Dict[str, Any] = None,
+                         body: Dict[str, Any] = None) -> OptionalJSON:
+        endpoint = self._get_endpoint(url)
+        with Metrics.timer('tinder_api_seconds', endpoint=endpoint):
+            for attempt in range(self.MAX_AUTH_ATTEMPTS + 1):
+                access_token = await self._get_access_token()
+                headers = {**self.headers, 'X-Auth-Token': access_token}
+                response = await self._session.request(method, self.base_url + url, headers=headers,
+                                                       params=params, json=body)
+                if response.status_code not in (401, 403) or attempt == self.MAX_AUTH_ATTEMPTS:
+                    break
+                # When we are not authorized, we refresh the tokens and try again. If the tokens remain
+                # invalid after a limited number of refreshes, we give up and raise the error below.
+                Logger.log('Not authorized (%d) for %s, refreshing tokens', response.status_code, url, level=1)
+                Metrics.count('tinder_token_refreshes_total')
+                await self._refresh_tinder_tokens(access_token)
+
+        Metrics.count('tinder_api_calls_total', endpoint=endpoint, status=response.status_code)
+        return ensure_ok(response).json()
+
+    @staticmethod
+    def _get_endpoint(url: str) -> str:
+        """
+        Return the url with the user id replaced, e.g. /like/{id}, such that calls can be grouped per endpoint
+        """
+
+        return re.sub(r'^(/.+)/(?!recs$)[^/]+$', r'\1/{id}', url)
+
+
+class TinderService:
+    """
+    Class responsible to make API calls to Tinder
+
+    Synchronous wrapper around AsyncTinderService. The calls run on a shared background event loop, so several
+    threads can use this class at the same time, sharing one connection pool.
+
+    Documented APIs: https://github.com/fbessez/Tinder
+    """
+
+    def __init__(self, secrets_store: SecretsStore = None, session: AsyncHttpSession = None):
+        self._loop = BackgroundEventLoop.get()
+        self.async_service = AsyncTinderService(secrets_store, session)
+
+    @property
+    def secrets(self) -> SecretsStore:
+        return self.async_service.secrets
+
+    @property
+    def headers(self) -> Dict[str, Any]:
+        return self.async_service.headers
+
+    @property
+    def likes_remaining(self) -> Optional[int]:
+        return self.async_service.likes_remaining
+
+    @property
+    def rate_limited_until(self) -> Optional[datetime]:
+        return self.async_service.rate_limited_until
+
+    def get_user(self, user_id: str) -> TinderUser:
+        return self._loop.run(self.async_service.get_user(user_id))
+
+    def get_recommendations(self, count: int = 1) -> Iterator[TinderUser]:
+        yield from self._loop.run(self.async_service.get_recommendations(count))
+
+    def like(self, user: TinderUser) -> bool:
+        """
+        Swipe a user to the right
+
+        :param user: User to swipe
+        :return: Flag indicating whether you have match
+        :raises OutOfLikes: when the like is refused, since there are no likes remaining
+        """
+
+        return self._loop.run(self.async_service.like(user))
+
+    def nope(self, user: TinderUser):
+        """
+        Swipe a user to the left
+
+        :param user: User to swipe
+        """
+
+        return self._loop.run(self.async_service.nope(user))
+
+    def send_message(self, user_id: str, message: str):
+        """
+        Send a message to the given user
+        """
+
+        return self._loop.run(self.async_service.send_message(user_id, message))
 
-        assert response.ok, response.text
-        return response.json()
+    def close(self):
+        self._loop.run(self.async_service.close())
 
 
 if __name__ == '__main__':
@@ -17,44 +17,65 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 from collections import OrderedDict
 from datetime import datetime
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional
 
-from type_hinting import TinderUserDict
+from type_hinting import PhotoDict, SchoolDict, TinderUserDict
 
 
 class TinderUser:
     """
     Representation of a Tinder User
+
+    All fields are parsed once, when the user is created. The raw dictionary is kept in `d`,
+    unless it is dropped with drop_raw() to save memory, for example during bulk analysis.
     """
 
+    __slots__ = ('_d', 'id', 'name', 'bio', 'age', 'jobs', 'schools', 'school_names', 'common_friends', 'distance',
+                 'photos')
+
     def __init__(self, data_dict: TinderUserDict):
-        self.d = data_dict
+        self._d: Optional[TinderUserDict] = data_dict
+        self.id: str = data_dict.get('_id')
+        self.name: str = data_dict.get('name')
+        self.bio: str = self._parse_bio(data_dict)
+        self.age: int = self._parse_age(data_dict)
+        self.jobs: List[str] = self._parse_jobs(data_dict)
+        self.schools: List[SchoolDict] = data_dict.get('schools') or list()
+        self.school_names: List[str] = [school.get('name') for school in self.schools if school.get('name')]
+        self.common_friends: List[str] = self._parse_common_friends(data_dict)
+        self.distance: int = self._parse_distance(data_dict)
+        self.photos: List[PhotoDict] = data_dict.get('photos') or list()
 
     @property
-    def id(self) -> str:
-        return self.d['_id']
+    def d(self) -> TinderUserDict:
+        """
+        Return the raw dictionary representation of the user, as returned by Tinder
+        """
 
-    @property
-    def bio(self) -> str:
+        if self._d is None:
+            raise AttributeError(f'The raw data of user {self.id} has been dropped')
+        return self._d
+
+    def drop_raw(self):
         """
-        Return a representation of the user's bio
+        Forget the raw dictionary representation of the user, keeping only the parsed fields
         """
 
-        bio = self.d.get('bio')
-        if bio:
-            bio = bio.replace('\n', '. ')
-        return bio
+        self._d = None
 
-    @property
-    def name(self) -> str:
+    @staticmethod
+    def _parse_bio(data_dict: TinderUserDict) -> str:
         """
-        Return the user name
+        Return a representation of the user's bio
         """
 
-        return self.d.get('name')
+        bio = data_dict.get('bio')
+        if bio:
+            bio = bio.replace('\n', '. ')
+        return bio
 
-    @property
-    def age(self) -> int:
+    @staticmethod
+    def _parse_age(data_dict: TinderUserDict) -> int:
         """
         Return the user age in years
 
@@ -63,7 +84,7 @@ class TinderUser:
         In practice, this means that the birthday is not precise, they are all on the same day.
         """
 
-        raw = self.d.get('birth_date')
+        raw = data_dict.get('birth_date')
         if raw:
             birth_date = datetime.strptime(raw, '%Y-%m-%dT%H:%M:%S.%fZ')
             now = datetime.now()
@@ -72,64 +93,41 @@ class TinderUser:
 
         return 0
 
-    @property
-    def jobs(self) -> [str]:
+    @staticmethod
+    def _parse_jobs(data_dict: TinderUserDict) -> List[str]:
         """
         Return a list of jobs. Format per element: "title - company"
         """
 
         jobs = list()
-        if 'jobs' in self.d:
-            for job in self.d.get('jobs'):
-                this_job = list()
-                if 'title' in job and 'name' in job['title']:
-                    this_job.append(job['title']['name'])
-                if 'company' in job and 'name' in job['company']:
-                    this_job.append(job['company']['name'])
-                if len(this_job) > 0:
-                    this_job_string = ' - '.join(this_job)
-                    jobs.append(this_job_string)
+        for job in data_dict.get('jobs') or list():
+            this_job = list()
+            if 'title' in job and 'name' in job['title']:
+                this_job.append(job['title']['name'])
+            if 'company' in job and 'name' in job['company']:
+                this_job.append(job['company']['name'])
+            if len(this_job) > 0:
+                this_job_string = ' - '.join(this_job)
+                jobs.append(this_job_string)
         return jobs
 
-    @property
-    def schools(self) -> [dict]:
-        """
-        Return a list of schools. Each school is a dictionary with id and name
-        """
-
-        if 'schools' in self.d:
-            return self.d.get('schools')
-        else:
-            return list()
-
-    @property
-    def school_names(self) -> [str]:
-        """
-        Return a list of school names
-        """
-
-        return [school.get('name') for school in self.schools if school.get('name')]
-
-    @property
-    def common_friends(self) -> [str]:
+    @staticmethod
+    def _parse_common_friends(data_dict: TinderUserDict) -> List[str]:
         """
         Return a list of common friends. Format per element: "name"
         """
 
-        common_friends = list()
-        for friend in common_friends:
-            print(friend)
-            common_friends.append(friend['name'])
-        return common_friends
+        return [friend['name'] for friend in data_dict.get('common_friends') or list()
+                if isinstance(friend, dict) and friend.get('name')]
 
-    @property
-    def distance(self) -> int:
+    @staticmethod
+    def _parse_distance(data_dict: TinderUserDict) -> int:
         """
         Return the distance in km. Format: integer
         """
 
         try:
-            return int(round(self.d['distance_mi'] * 1.609))
+            return int(round(data_dict['distance_mi'] * 1.609))
         except (KeyError, TypeError):
             return 0
 
@@ -155,11 +153,7 @@ class TinderUser:
         txt_lines = [f'{key}: {value}' for key, value in txt_elements.items()]
         return '\n'.join(txt_lines)
 
-    @property
-    def photos(self):
-        return self.d['photos']
-
-    def as_dict(self):
+    def as_dict(self) -> Dict[str, Any]:
         """
         Return a dictionary representation of the current object, removing keys with empty values
         """
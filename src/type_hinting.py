@@ -20,7 +20,7 @@ TinderUserDict = Dict[str, Any]  # Dictionary representation of a Tinder User
 #                     {'height': 106,'width': 84,
 #                      'url': 'https://images-ssl.gotinder.com/<user_id>/84x106_<uuid>.jpg',}],
 #  'url': 'https://images-ssl.gotinder.com/<user_id>/original_<uuid>.jpeg'}
-PhotoDict = Dict[str, str]
+PhotoDict = Dict[str, Any]
 
 # {
 #     'id': 131231,  # Ignored in this code
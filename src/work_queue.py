@@ -0,0 +1,242 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional
+
+import common
+
+Payload = Dict[str, Any]  # JSON serializable content of a job
+
+
+class Job:
+    """
+    Unit of work taken from a WorkQueue by a worker
+
+    The job is leased to the worker until lease_until. If the worker does not acknowledge the job before then,
+    for example because it died, the job is handed out to another worker again.
+    """
+
+    def __init__(self, job_id: int, topic: str, payload: Payload, attempts: int, lease_until: float):
+        self.id = job_id
+        self.topic = topic
+        self.payload = payload
+        self.attempts = attempts  # Number of times the job has been leased, including this time
+        self.lease_until = lease_until
+
+    def __repr__(self) -> str:
+        return f'Job({self.id}, {self.topic!r}, attempt {self.attempts})'
+
+
+class WorkQueue(ABC):
+    """
+    Queue of jobs per topic, with leases, acknowledgements and retries
+
+    - A published job is leased to one worker at a time.
+    - A job whose lease expires is leased again, such that the work of a worker that died is retried.
+    - A job that failed too many times is not handed out anymore.
+    - Publishing a job with the key of a job that is already in the queue does nothing, such that the same
+      profile is never queued twice.
+    """
+
+    # States of a job
+    READY = 'ready'
+    LEASED = 'leased'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    LEASE_SECONDS = 60  # Number of seconds a worker has to finish a job
+    MAX_ATTEMPTS = 5  # Number of times a job is leased before it is given up
+    RETRY_DELAY = 5  # Number of seconds after which a failed job is handed out again
+
+    @abstractmethod
+    def publish(self, topic: str, payload: Payload, key: str = None) -> bool:
+        """
+        Add a job to the queue, and return whether it was added, i.e. there was no job with the same key yet
+        """
+
+    @abstractmethod
+    def lease(self, topics: List[str], worker_id: str) -> Optional[Job]:
+        """
+        Return the oldest available job of the given topics, leased to the given worker, or None if there is none
+        """
+
+    @abstractmethod
+    def ack(self, job: Job):
+        """
+        Mark the job as done
+
+        If the lease of the job expired and the job was leased again in the meantime, this does nothing.
+        """
+
+    @abstractmethod
+    def nack(self, job: Job, error: str = None):
+        """
+        Release the job after it failed, such that it is retried after the retry delay
+        """
+
+    @abstractmethod
+    def nr_jobs(self, topic: str = None, state: str = None) -> int:
+        pass
+
+
+class SqliteWorkQueue(WorkQueue):
+    """
+    WorkQueue in an SQLite database, shared by all processes that open the same file
+
+    Leases are taken in an immediate transaction, such that two workers never lease the same job. Since SQLite locks
+    do not work reliably on network file systems, workers on other machines need another WorkQueue implementation.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or os.path.join(common.get_dir('data'), 'work_queue.sqlite3')
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY,
+                topic TEXT NOT NULL,
+                key TEXT,
+                payload TEXT NOT NULL,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                available_at REAL NOT NULL,
+                leased_by TEXT,
+                lease_until REAL,
+                error TEXT,
+                UNIQUE (topic, key)
+            );
+            CREATE INDEX IF NOT EXISTS jobs_topic_state_available_at ON jobs (topic, state, available_at);
+        ''')
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def publish(self, topic: str, payload: Payload, key: str = None) -> bool:
+        with self._lock:
+            cursor = self._connection.execute(
+                'INSERT OR IGNORE INTO jobs (topic, key, payload, state, available_at) VALUES (?, ?, ?, ?, ?)',
+                (topic, key, json.dumps(payload), self.READY, time.time()))
+            return cursor.rowcount == 1
+
+    def lease(self, topics: List[str], worker_id: str) -> Optional[Job]:
+        now = time.time()
+        placeholders = ', '.join('?' * len(topics))
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                # Jobs of which the lease expired are handed out again, or given up after too many attempts
+                self._connection.execute(
+                    f'UPDATE jobs SET state = ?, error = ? WHERE topic IN ({placeholders}) AND state = ? '
+                    f'AND lease_until < ? AND attempts >= ?',
+                    (self.FAILED, 'Lease expired', *topics, self.LEASED, now, self.MAX_ATTEMPTS))
+                row = self._connection.execute(
+                    f'SELECT id, topic, payload, attempts FROM jobs WHERE topic IN ({placeholders}) '
+                    f'AND ((state = ? AND available_at <= ?) OR (state = ? AND lease_until < ?)) ORDER BY id LIMIT 1',
+                    (*topics, self.READY, now, self.LEASED, now)).fetchone()
+                if row is None:
+                    self._connection.execute('COMMIT')
+                    return None
+                job_id, topic, payload, attempts = row
+                lease_until = now + self.LEASE_SECONDS
+                self._connection.execute(
+                    'UPDATE jobs SET state = ?, attempts = ?, leased_by = ?, lease_until = ? WHERE id = ?',
+                    (self.LEASED, attempts + 1, worker_id, lease_until, job_id))
+                self._connection.execute('COMMIT')
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+        return Job(job_id, topic, json.loads(payload), attempts + 1, lease_until)
+
+    def ack(self, job: Job):
+        with self._lock:
+            self._connection.execute('UPDATE jobs SET state = ?, lease_until = NULL WHERE id = ? AND attempts = ?',
+                                     (self.DONE, job.id, job.attempts))
+
+    def nack(self, job: Job, error: str = None):
+        state = self.FAILED if job.attempts >= self.MAX_ATTEMPTS else self.READY
+        with self._lock:
+            self._connection.execute(
+                'UPDATE jobs SET state = ?, available_at = ?, lease_until = NULL, error = ? '
+                'WHERE id = ? AND attempts = ?',
+                (state, time.time() + self.RETRY_DELAY, error, job.id, job.attempts))
+
+    def nr_jobs(self, topic: str = None, state: str = None) -> int:
+        query = 'SELECT COUNT(*) FROM jobs WHERE 1 = 1'
+        params = []
+        if topic is not None:
+            query += ' AND topic = ?'
+            params.append(topic)
+        if state is not None:
+            query += ' AND state = ?'
+            params.append(state)
+        with self._lock:
+            return self._connection.execute(query, params).fetchone()[0]
+
+
+class MemoryWorkQueue(WorkQueue):
+    """
+    WorkQueue in memory, with the same behaviour as SqliteWorkQueue, for running all workers in one process
+    """
+
+    def __init__(self):
+        self._jobs: Dict[int, Dict[str, Any]] = dict()
+        self._keys = set()
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def publish(self, topic: str, payload: Payload, key: str = None) -> bool:
+        with self._lock:
+            if key is not None:
+                if (topic, key) in self._keys:
+                    return False
+                self._keys.add((topic, key))
+            # Store a copy, like the SQLite queue does, such that publisher and worker never share objects
+            self._jobs[self._next_id] = {'topic': topic, 'payload': json.dumps(payload),
+                                         'state': self.READY, 'attempts': 0,
+                                         'available_at': time.time(), 'lease_until': None}
+            self._next_id += 1
+            return True
+
+    def lease(self, topics: List[str], worker_id: str) -> Optional[Job]:
+        now = time.time()
+        with self._lock:
+            for job_id, job in self._jobs.items():
+                if job['topic'] not in topics:
+                    continue
+                is_ready = job['state'] == self.READY and job['available_at'] <= now
+                is_expired = job['state'] == self.LEASED and job['lease_until'] < now
+                if is_expired and job['attempts'] >= self.MAX_ATTEMPTS:
+                    job['state'] = self.FAILED
+                elif is_ready or is_expired:
+                    job['state'] = self.LEASED
+                    job['attempts'] += 1
+                    job['lease_until'] = now + self.LEASE_SECONDS
+                    return Job(job_id, job['topic'], json.loads(job['payload']), job['attempts'],
+                               job['lease_until'])
+        return None
+
+    def ack(self, job: Job):
+        with self._lock:
+            stored_job = self._jobs[job.id]
+            if stored_job['attempts'] == job.attempts:
+                stored_job['state'] = self.DONE
+
+    def nack(self, job: Job, error: str = None):
+        with self._lock:
+            stored_job = self._jobs[job.id]
+            if stored_job['attempts'] != job.attempts:
+                return
+            stored_job['state'] = self.FAILED if job.attempts >= self.MAX_ATTEMPTS else self.READY
+            stored_job['available_at'] = time.time() + self.RETRY_DELAY
+            stored_job['lease_until'] = None
+
+    def nr_jobs(self, topic: str = None, state: str = None) -> int:
+        with self._lock:
+            return sum(1 for job in self._jobs.values()
+                       if (topic is None or job['topic'] == topic) and (state is None or job['state'] == state))
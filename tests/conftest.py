@@ -0,0 +1,20 @@
+"""
+Let the tests import the modules in src, and let the bot write all data to a temporary directory
+
+The directory is set before any module of the bot is imported, since some judges resolve their files on import.
+"""
+
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+SRC_DIR = os.path.join(os.path.dirname(__file__), '..', 'src')
+sys.path.insert(0, os.path.abspath(SRC_DIR))
+
+import common  # noqa: E402
+
+DATA_DIR = tempfile.mkdtemp(prefix='patinderbot_tests_')
+os.environ[common.PROJECT_DIR_VARIABLE] = DATA_DIR
+atexit.register(shutil.rmtree, DATA_DIR, ignore_errors=True)
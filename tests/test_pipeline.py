@@ -0,0 +1,108 @@
+import random
+import threading
+import time
+
+import pytest
+
+from pipeline import Pipeline, Stage
+
+
+def _collect(results: list):
+    lock = threading.Lock()
+
+    def collect(item):
+        with lock:
+            results.append(item)
+
+    return collect
+
+
+def _sleep_randomly(seed: int):
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    def sleep(item):
+        with lock:
+            seconds = rng.uniform(0, 0.005)
+        time.sleep(seconds)
+        return item
+
+    return sleep
+
+
+def test_ordered_stage_keeps_the_order_of_the_source():
+    results = []
+    Pipeline([
+        Stage('sleep', _sleep_randomly(seed=0), concurrency=8, queue_size=4),
+        Stage('square', lambda item: item * item, concurrency=3, queue_size=2),
+        Stage('collect', _collect(results)),
+    ]).run(range(200))
+
+    assert results == [item * item for item in range(200)]
+
+
+def test_unordered_stage_passes_on_all_items():
+    results = []
+    Pipeline([
+        Stage('sleep', _sleep_randomly(seed=1), concurrency=8, ordered=False),
+        Stage('collect', _collect(results)),
+    ]).run(range(200))
+
+    assert sorted(results) == list(range(200))
+
+
+def test_items_for_which_a_stage_returns_none_are_dropped():
+    results = []
+    Pipeline([
+        Stage('odd', lambda item: item if item % 2 else None, concurrency=4),
+        Stage('collect', _collect(results)),
+    ]).run(range(100))
+
+    assert results == list(range(1, 100, 2))
+
+
+def test_error_in_a_stage_stops_the_source_and_is_raised():
+    nr_read = 0
+    results = []
+
+    def source():
+        nonlocal nr_read
+        for item in range(10000):
+            nr_read += 1
+            yield item
+
+    def fail_on_ten(item):
+        if item == 10:
+            raise ValueError(item)
+        return item
+
+    stages = [
+        Stage('fail', fail_on_ten, queue_size=2),
+        Stage('collect', _collect(results), queue_size=2),
+    ]
+    with pytest.raises(ValueError):
+        Pipeline(stages).run(source())
+
+    assert nr_read < 100
+    # The items that passed the failing stage before the error are still handled by the stages after it
+    assert results[:10] == list(range(10))
+    assert 10 not in results
+    assert not any(worker.is_alive() for stage in stages for worker in stage._workers)
+
+
+def test_error_in_the_source_is_raised_after_the_items_it_produced_are_handled():
+    results = []
+
+    def source():
+        yield from range(20)
+        raise KeyError('source')
+
+    stages = [
+        Stage('sleep', _sleep_randomly(seed=2), concurrency=4),
+        Stage('collect', _collect(results)),
+    ]
+    with pytest.raises(KeyError):
+        Pipeline(stages).run(source())
+
+    assert results == list(range(20))
+    assert not any(worker.is_alive() for stage in stages for worker in stage._workers)
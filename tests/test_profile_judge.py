@@ -0,0 +1,49 @@
+import json
+import os
+
+import pytest
+
+import common
+from ProfileJudge.profile_judge import ProfileJudge
+from fake_tinder_server import FakeProfileGenerator
+from tinder_user import TinderUser
+
+WORD_LISTS = {
+    'name_approve_words.json': ['anna', 'julia'],
+    'name_reject_words.json': ['emma', 'lisa'],
+    'school_approve_words.json': ['vrije', 'delft'],
+    'school_reject_words.json': ['hogeschool', 'mbo', 'pabo', 'amsterdam', 'utrecht', 'van'],
+}
+
+
+@pytest.fixture(scope='module')
+def users():
+    for filename, words in WORD_LISTS.items():
+        with open(os.path.join(common.get_dir('json'), filename), 'w') as f:
+            json.dump(words, f)
+    generator = FakeProfileGenerator('http://localhost/images', seed=0)
+    return [TinderUser(generator.generate()) for _ in range(500)]
+
+
+def test_judge_many_decides_like_like_or_nope(users):
+    actions = [ProfileJudge().like_or_nope(user) for user in users]
+    results = ProfileJudge().judge_many(users)
+
+    assert [action for action, _ in results] == actions
+    # The users are decided by all checks, not only by name
+    assert len({reason for _, reason in results}) >= 6
+
+
+def test_judge_many_gives_the_reason_of_like_or_nope(users):
+    judge = ProfileJudge()
+    results = judge.judge_many(users)
+
+    reasons = []
+    judge._action = lambda action, reason: reasons.append(reason) or action
+    for user in users:
+        judge.like_or_nope(user)
+    assert [reason for _, reason in results] == reasons
+
+
+def test_judge_many_without_users():
+    assert ProfileJudge().judge_many([]) == []
@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from enums import Status, SwipeAction
+from swipe_ledger import SubmissionClaimed, SwipeLedger
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    ledger = SwipeLedger(str(tmp_path / 'swipe_ledger.sqlite3'))
+    yield ledger
+    ledger.close()
+
+
+def _lease(seconds: float = 60) -> datetime:
+    return datetime.now() + timedelta(seconds=seconds)
+
+
+def test_completed_submission_is_recorded_once_and_not_claimed_again(ledger):
+    ledger.park_like('user', {'_id': 'user', 'name': 'Anna'})
+
+    assert ledger.claim_submission('user', SwipeAction.like, 'worker-1', _lease())
+    assert ledger.complete_submission('user', 'worker-1', Status.liked)
+
+    assert ledger.last_status('user') == Status.liked
+    assert [user_id for user_id, _, _ in ledger.swipes()] == ['user']
+    assert ledger.nr_pending_likes == 0
+    assert not ledger.claim_submission('user', SwipeAction.like, 'worker-2', _lease())
+    assert not ledger.complete_submission('user', 'worker-1', Status.liked)
+    assert len(ledger.swipes()) == 1
+
+
+def test_claim_of_another_worker_is_respected_until_its_lease_expires(ledger):
+    assert ledger.claim_submission('user', SwipeAction.nope, 'worker-1', _lease(-1))
+    assert ledger.claim_submission('user', SwipeAction.nope, 'worker-2', _lease())
+
+    with pytest.raises(SubmissionClaimed) as error:
+        ledger.claim_submission('user', SwipeAction.nope, 'worker-1', _lease())
+    assert error.value.worker_id == 'worker-2'
+
+    # The worker that lost its claim does not record the swipe, the worker that holds the claim does
+    assert not ledger.complete_submission('user', 'worker-1', Status.noped)
+    assert ledger.complete_submission('user', 'worker-2', Status.noped)
+    assert len(ledger.swipes()) == 1
+
+
+def test_worker_can_claim_its_own_submission_again(ledger):
+    assert ledger.claim_submission('user', SwipeAction.like, 'worker-1', _lease())
+    assert ledger.claim_submission('user', SwipeAction.like, 'worker-1', _lease())
+
+
+def test_released_submission_can_be_claimed_by_another_worker(ledger):
+    assert ledger.claim_submission('user', SwipeAction.like, 'worker-1', _lease())
+
+    ledger.release_submission('user', 'worker-2')
+    with pytest.raises(SubmissionClaimed):
+        ledger.claim_submission('user', SwipeAction.like, 'worker-2', _lease())
+
+    ledger.release_submission('user', 'worker-1')
+    assert ledger.claim_submission('user', SwipeAction.like, 'worker-2', _lease())
+    assert not ledger.complete_submission('user', 'worker-1', Status.liked)
+    assert ledger.swipes() == []
@@ -0,0 +1,65 @@
+import random
+import string
+from typing import List, Set, Tuple
+
+import pytest
+
+from ProfileJudge.vote import Vote
+from ProfileJudge.word_matcher import WordMatcher
+
+VOCABULARY = ['universiteit', 'van', 'amsterdam', 'vrije', 'hogeschool', 'utrecht', 'leiden', 'mbo', 'pabo', 'hbo',
+              'college', 'school', 'of', 'economics', 'tu', 'delft', 'anna', 'emma', 'julia', '2010']
+APPROVE_WORDS = ['vrije', 'delft', 'anna']
+REJECT_WORDS = ['mbo', 'pabo', 'van', 'amsterdam', 'school', 'of', 'emma', '2010']
+
+
+def judge_by_words_before_word_matcher(name: str, approve_words: Set[str],
+                                       reject_words: Set[str]) -> Tuple[Vote, List[str]]:
+    """
+    The word matching of WordJudge.judge_by_words before the WordMatcher, returning the vote and the review words
+    """
+
+    clean_name = name.lower()
+    clean_name = ''.join(letter for letter in clean_name if letter in string.ascii_lowercase + string.digits + ' ')
+    words = clean_name.split(' ')
+    if any(word in approve_words for word in words):
+        return Vote.approve, []
+    elif all(word in reject_words for word in words):
+        return Vote.reject, []
+    else:
+        return Vote.review, [word for word in words if word not in reject_words]
+
+
+def _random_name(rng: random.Random) -> str:
+    words = [rng.choice(VOCABULARY + [''.join(rng.choices(string.ascii_lowercase, k=5))])
+             for _ in range(rng.randint(1, 4))]
+    words = [word.capitalize() if rng.random() < 0.5 else word for word in words]
+    separators = [rng.choice([' ', ' ', ' ', ', ', ' - ', '  ', '. ']) for _ in words[1:]]
+    name = words[0] + ''.join(separator + word for separator, word in zip(separators, words[1:]))
+    return name + rng.choice(['', '', '.', ' (NL)', '!'])
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_matches_like_the_word_matching_it_replaced(seed):
+    rng = random.Random(seed)
+    matcher = WordMatcher(APPROVE_WORDS, REJECT_WORDS)
+    for _ in range(500):
+        name = _random_name(rng)
+        assert matcher.match(name) == judge_by_words_before_word_matcher(name, set(APPROVE_WORDS),
+                                                                         set(REJECT_WORDS)), name
+
+
+def test_accents_are_folded():
+    matcher = WordMatcher(['universite'], ['ecole'])
+
+    assert matcher.match('Université Paris')[0] == Vote.approve
+    assert matcher.match('École')[0] == Vote.reject
+
+
+def test_phrases_match_consecutive_words():
+    matcher = WordMatcher(['vrije universiteit'], ['hogeschool', 'van amsterdam'])
+
+    assert matcher.match('Vrije Universiteit Amsterdam') == (Vote.approve, [])
+    assert matcher.match('Universiteit Vrije') == (Vote.review, ['universiteit', 'vrije'])
+    assert matcher.match('Hogeschool van Amsterdam') == (Vote.reject, [])
+    assert matcher.match('Hogeschool Amsterdam') == (Vote.review, ['amsterdam'])